@@ -5,45 +5,191 @@ from langchain.chat_models import ChatOpenAI
 from langchain.agents import AgentExecutor
 from langchain.agents.agent_types import AgentType
 from langchain.callbacks import get_openai_callback
-from database import listar_tabelas, obter_schema, executar_query
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.prompts.base import StringPromptValue
+from database import (obter_catalogo, executar_query, agregar_por_periodo, agregar_por_categoria,
+                      ConsultaInterrompida, LIMITE_LINHAS_PADRAO, PONTOS_ALVO_GRAFICO)
+from protecao_sql import proteger_sql
+from cache_perguntas import obter_cache_perguntas
+from cache_previsoes import chave_previsao, obter_cache_previsoes
+from previsao import (CONFIG_PROPHET, CONFIG_RAPIDO, HORIZONTE_MESES, MODELO_PREVISAO_PADRAO, ajustar_modelo_prophet,
+                      ajustar_rapido, datas_futuras, escolher_modelo, parametros_prophet, prever_series)
+from graficos import html_figura, reduzir_serie, top_n_com_outros
+from perfil import colunas_por_papel, descrever_perfil, papeis_resultado
+from rastreamento import etapa, obter_rastreador, rastro_atual
+from series_previsao import obter_series
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from prophet import Prophet
-from sklearn.linear_model import LinearRegression
 import numpy as np
-from datetime import datetime, timedelta
+import threading
+import asyncio
+import contextvars
+import re
+from contextlib import contextmanager
+
+def _normalizar_sql(sql):
+    return re.sub(r'\s+', ' ', sql or '').strip().rstrip(';').strip().lower()
+
+def _retorna_linhas(sql):
+    return re.match(r'\s*(select|with)\b', sql, re.IGNORECASE) is not None
+
+class PerguntaCancelada(ConsultaInterrompida):
+    """Pergunta cancelada (ou acima do prazo) entre dois passos do agente ReAct"""
+
+# Evento conferido pelo agente ReAct antes de cada passo; acompanha as threads (`asyncio.to_thread`)
+_parada_pergunta = contextvars.ContextVar('parada_pergunta', default=None)
+
+@contextmanager
+def parada_da_pergunta(evento):
+    """Interrompe o agente ReAct do bloco antes do próximo passo quando `evento` for sinalizado"""
+    token = _parada_pergunta.set(evento)
+    try:
+        yield
+    finally:
+        _parada_pergunta.reset(token)
+
+class ExecutorCancelavel(AgentExecutor):
+    """AgentExecutor que para entre os passos quando a pergunta é cancelada (`parada_da_pergunta`).
+
+    A chamada ao LLM ou a ferramenta em andamento termina; o passo seguinte não começa.
+    """
+
+    def _should_continue(self, iterations, time_elapsed):
+        evento = _parada_pergunta.get()
+        if evento is not None and evento.is_set():
+            raise PerguntaCancelada("Pergunta cancelada")
+        return super()._should_continue(iterations, time_elapsed)
+
+class SQLDatabaseCapturador(SQLDatabase):
+    """SQLDatabase que guarda o resultado das consultas executadas pelo agente,
+    para que gráficos e previsões não precisem executar o SQL novamente"""
+
+    def __init__(self, engine, **kwargs):
+        super().__init__(engine, **kwargs)
+        self._lock = threading.Lock()
+        self._capturas = []
+
+    def run(self, command, fetch="all"):
+        if fetch != "all" or not _retorna_linhas(command):
+            return super().run(command, fetch)
+        try:
+            sql = proteger_sql(self._engine, command)
+        except ValueError as e:
+            # Volta ao agente como erro do banco, para que ele reescreva a consulta
+            return f"Error: {e}"
+        with etapa('sql_agente') as span:
+            df = executar_query(self._engine, sql)
+            span.update(linhas=len(df), truncado=df.attrs.get('truncado', False))
+        with self._lock:
+            # O SQL executado (com o LIMIT automático, se houver) é o que vai para o cache de perguntas
+            self._capturas.append((command, sql, df))
+        saida = str(list(df.itertuples(index=False, name=None)))
+        if df.attrs.get('truncado'):
+            saida += f"\n(resultado truncado em {len(df)} linhas)"
+        return saida
+
+    def limpar_capturas(self):
+        with self._lock:
+            self._capturas = []
+
+    def obter_captura(self, sql=None):
+        """Retorna (sql executado, DataFrame) capturado para o SQL informado.
+
+        Sem SQL, retorna a última consulta executada pelo agente.
+        """
+        with self._lock:
+            if not self._capturas:
+                return None
+            if not sql:
+                return self._capturas[-1][1:]
+            alvo = _normalizar_sql(sql)
+            for comando, executado, df in reversed(self._capturas):
+                if alvo in (_normalizar_sql(comando), _normalizar_sql(executado)):
+                    return executado, df
+        return None
 
 class AnalyticsEngine:
-    def __init__(self, engine):
+    def __init__(self, engine, db=None):
         self.engine = engine
+        self.db = db
+
+    def resultado_capturado(self, sql=None):
+        """Resultado já obtido pelo agente para o SQL, se houver"""
+        if self.db is None:
+            return None
+        return self.db.obter_captura(sql)
+    
+    def papeis_colunas(self, df):
+        """Papel de cada coluna do resultado (data, medida, categoria...), lido dos perfis das tabelas"""
+        perfis = obter_catalogo(self.engine).perfis_disponiveis() if self.engine is not None else {}
+        return papeis_resultado(df, perfis)
+    
+    def intervalo_datas(self, df, coluna, sql):
+        """(início, fim) de `coluna` sem consultar o banco, ou None se não for possível saber"""
+        valores = df[coluna].dropna()
+        if not df.attrs.get('truncado') and len(valores):
+            return valores.min(), valores.max()
+        # Sem filtros, o intervalo da consulta é o da própria tabela, guardado no perfil
+        if self.engine is None or re.search(r'\b(where|having|limit|join)\b', sql, re.IGNORECASE):
+            return None
+        for perfil in obter_catalogo(self.engine).perfis_disponiveis().values():
+            estatistica = (perfil or {}).get('colunas', {}).get(coluna)
+            if estatistica and estatistica['papel'] == 'data' and estatistica.get('min') is not None:
+                return estatistica['min'], estatistica['max']
+        return None
     
-    def gerar_grafico(self, df, tipo='linha'):
-        """Gera gráfico baseado no DataFrame fornecido"""
+    def gerar_grafico(self, df, tipo='linha', sql=None):
+        """Gera gráfico baseado no DataFrame fornecido.
+
+        Com o `sql` que originou `df`, séries temporais longas (ou truncadas) são agregadas
+        por período no próprio banco antes de plotar.
+        """
+        papeis = self.papeis_colunas(df)
+        
         # Identificar coluna temporal
-        data_cols = [col for col in df.columns if any(term in col.lower() 
-                    for term in ['data', 'date', 'dt', 'período', 'periodo'])]
+        data_cols = colunas_por_papel(papeis, 'data')
         if data_cols:
             x_col = data_cols[0]
-            df[x_col] = pd.to_datetime(df[x_col])
         else:
-            x_col = df.columns[0]
+            categorias = [col for col in df.columns if papeis[col] != 'medida']
+            x_col = categorias[0] if categorias else df.columns[0]
             
         # Identificar coluna numérica
-        num_cols = df.select_dtypes(include=[np.number]).columns
-        if len(num_cols) > 0:
-            y_col = [col for col in num_cols if 'quantidade' in col.lower() or 'qtd' in col.lower()]
-            if y_col:
-                y_col = y_col[0]
-            else:
-                y_col = num_cols[0]
+        num_cols = [col for col in colunas_por_papel(papeis, 'medida', ['quantidade', 'qtd']) if col != x_col]
+        if num_cols:
+            y_col = num_cols[0]
         else:
             y_col = df.columns[1]
         
+        if sql and y_col != x_col and (len(df) > PONTOS_ALVO_GRAFICO or df.attrs.get('truncado')):
+            try:
+                with etapa('grafico_agregacao_sql', linhas_originais=len(df)) as span:
+                    if data_cols:
+                        intervalo = self.intervalo_datas(df, x_col, sql)
+                        span['intervalo_conhecido'] = intervalo is not None
+                        df = agregar_por_periodo(self.engine, sql, x_col, y_col, intervalo=intervalo)
+                        span['balde'] = df.attrs['balde']
+                    else:
+                        df = agregar_por_categoria(self.engine, sql, x_col, y_col)
+                    span['linhas'] = len(df)
+            except Exception:
+                # Consulta que não aceita ser subconsulta: usa o resultado já carregado
+                pass
+        
+        if data_cols:
+            df[x_col] = pd.to_datetime(df[x_col])
+        
         # Agregar dados se necessário
         if pd.api.types.is_datetime64_any_dtype(df[x_col]):
             df = df.groupby(x_col)[y_col].sum().reset_index()
         
+        # Limitar os pontos enviados ao navegador
+        pontos_originais = len(df)
+        if tipo == 'linha':
+            df = reduzir_serie(df, x_col, y_col)
+        elif y_col != x_col:
+            df = top_n_com_outros(df, x_col, y_col)
+        
         # Criar gráfico
         if tipo == 'linha':
             fig = go.Figure()
@@ -74,15 +220,21 @@ class AnalyticsEngine:
         if pd.api.types.is_datetime64_any_dtype(df[x_col]):
             fig.update_xaxes(tickangle=45)
         
-        return fig.to_html(full_html=False, include_plotlyjs='cdn')
+        with etapa('grafico_html', pontos=len(df), pontos_originais=pontos_originais) as span:
+            html = html_figura(fig)
+            span['bytes'] = len(html)
+        return html
     
-    def fazer_previsao(self, df, periodos=12):
-        """Realiza previsão usando Prophet"""
+    def fazer_previsao(self, df, periodos=HORIZONTE_MESES, modelo=MODELO_PREVISAO_PADRAO, chave_serie=None):
+        """Realiza previsão usando Prophet ou o modelo rápido (veja `previsao.escolher_modelo`).
+
+        Prevê os `periodos` meses seguintes à última data. Com `chave_serie` (ex.: o SQL de
+        origem), o Prophet parte dos parâmetros do ajuste anterior da mesma série.
+        """
         # Identificar coluna temporal e numérica
-        data_cols = [col for col in df.columns if any(term in col.lower() 
-                    for term in ['data', 'date', 'dt', 'período', 'periodo'])]
-        num_cols = [col for col in df.columns if any(term in col.lower() 
-                   for term in ['quantidade', 'qtd', 'valor', 'total'])]
+        papeis = self.papeis_colunas(df)
+        data_cols = colunas_por_papel(papeis, 'data')
+        num_cols = colunas_por_papel(papeis, 'medida', ['quantidade', 'qtd'])
         
         if not data_cols or not num_cols:
             return None, "Não foi possível identificar colunas adequadas para previsão"
@@ -96,33 +248,45 @@ class AnalyticsEngine:
             'y': df[value_col].astype(float)
         })
         
-        # Treinar modelo
-        model = Prophet(
-            yearly_seasonality=True,
-            weekly_seasonality=True,
-            daily_seasonality=False,
-            interval_width=0.95
-        )
-        model.fit(df_prophet)
+        # Horizonte móvel a partir da última data do histórico
+        future = datas_futuras(df_prophet['ds'].max(), periodos)
         
-        # Criar datas futuras para 2024
-        future_dates = pd.date_range(
-            start=df_prophet['ds'].max(),
-            end='2024-12-31',
-            freq='M'
-        )
-        future = pd.DataFrame({'ds': future_dates})
+        # Mesma série, mesmas datas e mesma configuração: reaproveitar a previsão
+        modelo = escolher_modelo(len(df_prophet), modelo=modelo)
+        cache = obter_cache_previsoes()
+        chave = chave_previsao(df_prophet, future, CONFIG_PROPHET if modelo == 'prophet' else CONFIG_RAPIDO)
+        with etapa('previsao_cache') as span:
+            forecast = cache.obter(chave)
+            span['acerto'] = forecast is not None
+        
+        if forecast is None and modelo == 'rapido':
+            with etapa('previsao_ajuste', pontos=len(df_prophet), modelo=modelo):
+                forecast = ajustar_rapido(df_prophet, future)
+            cache.armazenar(chave, forecast)
+        
+        if forecast is None:
+            # Treinar modelo, partindo do último ajuste da série quando houver
+            inicial = cache.parametros(chave_serie) if chave_serie else None
+            with etapa('previsao_ajuste', pontos=len(df_prophet), modelo=modelo, warm_start=inicial is not None):
+                model = ajustar_modelo_prophet(df_prophet, CONFIG_PROPHET, inicial)
+            if chave_serie:
+                cache.armazenar_parametros(chave_serie, parametros_prophet(model))
+            
+            # Fazer previsão
+            with etapa('previsao_predicao', periodos=len(future)):
+                forecast = model.predict(future)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+            cache.armazenar(chave, forecast)
         
-        # Fazer previsão
-        forecast = model.predict(future)
+        fim_previsao = forecast['ds'].max().strftime('%m/%Y')
         
         # Criar gráfico
         fig = go.Figure()
         
         # Dados históricos
+        historico = reduzir_serie(df_prophet.sort_values('ds'), 'ds', 'y')
         fig.add_trace(go.Scatter(
-            x=df_prophet['ds'],
-            y=df_prophet['y'],
+            x=historico['ds'],
+            y=historico['y'],
             mode='lines+markers',
             name='Dados Históricos',
             line=dict(color='#2E86C1', width=2),
@@ -151,7 +315,7 @@ class AnalyticsEngine:
         
         # Layout
         fig.update_layout(
-            title=f'Previsão de {value_col} para 2024',
+            title=f'Previsão de {value_col} até {fim_previsao}',
             xaxis_title='Data',
             yaxis_title=value_col,
             template='plotly_white',
@@ -164,19 +328,47 @@ class AnalyticsEngine:
             'valores_previstos': forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']].to_dict('records'),
             'ultima_data_historica': df_prophet['ds'].max().strftime('%d/%m/%Y'),
             'media_historica': df_prophet['y'].mean(),
-            'total_previsto_2024': forecast['yhat'].sum()
+            'total_previsto': forecast['yhat'].sum(),
+            'meses_previstos': len(forecast),
+            'fim_previsao': fim_previsao,
         }
         
-        return previsao_dict, fig.to_html(full_html=False, include_plotlyjs='cdn')
+        with etapa('previsao_html', pontos=len(historico), pontos_originais=len(df_prophet)) as span:
+            html = html_figura(fig)
+            span['bytes'] = len(html)
+        return previsao_dict, html
+    
+    def prever_em_lote(self, df, coluna_grupo, processos=None, ao_progresso=None, modelo=MODELO_PREVISAO_PADRAO,
+                       chave_series=None):
+        """Previsão de cada série de `coluna_grupo` (ex.: material ou loja), em paralelo.
 
-def criar_agente(engine):
+        `df` vem em formato longo, com uma coluna de data e uma numérica além do grupo.
+        Retorna (previsoes, metricas) de `previsao.prever_series`.
+        """
+        papeis = self.papeis_colunas(df)
+        data_cols = [col for col in colunas_por_papel(papeis, 'data') if col != coluna_grupo]
+        num_cols = [col for col in colunas_por_papel(papeis, 'medida', ['quantidade', 'qtd']) if col != coluna_grupo]
+        
+        if not data_cols or not num_cols:
+            raise ValueError("Não foi possível identificar colunas adequadas para previsão")
+        
+        with etapa('previsao_lote', series=int(df[coluna_grupo].nunique())) as span:
+            previsoes, metricas = prever_series(
+                df, coluna_grupo, data_cols[0], num_cols[0], processos=processos, ao_progresso=ao_progresso,
+                modelo=modelo, chave_series=chave_series)
+            span.update(ajustadas=metricas['ajustadas'], do_cache=metricas['do_cache'],
+                        processos=metricas['processos'])
+        return previsoes, metricas
+
+def criar_agente(engine, llm=None):
     """Cria o agente com capacidades analíticas"""
-    db = SQLDatabase(engine)
+    db = SQLDatabaseCapturador(engine)
     
-    llm = ChatOpenAI(
-        model="gpt-4",
-        temperature=0.3
-    )
+    if llm is None:
+        llm = ChatOpenAI(
+            model="gpt-4",
+            temperature=0.3
+        )
     
     toolkit = SQLDatabaseToolkit(db=db, llm=llm)
     
@@ -186,16 +378,25 @@ def criar_agente(engine):
         verbose=True,
         agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
     )
+    # Mesmo agente e ferramentas, num executor que pode ser cancelado entre os passos
+    agent_executor = ExecutorCancelavel.from_agent_and_tools(
+        agent=agent_executor.agent,
+        tools=agent_executor.tools,
+        verbose=agent_executor.verbose,
+        max_iterations=agent_executor.max_iterations,
+        max_execution_time=agent_executor.max_execution_time,
+        early_stopping_method=agent_executor.early_stopping_method,
+    )
     
-    analytics = AnalyticsEngine(engine)
+    analytics = AnalyticsEngine(engine, db)
     
     return agent_executor, analytics
 
-def fazer_pergunta(agente, engine, analytics, pergunta):
-    """Processa a pergunta e retorna resposta com visualizações"""
-    tabelas = listar_tabelas(engine)
-    schemas = {table: obter_schema(engine, table) for table in tabelas}
-    
+PALAVRAS_PREVISAO = ['previsão', 'previsao', 'prever', 'futuro', 'próximos meses', 'próximo ano']
+PALAVRAS_GRAFICO = ['gráfico', 'grafico', 'visualizar', 'mostrar']
+
+def montar_contexto(schemas, perfis=None):
+    """Monta o prompt com as instruções, o schema das tabelas e, se houver, as estatísticas dos perfis"""
     contexto = """Você é um Cientista de Dados Expert em IA. 
     RESPONDA SEMPRE EM PORTUGUÊS DO BRASIL de forma clara e objetiva.
     
@@ -216,74 +417,458 @@ def fazer_pergunta(agente, engine, analytics, pergunta):
     ORDER BY data
     """
     
-    contexto += f"As tabelas disponíveis são: {', '.join(tabelas)}. "
+    contexto += f"As tabelas disponíveis são: {', '.join(schemas)}. "
     for table, schema in schemas.items():
         colunas = [f"{col['name']} ({col['type']})" for col in schema]
         contexto += f"A tabela {table} tem as seguintes colunas: {', '.join(colunas)}. "
+        perfil = (perfis or {}).get(table)
+        if perfil:
+            contexto += f"Estatísticas de {table}: {descrever_perfil(perfil, [col['name'] for col in schema])}. "
+    return contexto
+
+# Poda do schema enviado no prompt: só as tabelas e colunas relevantes para a pergunta
+MAX_TABELAS_PROMPT = 5
+MAX_COLUNAS_POR_TABELA = 25
+TERMOS_DATA = ['data', 'date', 'dt', 'período', 'periodo']
+
+def selecionar_schema(catalogo, pergunta, max_tabelas=MAX_TABELAS_PROMPT, max_colunas=MAX_COLUNAS_POR_TABELA):
+    """Ordena tabelas e colunas pela relevância para a pergunta e mantém apenas as primeiras.
+
+    Retorna o schema completo quando ele já é pequeno ou quando nada na pergunta
+    corresponde a nomes do schema.
+    """
+    schemas = catalogo.schemas()
+    if len(schemas) <= max_tabelas and all(len(cols) <= max_colunas for cols in schemas.values()):
+        return schemas
     
-    pergunta_completa = f"{contexto}\n\nPergunta do usuário: {pergunta}"
+    indice_tabelas, indice_colunas = catalogo.indice()
+    tabelas = [tabela for tabela, _ in indice_tabelas.buscar(pergunta, limite=max_tabelas)]
+    if not tabelas:
+        return schemas
     
-    try:
+    relevantes = {}
+    for tabela, coluna in indice_colunas.buscar(pergunta, limite=len(indice_colunas)):
+        relevantes.setdefault(tabela, []).append(coluna)
+    
+    selecionado = {}
+    for tabela in tabelas:
+        colunas = schemas[tabela]
+        if len(colunas) > max_colunas:
+            # Tabelas largas: colunas citadas na pergunta e colunas de data primeiro
+            prioridade = relevantes.get(tabela, []) + [
+                col['name'] for col in colunas if any(t in col['name'].lower() for t in TERMOS_DATA)]
+            nomes = list(dict.fromkeys(prioridade + [col['name'] for col in colunas]))[:max_colunas]
+            colunas = [col for col in colunas if col['name'] in nomes]
+        selecionado[tabela] = colunas
+    return selecionado
+
+def resumir_resultado(df, limite=20):
+    """Resposta em texto para consultas executadas sem passar pelo LLM"""
+    if df.empty:
+        return "A consulta não retornou resultados."
+    resumo = f"Resultado da consulta:\n\n{df.head(limite).to_html(index=False, border=0)}"
+    if len(df) > limite:
+        resumo += f"\n\nExibindo {limite} de {len(df):,} linhas."
+    return resumo
+
+def gerar_visualizacao(analytics, pergunta, df, sql=None):
+    """Gera a previsão ou o gráfico pedido na pergunta; `sql` é a consulta que gerou `df`.
+
+    Retorna ('previsao', (previsao_dict, html)), ('grafico', html), ('erro', mensagem) ou None.
+    """
+    # Se for pedido de previsão
+    if any(palavra in pergunta.lower() for palavra in PALAVRAS_PREVISAO):
+        try:
+            with etapa('previsao', linhas=len(df)):
+                return 'previsao', analytics.fazer_previsao(df, chave_serie=sql)
+        except Exception as e:
+            return 'erro', f"Não foi possível gerar a previsão: {str(e)}"
+    
+    # Se for pedido de gráfico
+    elif any(palavra in pergunta.lower() for palavra in PALAVRAS_GRAFICO):
+        tipo = 'barra' if any(palavra in pergunta.lower() 
+                            for palavra in ['barra', 'coluna', 'colunas']) else 'linha'
+        try:
+            with etapa('grafico', linhas=len(df)):
+                return 'grafico', analytics.gerar_grafico(df, tipo, sql)
+        except Exception as e:
+            return 'erro', f"Não foi possível gerar o gráfico: {str(e)}"
+    
+    return None
+
+def montar_resposta(resposta, df, visualizacao):
+    """Junta o texto da resposta com a visualização gerada por `gerar_visualizacao`"""
+    if df.attrs.get('truncado'):
+        resposta += f"\n\nObservação: o resultado foi limitado a {len(df):,} linhas para análise."
+    
+    if visualizacao is None:
+        return resposta
+    tipo, conteudo = visualizacao
+    
+    if tipo == 'erro':
+        resposta += f"\n\n{conteudo}"
+    
+    elif tipo == 'previsao':
+        previsao_dict, grafico_previsao = conteudo
+        try:
+            if previsao_dict:
+                media_prevista = np.mean([v['yhat'] for v in previsao_dict['valores_previstos']])
+                total_previsto = previsao_dict['total_previsto']
+                
+                resposta = f"""
+                Com base nos dados históricos até {previsao_dict['ultima_data_historica']}, 
+                realizei uma análise preditiva para os próximos {previsao_dict['meses_previstos']} meses
+                (até {previsao_dict['fim_previsao']}):
+
+                • Média mensal prevista: {media_prevista:,.2f}
+                • Total previsto no período: {total_previsto:,.2f}
+                
+                {resposta}
+                
+                Aqui está o gráfico com a previsão:
+                
+                {grafico_previsao}
+                
+                Legenda:
+                - Linha azul: dados históricos
+                - Linha vermelha tracejada: previsão
+                - Área sombreada: intervalo de confiança (95%)
+                """
+        except Exception as e:
+            resposta += f"\n\nNão foi possível gerar a previsão: {str(e)}"
+    
+    else:
+        resposta = f"""
+            Análise dos dados solicitados:
+            
+            {resposta}
+            
+            Aqui está a visualização:
+            
+            {conteudo}
+            """
+    
+    return resposta
+
+def limite_linhas_resultado(pergunta):
+    """Linhas a trazer do banco para responder a pergunta.
+
+    Pedidos só de gráfico trazem uma amostra: o gráfico é agregado no banco a partir do SQL.
+    """
+    texto = pergunta.lower()
+    if any(p in texto for p in PALAVRAS_GRAFICO) and not any(p in texto for p in PALAVRAS_PREVISAO):
+        return PONTOS_ALVO_GRAFICO
+    return LIMITE_LINHAS_PADRAO
+
+def consultar_resultado(engine, sql, pergunta):
+    """Executa o SQL da resposta; pedidos de previsão leem do banco só os períodos novos da série"""
+    if any(p in pergunta.lower() for p in PALAVRAS_PREVISAO):
+        return obter_series(engine).obter(sql, limite_linhas_resultado(pergunta))
+    return executar_query(engine, sql, max_linhas=limite_linhas_resultado(pergunta))
+
+def enriquecer_resposta(analytics, pergunta, resposta, df, sql=None):
+    """Acrescenta previsão ou gráfico à resposta conforme o pedido do usuário"""
+    return montar_resposta(resposta, df, gerar_visualizacao(analytics, pergunta, df, sql))
+
+def _registrar_tokens(span, cb):
+    """Copia os tokens do callback para o span e acumula no rastro da pergunta"""
+    span.update(prompt_tokens=cb.prompt_tokens, completion_tokens=cb.completion_tokens,
+                total_tokens=cb.total_tokens, custo_usd=cb.total_cost)
+    rastro = rastro_atual()
+    if rastro is not None:
+        for chave in ('prompt_tokens', 'completion_tokens', 'total_tokens', 'custo_usd'):
+            rastro.atributos[chave] = rastro.atributos.get(chave, 0) + span[chave]
+
+def _executar_agente(agente, pergunta_completa):
+    """Executa o agente registrando tempo e tokens no rastro da pergunta"""
+    with etapa('llm', caracteres_prompt=len(pergunta_completa)) as span:
         with get_openai_callback() as cb:
             resposta = agente.run(pergunta_completa)
+        _registrar_tokens(span, cb)
+    return resposta
+
+INSTRUCOES_SQL_DIRETO = """
+    Responda SOMENTE com uma única consulta SQL no dialeto {dialeto} que responda à pergunta,
+    entre ```sql e ```. Use apenas as tabelas e colunas listadas acima e não altere dados.
+    """
+
+def _llm_do_agente(agente):
+    """LLM usado pelo executor criado em `criar_agente`"""
+    llm_chain = getattr(getattr(agente, 'agent', None), 'llm_chain', None)
+    return getattr(llm_chain, 'llm', None)
+
+def _perfis_prompt(engine, schema):
+    # Só os perfis já calculados: a pergunta não espera pela varredura das tabelas
+    with etapa('perfil_tabelas', tabelas=len(schema)) as span:
+        perfis = obter_catalogo(engine).perfis_disponiveis(list(schema))
+        span['perfis'] = len(perfis)
+        return perfis
+
+def _prompt_sql_direto(engine, schema, pergunta):
+    return (f"{montar_contexto(schema, _perfis_prompt(engine, schema))}\n{INSTRUCOES_SQL_DIRETO.format(dialeto=engine.dialect.name)}"
+            f"\n\nPergunta do usuário: {pergunta}")
+
+def gerar_sql_direto(llm, engine, schema, pergunta):
+    """Gera o SQL com uma única chamada ao LLM e o valida com EXPLAIN, sem o ciclo ReAct.
+
+    Levanta exceção se a resposta não contiver SQL, se o banco rejeitar a consulta ou se a
+    estimativa de custo passar do orçamento (`proteger_sql`).
+    """
+    prompt = _prompt_sql_direto(engine, schema, pergunta)
+    with etapa('llm_direto', caracteres_prompt=len(prompt)) as span:
+        with get_openai_callback() as cb:
+            resposta = llm.predict(prompt)
+        _registrar_tokens(span, cb)
+    sql = extrair_sql_da_resposta(resposta) or resposta.strip()
+    with etapa('validacao_sql'):
+        return proteger_sql(engine, sql)
+
+def fazer_pergunta(agente, engine, analytics, pergunta, usar_cache=True, modo_rapido=True):
+    """Processa a pergunta e retorna resposta com visualizações.
+
+    Com `modo_rapido`, tenta primeiro gerar o SQL em uma única chamada ao LLM;
+    o agente ReAct só é usado se esse SQL não passar na validação ou falhar.
+    """
+    with obter_rastreador().rastrear(pergunta) as rastro:
+        with etapa('schema') as span:
+            catalogo = obter_catalogo(engine)
+            schemas = catalogo.schemas()
+            versao_schema = catalogo.versao()
+            span['tabelas'] = len(schemas)
+        cache = obter_cache_perguntas() if usar_cache else None
         
-        sql_usado = extrair_sql_da_resposta(resposta)
-        
-        if sql_usado:
-            df = pd.read_sql(sql_usado, engine)
+        try:
+            # Pergunta já respondida antes: executa o SQL validado sem chamar o LLM
+            if cache is not None:
+                with etapa('cache_perguntas') as span:
+                    entrada = cache.buscar(pergunta, versao_schema)
+                    span['acerto'] = entrada is not None
+                if entrada is not None:
+                    try:
+                        with etapa('sql_cache') as span:
+                            # SQL do cache passa pelo mesmo orçamento que o gerado agora
+                            sql_cache = proteger_sql(engine, entrada['sql'])
+                            df = consultar_resultado(engine, sql_cache, pergunta)
+                            span['linhas'] = len(df)
+                    except ConsultaInterrompida:
+                        raise
+                    except Exception:
+                        cache.descartar(entrada['chave'])
+                    else:
+                        resposta = resumir_resultado(df) + "\n\n(Consulta reaproveitada do cache de perguntas.)"
+                        return enriquecer_resposta(analytics, pergunta, resposta, df, sql_cache), sql_cache
+            
+            # Primeiro com o schema reduzido; o schema completo só se a primeira tentativa falhar
+            with etapa('selecao_schema') as span:
+                schema_reduzido = selecionar_schema(catalogo, pergunta)
+                span['tabelas'] = len(schema_reduzido)
             
-            # Se for pedido de previsão
-            if any(palavra in pergunta.lower() for palavra in ['previsão', 'previsao', 'prever', 'futuro', '2024']):
+            llm = _llm_do_agente(agente) if modo_rapido else None
+            if llm is not None:
                 try:
-                    previsao_dict, grafico_previsao = analytics.fazer_previsao(df)
-                    
-                    if previsao_dict:
-                        media_2024 = np.mean([v['yhat'] for v in previsao_dict['valores_previstos']])
-                        total_2024 = previsao_dict['total_previsto_2024']
-                        
-                        resposta = f"""
-                        Com base nos dados históricos até {previsao_dict['ultima_data_historica']}, 
-                        realizei uma análise preditiva para 2024:
-
-                        • Média mensal prevista: {media_2024:,.2f}
-                        • Total previsto para 2024: {total_2024:,.2f}
-                        
-                        {resposta}
-                        
-                        Aqui está o gráfico com a previsão:
-                        
-                        {grafico_previsao}
-                        
-                        Legenda:
-                        - Linha azul: dados históricos
-                        - Linha vermelha tracejada: previsão
-                        - Área sombreada: intervalo de confiança (95%)
-                        """
+                    sql_usado = gerar_sql_direto(llm, engine, schema_reduzido, pergunta)
+                    with etapa('sql_direto') as span:
+                        df = consultar_resultado(engine, sql_usado, pergunta)
+                        span['linhas'] = len(df)
+                except ConsultaInterrompida:
+                    # Cancelada ou acima do tempo: o agente ReAct não tenta de novo
+                    raise
                 except Exception as e:
-                    resposta += f"\n\nNão foi possível gerar a previsão: {str(e)}"
+                    rastro.atributos['erro_modo_rapido'] = str(e)
+                else:
+                    rastro.atributos['modo'] = 'direto'
+                    if cache is not None:
+                        cache.armazenar(pergunta, versao_schema, sql_usado)
+                    return enriquecer_resposta(analytics, pergunta, resumir_resultado(df), df, sql_usado), sql_usado
+            
+            rastro.atributos['modo'] = 'agente'
+            tentativas = [schema_reduzido]
+            if schema_reduzido != schemas:
+                tentativas.append(schemas)
             
-            # Se for pedido de gráfico
-            elif any(palavra in pergunta.lower() for palavra in ['gráfico', 'grafico', 'visualizar', 'mostrar']):
-                tipo = 'barra' if any(palavra in pergunta.lower() 
-                                    for palavra in ['barra', 'coluna', 'colunas']) else 'linha'
+            for numero, schema_prompt in enumerate(tentativas, start=1):
+                ultima = numero == len(tentativas)
+                contexto = montar_contexto(schema_prompt, _perfis_prompt(engine, schema_prompt))
+                pergunta_completa = f"{contexto}\n\nPergunta do usuário: {pergunta}"
+                
+                if analytics.db is not None:
+                    analytics.db.limpar_capturas()
+                
                 try:
-                    grafico = analytics.gerar_grafico(df, tipo)
-                    resposta = f"""
-                    Análise dos dados solicitados:
+                    resposta = _executar_agente(agente, pergunta_completa)
                     
-                    {resposta}
+                    sql_usado = extrair_sql_da_resposta(resposta)
                     
-                    Aqui está a visualização:
-                    
-                    {grafico}
-                    """
-                except Exception as e:
-                    resposta += f"\n\nNão foi possível gerar o gráfico: {str(e)}"
+                    # Reaproveitar o resultado da consulta executada pelo agente
+                    captura = analytics.resultado_capturado(sql_usado)
+                    if captura is not None:
+                        sql_usado, df = captura
+                    elif sql_usado:
+                        with etapa('sql_reexecucao') as span:
+                            sql_usado = proteger_sql(engine, sql_usado)
+                            df = executar_query(engine, sql_usado)
+                            span['linhas'] = len(df)
+                except ConsultaInterrompida:
+                    raise
+                except Exception:
+                    if ultima:
+                        raise
+                    continue
+                
+                if sql_usado or ultima:
+                    break
+            rastro.atributos['tentativas'] = numero
+            
+            if sql_usado:
+                # Só chega aqui SQL que executou com sucesso
+                if cache is not None:
+                    cache.armazenar(pergunta, versao_schema, sql_usado)
+                resposta = enriquecer_resposta(analytics, pergunta, resposta, df, sql_usado)
+            
+            return resposta, sql_usado
         
-        return resposta, sql_usado
-    
-    except Exception as e:
-        return f"Erro ao processar a pergunta: {str(e)}", None
+        except Exception as e:
+            rastro.atributos['erro'] = str(e)
+            return f"Erro ao processar a pergunta: {str(e)}", None
+
+INSTRUCOES_NARRATIVA = """Você é um Cientista de Dados Expert em IA.
+    RESPONDA SEMPRE EM PORTUGUÊS DO BRASIL de forma clara e objetiva, em um parágrafo curto,
+    comentando o resultado abaixo. Não repita a tabela nem o SQL.
+    """
+
+class _RepassarTokens(AsyncCallbackHandler):
+    """Entrega cada token gerado pelo LLM à função `ao_receber_token`"""
+
+    def __init__(self, ao_receber_token):
+        self.ao_receber_token = ao_receber_token
+
+    async def on_llm_new_token(self, token, **kwargs):
+        self.ao_receber_token(token)
+
+def _llm_com_streaming(llm):
+    # Cópia com streaming ligado; o LLM do agente continua sem streaming
+    if 'streaming' in getattr(llm, '__fields__', {}):
+        return llm.copy(update={'streaming': True})
+    return llm
+
+async def _gerar_texto_async(llm, prompt, ao_receber_token=None):
+    callbacks = [_RepassarTokens(ao_receber_token)] if ao_receber_token else None
+    resultado = await llm.agenerate_prompt([StringPromptValue(text=prompt)], callbacks=callbacks)
+    return resultado.generations[0][0].text
+
+async def gerar_sql_direto_async(llm, engine, schema, pergunta):
+    """Versão assíncrona de `gerar_sql_direto`; o perfil das tabelas e a validação rodam em threads"""
+    prompt = await asyncio.to_thread(_prompt_sql_direto, engine, schema, pergunta)
+    with etapa('llm_direto', caracteres_prompt=len(prompt)) as span:
+        with get_openai_callback() as cb:
+            resposta = await _gerar_texto_async(llm, prompt)
+        _registrar_tokens(span, cb)
+    sql = extrair_sql_da_resposta(resposta) or resposta.strip()
+    with etapa('validacao_sql'):
+        return await asyncio.to_thread(proteger_sql, engine, sql)
+
+async def narrar_resultado(llm, pergunta, df, ao_receber_token=None, limite=20):
+    """Comentário do LLM sobre o resultado, entregue token a token a `ao_receber_token`"""
+    prompt = (f"{INSTRUCOES_NARRATIVA}\nResultado ({len(df):,} linhas):\n{df.head(limite).to_string(index=False)}"
+              f"\n\nPergunta do usuário: {pergunta}")
+    try:
+        with etapa('llm_narrativa', caracteres_prompt=len(prompt)) as span:
+            with get_openai_callback() as cb:
+                texto = await _gerar_texto_async(_llm_com_streaming(llm), prompt, ao_receber_token)
+            _registrar_tokens(span, cb)
+        return texto.strip()
+    except Exception:
+        # Sem o comentário, a resposta ainda traz a tabela e a visualização
+        return ""
+
+async def _responder_direto_async(agente, engine, analytics, pergunta, ao_receber_token, usar_cache):
+    """Caminho assíncrono com uma chamada ao LLM para o SQL; None quando o agente ReAct é necessário"""
+    with obter_rastreador().rastrear(pergunta) as rastro:
+        rastro.atributos['modo'] = 'direto_async'
+        try:
+            with etapa('schema') as span:
+                catalogo = obter_catalogo(engine)
+                schemas = await asyncio.to_thread(catalogo.schemas)
+                versao_schema = catalogo.versao()
+                span['tabelas'] = len(schemas)
+            cache = obter_cache_perguntas() if usar_cache else None
+            
+            sql_usado = df = entrada = None
+            if cache is not None:
+                with etapa('cache_perguntas') as span:
+                    entrada = await asyncio.to_thread(cache.buscar, pergunta, versao_schema)
+                    span['acerto'] = entrada is not None
+                if entrada is not None:
+                    try:
+                        with etapa('sql_cache') as span:
+                            sql_cache = await asyncio.to_thread(proteger_sql, engine, entrada['sql'])
+                            df = await asyncio.to_thread(consultar_resultado, engine, sql_cache, pergunta)
+                            span['linhas'] = len(df)
+                        sql_usado = sql_cache
+                    except ConsultaInterrompida:
+                        raise
+                    except Exception:
+                        cache.descartar(entrada['chave'])
+                        entrada = None
+            
+            llm = _llm_do_agente(agente)
+            if sql_usado is None:
+                if llm is None:
+                    return None
+                with etapa('selecao_schema') as span:
+                    schema_reduzido = selecionar_schema(catalogo, pergunta)
+                    span['tabelas'] = len(schema_reduzido)
+                sql_usado = await gerar_sql_direto_async(llm, engine, schema_reduzido, pergunta)
+                with etapa('sql_direto') as span:
+                    df = await asyncio.to_thread(consultar_resultado, engine, sql_usado, pergunta)
+                    span['linhas'] = len(df)
+                if cache is not None:
+                    cache.armazenar(pergunta, versao_schema, sql_usado)
+            
+            # Comentário do LLM e gráfico/previsão ao mesmo tempo
+            tarefas = [asyncio.to_thread(gerar_visualizacao, analytics, pergunta, df, sql_usado)]
+            if llm is not None and entrada is None:
+                tarefas.append(narrar_resultado(llm, pergunta, df, ao_receber_token))
+            visualizacao, *narrativa = await asyncio.gather(*tarefas)
+            resposta = resumir_resultado(df)
+            if entrada is not None:
+                resposta += "\n\n(Consulta reaproveitada do cache de perguntas.)"
+            elif narrativa and narrativa[0]:
+                resposta = f"{narrativa[0]}\n\n{resposta}"
+            return montar_resposta(resposta, df, visualizacao), sql_usado
+        
+        except asyncio.CancelledError:
+            rastro.atributos['cancelada'] = True
+            raise
+        except ConsultaInterrompida as e:
+            rastro.atributos['erro'] = str(e)
+            return f"Erro ao processar a pergunta: {str(e)}", None
+        except Exception as e:
+            rastro.atributos['erro_modo_rapido'] = str(e)
+            return None
+
+async def fazer_pergunta_async(agente, engine, analytics, pergunta, ao_receber_token=None, usar_cache=True):
+    """Versão assíncrona de `fazer_pergunta`.
+
+    O comentário do LLM é entregue token a token a `ao_receber_token` enquanto o gráfico
+    ou a previsão são gerados em paralelo. Se o SQL gerado em uma chamada não validar, usa
+    o agente ReAct em uma thread.
+
+    Cancelar a tarefa descarta o resultado e para o agente ReAct antes do próximo passo (a
+    chamada ao LLM em andamento termina). Etapas já em execução em outras threads terminam
+    em segundo plano; consultas no banco só param com `cancelar_consultas`.
+    """
+    resultado = await _responder_direto_async(agente, engine, analytics, pergunta, ao_receber_token, usar_cache)
+    if resultado is not None:
+        return resultado
+    parar = threading.Event()
+    try:
+        with parada_da_pergunta(parar):
+            return await asyncio.to_thread(
+                fazer_pergunta, agente, engine, analytics, pergunta, usar_cache=usar_cache, modo_rapido=False)
+    except asyncio.CancelledError:
+        parar.set()
+        raise
 
 def extrair_sql_da_resposta(resposta):
     """Extrai a query SQL da resposta"""
@@ -1,11 +1,8 @@
 import pandas as pd
 import numpy as np
-from prophet import Prophet
-from datetime import datetime
-import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.linear_model import LinearRegression
-from datetime import datetime, timedelta
+from graficos import html_figura, reduzir_serie, top_n_com_outros
+from previsao import HORIZONTE_MESES, MODELO_PREVISAO_PADRAO, ajustar_rapido, datas_futuras, escolher_modelo
 
 class AdvancedAnalytics:
     def __init__(self, engine):
@@ -22,10 +19,13 @@ class AdvancedAnalytics:
             y_col: nome da coluna para eixo y
             title: título do gráfico
         """
+        import plotly.express as px
+        
+        # Limitar os pontos enviados ao navegador
         if plot_type == 'line':
-            fig = px.line(df, x=x_col, y=y_col, title=title)
+            fig = px.line(reduzir_serie(df, x_col, y_col), x=x_col, y=y_col, title=title)
         elif plot_type == 'bar':
-            fig = px.bar(df, x=x_col, y=y_col, title=title)
+            fig = px.bar(top_n_com_outros(df, x_col, y_col), x=x_col, y=y_col, title=title)
         
         # Configuração do layout
         fig.update_layout(
@@ -35,30 +35,40 @@ class AdvancedAnalytics:
             showlegend=True
         )
         
-        return fig.to_html(full_html=False, include_plotlyjs='cdn')
+        return html_figura(fig)
     
-    def forecast_future(self, df, date_col, value_col, periods=12):
+    def forecast_future(self, df, date_col, value_col, periods=HORIZONTE_MESES, modelo=MODELO_PREVISAO_PADRAO):
         """
-        Realiza previsão usando Prophet
+        Realiza previsão usando Prophet ou o modelo rápido
         
         Args:
             df: DataFrame com os dados históricos
             date_col: nome da coluna de data
             value_col: nome da coluna de valor
             periods: número de períodos futuros para prever
+            modelo: 'prophet', 'rapido' ou 'auto' (veja previsao.escolher_modelo)
         """
         # Preparar dados para o Prophet
         prophet_df = df.rename(columns={date_col: 'ds', value_col: 'y'})
         
-        # Inicializar e treinar o modelo
-        model = Prophet(yearly_seasonality=True, 
-                       weekly_seasonality=True,
-                       daily_seasonality=False)
-        model.fit(prophet_df)
-        
-        # Criar DataFrame para previsão
-        future = model.make_future_dataframe(periods=periods, freq='M')
-        forecast = model.predict(future)
+        if escolher_modelo(len(prophet_df), modelo=modelo) == 'rapido':
+            # Mesmas datas do make_future_dataframe: histórico + `periods` fins de mês
+            prophet_df = prophet_df.assign(ds=pd.to_datetime(prophet_df['ds']))
+            historico = pd.DatetimeIndex(prophet_df['ds'].drop_duplicates().sort_values())
+            proximas = pd.DatetimeIndex(datas_futuras(historico.max(), periods)['ds'])
+            future = pd.DataFrame({'ds': historico.append(proximas)})
+            forecast = ajustar_rapido(prophet_df[['ds', 'y']], future)
+        else:
+            # Inicializar e treinar o modelo (Prophet importado só quando usado)
+            from prophet import Prophet
+            model = Prophet(yearly_seasonality=True, 
+                           weekly_seasonality=True,
+                           daily_seasonality=False)
+            model.fit(prophet_df)
+            
+            # Criar DataFrame para previsão
+            future = model.make_future_dataframe(periods=periods, freq='M')
+            forecast = model.predict(future)
         
         # Preparar dados para visualização
         result_df = pd.DataFrame({
@@ -72,9 +82,10 @@ class AdvancedAnalytics:
         fig = go.Figure()
         
         # Dados históricos
+        historico = reduzir_serie(prophet_df.sort_values('ds'), 'ds', 'y')
         fig.add_trace(go.Scatter(
-            x=prophet_df['ds'],
-            y=prophet_df['y'],
+            x=historico['ds'],
+            y=historico['y'],
             name='Dados Históricos',
             mode='lines'
         ))
@@ -99,11 +110,11 @@ class AdvancedAnalytics:
         ))
         
         fig.update_layout(
-            title='Previsão para 2024',
+            title=f'Previsão para os próximos {periods} meses',
             xaxis_title='Data',
             yaxis_title='Valor',
             template='plotly_white',
             showlegend=True
         )
         
-        return result_df, fig.to_html(full_html=False, include_plotlyjs='cdn')
\ No newline at end of file
+        return result_df, html_figura(fig)
\ No newline at end of file
@@ -1,12 +1,20 @@
 import streamlit as st
-from database import carregar_dados_do_postgres, carregar_planilha, executar_query, listar_tabelas
-from agent import criar_agente, fazer_pergunta
-from utils import formatar_resposta
+from database import carregar_dados_do_postgres, carregar_planilha, executar_query, obter_catalogo, calcular_hash_arquivo, metricas_pool
+from database import cancelar_consultas, dono_das_consultas
+from ingestao import obter_cache_ingestao
+from cache_previsoes import obter_cache_previsoes
+from rastreamento import obter_rastreador
+from preaquecimento import estado_preaquecimento, iniciar_preaquecimento
+from historico import HistoricoConversa
+from rollups import obter_rollups
 import os
 from dotenv import load_dotenv
 from PIL import Image
-import plotly.express as px
 import pandas as pd
+import asyncio
+import threading
+import time
+import uuid
 
 # Carregar variáveis de ambiente
 load_dotenv()
@@ -23,6 +31,10 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# O agente (LangChain), o Plotly Express e o Prophet são importados em segundo plano;
+# a página abre sem esperar por eles
+iniciar_preaquecimento()
+
 # CSS customizado
 st.markdown("""
     <style>
@@ -60,37 +72,39 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Função para exibir mensagens no chat
-def exibir_mensagem(role, content, sql_usado=None):
-    if role == "Usuário":
-        st.markdown(f"<div class='user-message'><strong>Usuário:</strong> {content}</div>", 
+def exibir_mensagem(mensagem, historico):
+    if mensagem['role'] == "Usuário":
+        texto = ''.join(parte.get('texto', '') for parte in mensagem['partes'])
+        st.markdown(f"<div class='user-message'><strong>Usuário:</strong> {texto}</div>", 
                    unsafe_allow_html=True)
     else:
-        # Verificar se há HTML de gráfico na resposta
-        if "<div>" in str(content):
-            partes = str(content).split("<div>")
-            st.markdown(f"<div class='assistant-message'><strong>Assistente:</strong> {partes[0]}</div>", 
-                       unsafe_allow_html=True)
-            for parte in partes[1:]:
-                if "</div>" in parte:
-                    grafico_html = f"<div>{parte.split('</div>')[0]}</div>"
-                    st.components.v1.html(grafico_html, height=600, scrolling=True)
-                    texto_restante = parte.split('</div>')[1]
-                    if texto_restante.strip():
-                        st.markdown(f"<div class='assistant-message'>{texto_restante}</div>", 
-                                  unsafe_allow_html=True)
-        else:
-            st.markdown(f"<div class='assistant-message'><strong>Assistente:</strong> {content}</div>", 
-                       unsafe_allow_html=True)
+        rotulo = "<strong>Assistente:</strong> "
+        for parte in mensagem['partes']:
+            if 'figura' in parte:
+                # Desenhadas pelo plotly.js do próprio Streamlit; o tamanho é o do JSON enviado ao navegador
+                figura = historico.figura(parte['figura'])
+                if figura is None:
+                    st.caption("Gráfico indisponível.")
+                    continue
+                st.plotly_chart(figura, use_container_width=True)
+                st.caption(f"Gráfico: {parte['bytes'] / 1024:.1f} KB")
+            else:
+                st.markdown(f"<div class='assistant-message'>{rotulo}{parte['texto']}</div>", 
+                           unsafe_allow_html=True)
+                rotulo = ""
         
-        if sql_usado:
+        if mensagem.get('sql_usado'):
             with st.expander("Ver SQL utilizado"):
-                st.code(sql_usado, language='sql')
+                st.code(mensagem['sql_usado'], language='sql')
 
 # Inicialização do histórico de chat
-if 'mensagens' not in st.session_state:
-    st.session_state.mensagens = []
+if 'historico' not in st.session_state:
+    st.session_state.historico = HistoricoConversa()
 if 'dados_carregados' not in st.session_state:
     st.session_state.dados_carregados = False
+# Identifica as consultas desta sessão, para cancelar só as dela no banco compartilhado
+if 'sessao' not in st.session_state:
+    st.session_state.sessao = uuid.uuid4().hex
 
 # Área principal
 col1, col2 = st.columns([1, 5])
@@ -127,15 +141,33 @@ if opcao == "Banco de Dados PostgreSQL":
             with st.spinner("Conectando ao banco de dados..."):
                 engine = carregar_dados_do_postgres(connection_string)
                 st.session_state.engine = engine
+                st.session_state.pop('hash_planilha', None)
+                from agent import criar_agente
                 agente, analytics = criar_agente(engine)
                 st.session_state.agente = agente
                 st.session_state.analytics = analytics
-                tabelas = listar_tabelas(engine)
+                catalogo = obter_catalogo(engine)
+                catalogo.invalidar()
+                tabelas = catalogo.tabelas()
+                # Perfil das tabelas calculado em segundo plano: conectar não espera pelas varreduras
+                catalogo.calcular_perfis_em_segundo_plano()
+                # Agregados já existentes atualizados em segundo plano; os novos só na primeira consulta que os use
+                rollups = obter_rollups(engine)
+                if rollups is not None:
+                    rollups.atualizar()
                 st.session_state.dados_carregados = True
                 st.sidebar.success("✅ Conectado com sucesso!")
                 st.sidebar.write("📋 Tabelas disponíveis:", tabelas)
         except Exception as e:
             st.sidebar.error(f"❌ Erro ao conectar: {str(e)}")
+    
+    if 'engine' in st.session_state and 'hash_planilha' not in st.session_state:
+        pool = metricas_pool(st.session_state.engine)
+        if 'checkouts' in pool:
+            st.sidebar.caption(
+                f"Pool: {pool['em_uso']} conexões em uso, {pool['ociosas']} ociosas, "
+                f"espera média {pool['espera_media_s'] * 1000:,.1f} ms (máx. {pool['espera_max_s'] * 1000:,.1f} ms)"
+            )
 else:
     arquivo = st.sidebar.file_uploader(
         "Carregue sua planilha (CSV, XLS, XLSX)",
@@ -143,71 +175,174 @@ else:
     )
     if arquivo is not None:
         try:
-            with st.spinner("Carregando planilha..."):
-                engine = carregar_planilha(arquivo)
-                st.session_state.engine = engine
-                agente, analytics = criar_agente(engine)
-                st.session_state.agente = agente
-                st.session_state.analytics = analytics
-                tabelas = listar_tabelas(engine)
-                st.session_state.dados_carregados = True
-                st.sidebar.success("✅ Planilha carregada com sucesso!")
-                st.sidebar.write("📋 Tabelas disponíveis:", tabelas)
-                
-                if st.sidebar.checkbox("👀 Visualizar dados"):
-                    df = pd.read_sql(f"SELECT * FROM {tabelas[0]} LIMIT 5", engine)
-                    st.sidebar.dataframe(df)
+            # Streamlit reexecuta o script a cada interação: o hash é calculado uma vez por upload
+            # (id e tamanho do arquivo enviado) e a planilha só é recarregada se o conteúdo mudou
+            upload = (arquivo.id, arquivo.size)
+            if st.session_state.get('upload_planilha') != upload:
+                st.session_state.hash_upload = calcular_hash_arquivo(arquivo)
+                st.session_state.upload_planilha = upload
+            hash_arquivo = st.session_state.hash_upload
+            if st.session_state.get('hash_planilha') != hash_arquivo:
+                with st.spinner("Carregando planilha..."):
+                    engine = carregar_planilha(arquivo, hash_arquivo)
+                    st.session_state.engine = engine
+                    from agent import criar_agente
+                    agente, analytics = criar_agente(engine)
+                    st.session_state.agente = agente
+                    st.session_state.analytics = analytics
+                    st.session_state.hash_planilha = hash_arquivo
+                    st.session_state.dados_carregados = True
+                    obter_catalogo(engine).calcular_perfis_em_segundo_plano()
+                    rollups = obter_rollups(engine)
+                    if rollups is not None:
+                        rollups.atualizar()
+            
+            engine = st.session_state.engine
+            tabelas = obter_catalogo(engine).tabelas()
+            st.sidebar.success("✅ Planilha carregada com sucesso!")
+            st.sidebar.write("📋 Tabelas disponíveis:", tabelas)
+            cache = obter_cache_ingestao().estatisticas()
+            st.sidebar.caption(
+                f"Cache de planilhas: {cache['acertos']} acertos, {cache['falhas']} falhas, "
+                f"{cache['arquivos']} arquivos ({cache['bytes'] / 1024 / 1024:,.1f} MB)"
+            )
+            
+            if st.sidebar.checkbox("👀 Visualizar dados"):
+                df = executar_query(engine, f"SELECT * FROM {tabelas[0]} LIMIT 5")
+                st.sidebar.dataframe(df)
         except Exception as e:
+            st.session_state.pop('hash_planilha', None)
             st.sidebar.error(f"❌ Erro ao carregar planilha: {str(e)}")
 
 # Botão para limpar histórico
 if st.sidebar.button("🗑️ Limpar Histórico"):
-    st.session_state.mensagens = []
+    st.session_state.historico.limpar()
     st.experimental_rerun()
 
 # Área de chat
 st.subheader("Chat com IA")
 
-# Exibir mensagens do chat
-for mensagem in st.session_state.mensagens:
-    exibir_mensagem(mensagem['role'], mensagem['content'], mensagem.get('sql_usado'))
+# Exibir mensagens do chat; as mais antigas só são lidas do disco quando pedidas
+historico = st.session_state.historico
+if historico.em_disco and st.checkbox(f"Mostrar {historico.em_disco} mensagens anteriores"):
+    for mensagem in historico.anteriores():
+        exibir_mensagem(mensagem, historico)
+for mensagem in historico.recentes:
+    exibir_mensagem(mensagem, historico)
 
 # Área de entrada de pergunta
 pergunta = st.text_input(
     "Faça uma pergunta sobre os dados:",
-    placeholder="Ex: Mostre um gráfico de vendas ou faça uma previsão para 2024..."
+    placeholder="Ex: Mostre um gráfico de vendas ou faça uma previsão para os próximos meses..."
 )
 
+def _responder_em_segundo_plano(andamento, agente, engine, analytics, pergunta, sessao):
+    """Roda a pergunta fora do script do Streamlit, que só acompanha `andamento` e pode cancelá-la"""
+    from agent import fazer_pergunta_async
+    
+    async def responder():
+        andamento['loop'] = asyncio.get_running_loop()
+        andamento['tarefa'] = asyncio.current_task()
+        if andamento['cancelada']:
+            raise asyncio.CancelledError
+        return await fazer_pergunta_async(agente, engine, analytics, pergunta,
+                                          ao_receber_token=andamento['tokens'].append)
+    
+    try:
+        with dono_das_consultas(sessao):
+            andamento['resultado'] = asyncio.run(responder())
+    except asyncio.CancelledError:
+        andamento['resultado'] = ("Pergunta cancelada.", None)
+    except Exception as e:
+        andamento['erro'] = e
+
+def cancelar_pergunta():
+    """Interrompe a pergunta em andamento: a tarefa assíncrona (o agente ReAct para antes do
+    próximo passo) e as consultas dela no banco"""
+    andamento = st.session_state.get('pergunta_em_andamento')
+    if andamento is None:
+        return
+    andamento['cancelada'] = True
+    if andamento.get('tarefa') is not None:
+        andamento['loop'].call_soon_threadsafe(andamento['tarefa'].cancel)
+    cancelar_consultas(dono=st.session_state.sessao)
+
 # Botão de enviar
-if st.button("Enviar"):
+if st.button("Enviar") and 'pergunta_em_andamento' not in st.session_state:
     if pergunta:
         if hasattr(st.session_state, 'agente') and hasattr(st.session_state, 'engine'):
-            try:
-                with st.spinner("Analisando sua pergunta..."):
-                    resposta, sql_usado = fazer_pergunta(
-                        st.session_state.agente,
-                        st.session_state.engine,
-                        st.session_state.analytics,
-                        pergunta
-                    )
-                    st.session_state.mensagens.append({
-                        "role": "Usuário",
-                        "content": pergunta
-                    })
-                    st.session_state.mensagens.append({
-                        "role": "Assistente",
-                        "content": resposta,
-                        "sql_usado": sql_usado
-                    })
-                    st.experimental_rerun()
-            except Exception as e:
-                st.error("❌ Erro ao processar pergunta!")
-                with st.expander("Ver detalhes do erro"):
-                    st.error(f"Tipo: {type(e).__name__}")
-                    st.error(f"Mensagem: {str(e)}")
+            andamento = {'pergunta': pergunta, 'tokens': [], 'cancelada': False}
+            andamento['thread'] = threading.Thread(
+                target=_responder_em_segundo_plano, daemon=True,
+                args=(andamento, st.session_state.agente, st.session_state.engine, st.session_state.analytics,
+                      pergunta, st.session_state.sessao))
+            st.session_state.pergunta_em_andamento = andamento
+            andamento['thread'].start()
         else:
             st.error("⚠️ Por favor, conecte-se ao banco de dados ou carregue uma planilha primeiro.")
 
+# Pergunta em andamento: o script só acompanha a thread. Clicar em Cancelar interrompe este
+# acompanhamento, e o callback roda no início da nova execução, com a consulta ainda no banco
+andamento = st.session_state.get('pergunta_em_andamento')
+if andamento is not None:
+    st.button("⏹️ Cancelar", on_click=cancelar_pergunta)
+    parcial = st.empty()
+    with st.spinner("Analisando sua pergunta..."):
+        while andamento['thread'].is_alive():
+            # Uma chamada ao Streamlit por volta: é nela que o clique em Cancelar interrompe o script
+            parcial.markdown(
+                f"<div class='assistant-message'><strong>Assistente:</strong> {''.join(andamento['tokens'])}▌</div>",
+                unsafe_allow_html=True)
+            time.sleep(0.1)
+    del st.session_state.pergunta_em_andamento
+    if 'erro' in andamento:
+        e = andamento['erro']
+        st.error("❌ Erro ao processar pergunta!")
+        with st.expander("Ver detalhes do erro"):
+            st.error(f"Tipo: {type(e).__name__}")
+            st.error(f"Mensagem: {str(e)}")
+    else:
+        resposta, sql_usado = andamento['resultado']
+        st.session_state.historico.adicionar("Usuário", andamento['pergunta'])
+        st.session_state.historico.adicionar("Assistente", resposta, sql_usado)
+        st.experimental_rerun()
+
+# Tempo gasto em cada etapa das últimas perguntas
+rastros = obter_rastreador().ultimos(1)
+if rastros:
+    with st.sidebar.expander("⏱️ Desempenho"):
+        ultimo = rastros[-1]
+        atributos = ultimo['atributos']
+        st.markdown(
+            f"**Última pergunta:** {ultimo['duracao_ms'] / 1000:,.2f} s · "
+            f"{atributos.get('total_tokens', 0):,} tokens"
+        )
+        st.dataframe(pd.DataFrame([
+            {'etapa': span['nome'], 'ms': span['duracao_ms'],
+             'linhas': span.get('linhas'), 'bytes': span.get('bytes')}
+            for span in ultimo['etapas']
+        ]))
+        resumo = obter_rastreador().resumo()
+        st.caption("Histórico da sessão do servidor (ms)")
+        st.dataframe(pd.DataFrame(resumo).T[['contagem', 'p50_ms', 'p95_ms']])
+        previsoes = obter_cache_previsoes().estatisticas
+        st.caption(
+            f"Cache de previsões: {previsoes['acertos_memoria'] + previsoes['acertos_disco']} acertos, "
+            f"{previsoes['falhas']} falhas"
+        )
+        preaquecimento = estado_preaquecimento()
+        if preaquecimento['tempos']:
+            tempos = ', '.join(f"{modulo} {segundos:.1f} s" if segundos is not None else f"{modulo} indisponível"
+                               for modulo, segundos in preaquecimento['tempos'].items())
+            situacao = "concluído" if preaquecimento['concluido'] else "em andamento"
+            st.caption(f"Pré-carregamento {situacao}: {tempos}")
+        rollups = obter_rollups(st.session_state.engine) if 'engine' in st.session_state else None
+        if rollups is not None:
+            st.caption(
+                f"Agregados: {rollups.estatisticas['consultas_respondidas']} consultas respondidas, "
+                f"{rollups.estatisticas['atualizacoes']} atualizações, {rollups.estatisticas['erros']} erros"
+            )
+
 # Exemplos de perguntas
 with st.sidebar.expander("💡 Exemplos de perguntas"):
     st.markdown("""
@@ -220,9 +355,9 @@ with st.sidebar.expander("💡 Exemplos de perguntas"):
     - Mostre um gráfico de barras por material
     
     **Previsões:**
-    - Qual a previsão de vendas para 2024?
+    - Qual a previsão de vendas para os próximos meses?
     - Faça uma previsão do material 300000
-    - Como será a tendência para abril de 2024?
+    - Como será a tendência para o próximo ano?
     """)
 
 # Informações adicionais
@@ -231,7 +366,7 @@ with st.sidebar.expander("ℹ️ Sobre"):
     **Funcionalidades:**
     - Análise de dados via SQL
     - Geração de gráficos
-    - Previsões para 2024
+    - Previsões para os próximos meses
     - Suporte a CSV e Excel
     - Conexão com PostgreSQL
     
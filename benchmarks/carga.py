@@ -0,0 +1,49 @@
+"""Benchmark de carga de planilhas: `df.to_sql` padrão contra `ingestao.carregar_arquivo`.
+
+Uso: python -m benchmarks.carga --linhas 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from benchmarks.dados_sinteticos import escrever_csv_vendas
+from ingestao import carregar_arquivo
+
+def carga_pandas(caminho):
+    inicio = time.perf_counter()
+    engine = create_engine('sqlite:///:memory:', echo=False)
+    df = pd.read_csv(caminho)
+    df.to_sql('dados', engine, index=False, if_exists='replace')
+    return len(df), time.perf_counter() - inicio
+
+def carga_em_lote(caminho):
+    engine = create_engine('sqlite:///:memory:', echo=False)
+    estatisticas = carregar_arquivo(caminho, engine)
+    print(f"{'':>18}  índices {estatisticas['indices']} em {estatisticas['segundos_indices']:.2f} s")
+    return estatisticas['linhas'], estatisticas['segundos']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=1_000_000)
+    parser.add_argument('--sem-pandas', action='store_true', help='não executa a carga de referência com to_sql')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'vendas.csv')
+        escrever_csv_vendas(caminho, args.linhas)
+        tamanho_mb = os.path.getsize(caminho) / 1024 / 1024
+        print(f"Arquivo: {args.linhas:,} linhas, {tamanho_mb:,.1f} MB")
+
+        cargas = [('carregar_arquivo', carga_em_lote)]
+        if not args.sem_pandas:
+            cargas.insert(0, ('pandas to_sql', carga_pandas))
+        for nome, funcao in cargas:
+            linhas, segundos = funcao(caminho)
+            print(f"{nome:>18}: {segundos:8.2f} s  {linhas / segundos:12,.0f} linhas/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+def gerar_vendas(n_linhas, n_materiais=500, n_lojas=50, inicio='2021-01-01', fim='2023-12-31', seed=42):
+    """Gera um DataFrame no formato da tabela `vendas` (data_venda, material, loja, quantidade, valor)"""
+    rng = np.random.default_rng(seed)
+    dias = pd.date_range(inicio, fim, freq='D')
+    datas = dias[rng.integers(0, len(dias), n_linhas)]
+    materiais = 300000 + rng.integers(0, n_materiais, n_linhas)
+    # Sazonalidade anual simples para que as previsões tenham algum sinal
+    sazonal = 1 + 0.3 * np.sin(2 * np.pi * datas.dayofyear.to_numpy() / 365.25)
+    quantidade = rng.poisson(10 * sazonal) + 1
+    preco = 5 + (materiais % 97)
+    return pd.DataFrame({
+        'data_venda': datas.strftime('%Y-%m-%d'),
+        'material': materiais,
+        'loja': rng.integers(1, n_lojas + 1, n_linhas),
+        'quantidade': quantidade,
+        'valor': np.round(quantidade * preco * rng.uniform(0.9, 1.1, n_linhas), 2),
+    })
+
+def escrever_csv_vendas(caminho, n_linhas, tamanho_bloco=1_000_000, seed=42):
+    """Escreve um CSV sintético em blocos, sem manter todas as linhas em memória"""
+    escritas = 0
+    bloco = 0
+    while escritas < n_linhas:
+        n = min(tamanho_bloco, n_linhas - escritas)
+        df = gerar_vendas(n, seed=seed + bloco)
+        df.to_csv(caminho, mode='w' if bloco == 0 else 'a', header=bloco == 0, index=False)
+        escritas += n
+        bloco += 1
+    return caminho
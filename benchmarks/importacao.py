@@ -0,0 +1,90 @@
+"""Benchmark de inicialização: custo de importar cada módulo em um interpretador novo.
+
+Cada módulo é importado em um processo separado com `python -X importtime`; o resultado
+traz o tempo total (p50 entre repetições) e as dependências mais caras de cada um. A entrada
+`inicio_app` corresponde ao que o `app.py` importa antes de desenhar a página.
+
+Uso: python -m benchmarks.importacao --repeticoes 5 --saida importacao.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.suite import _commit_git, resumir
+
+MODULOS = ('pandas', 'sqlalchemy', 'plotly.graph_objects', 'plotly.express', 'prophet', 'langchain.agents',
+           'streamlit', 'database', 'historico', 'previsao', 'analytics', 'agent')
+# Importações do topo do app.py (sem o streamlit, medido à parte)
+INICIO_APP = ('database', 'ingestao', 'cache_previsoes', 'rastreamento', 'historico', 'preaquecimento', 'rollups')
+MAIS_CAROS = 5
+
+_LINHA_IMPORTTIME = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+def medir_importacao(instrucao, raiz):
+    """Executa `instrucao` em um interpretador novo; retorna (segundos, [(modulo, self_us, cumulativo_us, nivel)])"""
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', instrucao], capture_output=True,
+                              text=True, cwd=raiz)
+    if processo.returncode != 0:
+        raise RuntimeError(processo.stderr.strip().splitlines()[-1])
+    modulos = [(m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+               for m in map(_LINHA_IMPORTTIME.match, processo.stderr.splitlines()) if m]
+    # Módulos de nível 0 são os importados diretamente pela instrução
+    total_us = sum(cumulativo for _, _, cumulativo, nivel in modulos if nivel == 0)
+    return total_us / 1e6, modulos
+
+def medir_modulo(instrucao, raiz, repeticoes):
+    duracoes, modulos = [], []
+    for _ in range(repeticoes):
+        segundos, modulos = medir_importacao(instrucao, raiz)
+        duracoes.append(segundos)
+    resultado = resumir(duracoes)
+    pacotes = {}
+    for nome, _, cumulativo, nivel in modulos:
+        # Custo agregado por pacote de primeiro nível (ex.: todos os submódulos de `prophet`)
+        if nivel == 1:
+            raiz_pacote = nome.split('.')[0]
+            pacotes[raiz_pacote] = pacotes.get(raiz_pacote, 0) + cumulativo
+    resultado['mais_caros_ms'] = {nome: round(us / 1000, 1) for nome, us in
+                                  sorted(pacotes.items(), key=lambda item: -item[1])[:MAIS_CAROS]}
+    resultado['modulos_carregados'] = len(modulos)
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modulos', help='lista separada por vírgulas (padrão: todos de MODULOS)')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--saida', help='grava os resultados em JSON')
+    args = parser.parse_args()
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    alvos = {m: f'import {m}' for m in (args.modulos.split(',') if args.modulos else MODULOS)}
+    alvos['inicio_app'] = 'import ' + ', '.join(INICIO_APP)
+    saida = {
+        'data': datetime.now(timezone.utc).isoformat(),
+        'commit': _commit_git(),
+        'plataforma': {'python': platform.python_version(), 'sistema': platform.platform()},
+        'repeticoes': args.repeticoes,
+        'resultados': {},
+    }
+    print(f"{'módulo':<22} {'p50 ms':>9} {'módulos':>8}  dependências mais caras (ms)")
+    for nome, instrucao in alvos.items():
+        try:
+            resultado = medir_modulo(instrucao, raiz, args.repeticoes)
+        except RuntimeError as e:
+            saida['resultados'][nome] = {'erro': str(e)}
+            print(f"{nome:<22} {'erro':>9}  {e}")
+            continue
+        saida['resultados'][nome] = resultado
+        caros = ', '.join(f'{pacote} {ms:.0f}' for pacote, ms in resultado['mais_caros_ms'].items())
+        print(f"{nome:<22} {resultado['p50_ms']:9.1f} {resultado['modulos_carregados']:8d}  {caros}")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
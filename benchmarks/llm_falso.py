@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Mapping, Optional
+
+from langchain.llms.base import LLM
+
+CAMINHO_TRANSCRICOES = os.path.join(os.path.dirname(__file__), 'transcricoes.json')
+_MARCADOR_PERGUNTA = 'Pergunta do usuário:'
+
+def carregar_transcricoes(caminho=CAMINHO_TRANSCRICOES):
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+class LLMReplay(LLM):
+    """LLM determinístico que reproduz transcrições gravadas do agente, sem acesso à rede.
+
+    A pergunta é identificada pelo trecho "Pergunta do usuário:" do prompt e o passo
+    pelo número de observações já presentes no scratchpad do agente ReAct. Prompts sem o
+    formato ReAct (geração de SQL em chamada única) recebem a resposta final gravada.
+    """
+
+    transcricoes: Dict[str, List[str]]
+    latencia_s: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _resposta(self, prompt):
+        if _MARCADOR_PERGUNTA not in prompt:
+            raise ValueError("Prompt sem pergunta do usuário; transcrição não encontrada")
+        depois = prompt.split(_MARCADOR_PERGUNTA, 1)[1]
+        pergunta = depois.split('\n', 1)[0].strip()
+        if pergunta not in self.transcricoes:
+            raise KeyError(f"Sem transcrição gravada para a pergunta: {pergunta!r}")
+        passos = self.transcricoes[pergunta]
+        if 'Action Input:' in prompt:
+            passo = min(len(re.findall(r'\nObservation:', depois)), len(passos) - 1)
+            return passos[passo]
+        # Prompt de chamada única (sem o formato ReAct): texto da resposta final gravada,
+        # com o bloco SQL apenas quando o prompt pede SQL
+        final = passos[-1].split('Final Answer:', 1)[-1].strip()
+        if '```sql' not in prompt:
+            final = re.sub(r'```sql.*?```', '', final, flags=re.DOTALL).strip()
+        return final
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None) -> str:
+        if self.latencia_s:
+            time.sleep(self.latencia_s)
+        return self._resposta(prompt)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None) -> str:
+        resposta = self._resposta(prompt)
+        # Entrega palavra a palavra, como um LLM com streaming
+        pedacos = re.findall(r'\S+\s*', resposta) or [resposta]
+        for pedaco in pedacos:
+            if self.latencia_s:
+                await asyncio.sleep(self.latencia_s / len(pedacos))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(pedaco)
+        return resposta
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"perguntas": sorted(self.transcricoes)}
@@ -0,0 +1,84 @@
+"""Benchmark de previsão: Prophet contra o modelo rápido (tendência + sazonalidade em NumPy).
+
+Separa os últimos meses de cada série mensal sintética como teste e compara erro (sMAPE, MAE),
+cobertura do intervalo de 95% e tempo por série.
+
+Uso: python -m benchmarks.previsao --series 20 --horizonte 12 --saida previsao.json
+"""
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.dados_sinteticos import gerar_vendas
+from previsao import ajustar_prophet, ajustar_rapido_matriz
+
+def series_mensais(n_series, linhas_por_serie=2000, seed=42):
+    """DataFrame com uma coluna por material e uma linha por mês (quantidade vendida)"""
+    vendas = gerar_vendas(n_series * linhas_por_serie, n_materiais=n_series, seed=seed)
+    vendas['ds'] = pd.to_datetime(vendas['data_venda']) + pd.offsets.MonthEnd(0)
+    return vendas.pivot_table(index='ds', columns='material', values='quantidade', aggfunc='sum').fillna(0)
+
+def metricas(real, previsto, inferior, superior):
+    real, previsto = np.asarray(real, dtype=float), np.asarray(previsto, dtype=float)
+    # Real e previsto nulos contam como erro zero
+    smape = np.mean(2 * np.abs(previsto - real) / np.maximum(np.abs(real) + np.abs(previsto), 1e-9))
+    return {
+        'smape': float(smape),
+        'mae': float(np.mean(np.abs(previsto - real))),
+        'cobertura_95': float(np.mean((real >= inferior) & (real <= superior))),
+    }
+
+def resumir(resultados, segundos, n_series):
+    return {
+        'smape': float(np.mean([r['smape'] for r in resultados])),
+        'mae': float(np.mean([r['mae'] for r in resultados])),
+        'cobertura_95': float(np.mean([r['cobertura_95'] for r in resultados])),
+        'segundos': segundos,
+        'ms_por_serie': segundos / n_series * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--series', type=int, default=20)
+    parser.add_argument('--horizonte', type=int, default=12, help='meses separados para teste')
+    parser.add_argument('--sem-prophet', action='store_true', help='mede apenas o modelo rápido')
+    parser.add_argument('--saida', help='grava os resultados em JSON')
+    args = parser.parse_args()
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+
+    tabela = series_mensais(args.series)
+    treino, teste = tabela.iloc[:-args.horizonte], tabela.iloc[-args.horizonte:]
+    print(f"{tabela.shape[1]} séries, {len(treino)} meses de treino, {len(teste)} de teste")
+    saida = {'series': tabela.shape[1], 'meses_treino': len(treino), 'horizonte': len(teste), 'modelos': {}}
+
+    inicio = time.perf_counter()
+    yhat, inferior, superior = ajustar_rapido_matriz(treino.index, treino.to_numpy(), teste.index)
+    segundos = time.perf_counter() - inicio
+    resultados = [metricas(teste.iloc[:, j], yhat[:, j], inferior[:, j], superior[:, j])
+                  for j in range(tabela.shape[1])]
+    saida['modelos']['rapido'] = resumir(resultados, segundos, tabela.shape[1])
+
+    if not args.sem_prophet:
+        resultados = []
+        inicio = time.perf_counter()
+        futuro = pd.DataFrame({'ds': teste.index})
+        for material in tabela.columns:
+            serie = pd.DataFrame({'ds': treino.index, 'y': treino[material].to_numpy()})
+            previsao = ajustar_prophet(serie, futuro)
+            resultados.append(metricas(teste[material], previsao['yhat'], previsao['yhat_lower'],
+                                       previsao['yhat_upper']))
+        saida['modelos']['prophet'] = resumir(resultados, time.perf_counter() - inicio, tabela.shape[1])
+
+    print(f"{'modelo':>8} {'sMAPE':>8} {'MAE':>10} {'cobertura':>10} {'ms/série':>10}")
+    for nome, r in saida['modelos'].items():
+        print(f"{nome:>8} {r['smape']:8.3f} {r['mae']:10.2f} {r['cobertura_95']:10.2f} {r['ms_por_serie']:10.2f}")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
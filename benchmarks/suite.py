@@ -0,0 +1,242 @@
+"""Suíte de benchmark offline: carga, consultas, perguntas ao agente, gráficos e previsões.
+
+O LLM é substituído por `LLMReplay`, que reproduz transcrições gravadas; nada acessa a rede.
+Os resultados (latências p50/p95/p99 em ms e vazão) são gravados em JSON para comparação
+entre commits.
+
+Uso: python -m benchmarks.suite --tamanhos 10000,1000000 --saida resultados.json
+     python -m benchmarks.suite --tamanhos 10000 --comparar resultados_base.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.dados_sinteticos import escrever_csv_vendas
+from benchmarks.llm_falso import LLMReplay, carregar_transcricoes
+
+# Consultas representativas do que o agente gera sobre a tabela de vendas
+CONSULTAS = {
+    'agregacao_mensal': (
+        "SELECT strftime('%Y-%m', data_venda) AS mes, SUM(quantidade) AS quantidade, SUM(valor) AS valor "
+        "FROM dados GROUP BY mes ORDER BY mes"),
+    'filtro_material': (
+        "SELECT data_venda AS data, SUM(quantidade) AS quantidade FROM dados "
+        "WHERE material = 300000 GROUP BY data_venda ORDER BY data_venda"),
+    'ranking_lojas': "SELECT loja, SUM(valor) AS valor FROM dados GROUP BY loja ORDER BY valor DESC LIMIT 10",
+    'historico_mensal': (
+        "SELECT date(data_venda, 'start of month') AS data, SUM(quantidade) AS quantidade FROM dados "
+        "WHERE material = 300000 GROUP BY 1 ORDER BY 1"),
+    'varredura': "SELECT * FROM dados LIMIT 100000",
+    'serie_diaria': "SELECT date(data_venda) AS data, SUM(quantidade) AS quantidade FROM dados GROUP BY 1 ORDER BY 1",
+}
+# Séries mensais dos primeiros materiais, para a previsão em lote
+CONSULTA_MENSAL_POR_MATERIAL = (
+    "SELECT material, date(data_venda, 'start of month') AS data, SUM(quantidade) AS quantidade FROM dados "
+    "WHERE material < 300000 + {series} GROUP BY 1, 2")
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    posicao = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[posicao]
+
+def resumir(duracoes_s, linhas=None):
+    """Estatísticas de uma medição; `linhas` permite calcular a vazão em linhas/s"""
+    ms = [d * 1000 for d in duracoes_s]
+    resumo = {
+        'repeticoes': len(ms),
+        'p50_ms': round(_percentil(ms, 50), 3),
+        'p95_ms': round(_percentil(ms, 95), 3),
+        'p99_ms': round(_percentil(ms, 99), 3),
+        'media_ms': round(sum(ms) / len(ms), 3),
+        'min_ms': round(min(ms), 3),
+        'max_ms': round(max(ms), 3),
+    }
+    if linhas is not None:
+        resumo['linhas'] = linhas
+        resumo['linhas_por_segundo'] = round(linhas / (_percentil(duracoes_s, 50) or 1e-9), 1)
+    return resumo
+
+def medir(funcao, repeticoes, aquecimento=1):
+    """Executa `funcao` e retorna (duracoes em segundos, último resultado)"""
+    resultado = None
+    for _ in range(aquecimento):
+        resultado = funcao()
+    duracoes = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        duracoes.append(time.perf_counter() - inicio)
+    return duracoes, resultado
+
+def _commit_git():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return None
+
+def executar_tamanho(caminho, n_linhas, repeticoes, previsao=True, latencia_llm=0.0, series_lote=8):
+    """Mede todas as etapas para um arquivo sintético de `n_linhas` linhas"""
+    from agent import criar_agente, fazer_pergunta
+    from database import carregar_planilha, executar_query, obter_catalogo
+
+    resultados = {}
+    duracoes, engine = medir(lambda: carregar_planilha(caminho, usar_cache=False), repeticoes, aquecimento=0)
+    resultados['carregar_planilha'] = resumir(duracoes, n_linhas)
+
+    for nome, sql in CONSULTAS.items():
+        duracoes, df = medir(lambda: executar_query(engine, sql), repeticoes)
+        resultados[f'executar_query.{nome}'] = resumir(duracoes, len(df))
+
+    # Mesmas consultas sobre a planilha em cache, respondidas pelos agregados quando possível
+    from rollups import obter_rollups
+    em_cache = carregar_planilha(caminho)
+    rollups = obter_rollups(em_cache)
+    if rollups is not None:
+        tabelas = obter_catalogo(em_cache).tabelas()
+        duracoes, _ = medir(lambda: rollups.atualizar(tabelas, bloquear=True), 1, aquecimento=0)
+        resultados['rollups.construir'] = resumir(duracoes, n_linhas)
+        for nome, sql in CONSULTAS.items():
+            if executar_query(em_cache, sql).attrs.get('rollup'):
+                duracoes, df = medir(lambda: executar_query(em_cache, sql), repeticoes)
+                resultados[f'executar_query.rollup.{nome}'] = resumir(duracoes, len(df))
+
+    llm = LLMReplay(transcricoes=carregar_transcricoes(), latencia_s=latencia_llm)
+    agente, analytics = criar_agente(engine, llm=llm)
+    for pergunta in llm.transcricoes:
+        if not previsao and any(p in pergunta.lower() for p in ('previsão', 'prever')):
+            continue
+        # Chamada única ao LLM (padrão) e o ciclo ReAct completo
+        for nome, modo_rapido in (('fazer_pergunta', True), ('fazer_pergunta_agente', False)):
+            duracoes, (resposta, sql) = medir(
+                lambda: fazer_pergunta(agente, engine, analytics, pergunta, usar_cache=False,
+                                       modo_rapido=modo_rapido), repeticoes)
+            if sql is None:
+                raise RuntimeError(f"Pergunta sem SQL no benchmark: {pergunta!r}: {resposta[:200]}")
+            resultados[f'{nome}.{pergunta}'] = resumir(duracoes)
+
+    serie = executar_query(engine, CONSULTAS['filtro_material'])
+    duracoes, html = medir(lambda: analytics.gerar_grafico(serie, 'linha'), repeticoes)
+    resultados['gerar_grafico.linha'] = resumir(duracoes, len(serie))
+    resultados['gerar_grafico.linha']['bytes_html'] = len(html.encode('utf-8'))
+
+    # Série já lida: só o último período volta do banco
+    from series_previsao import SeriesIncrementais
+    series = SeriesIncrementais(engine)
+    series.obter(CONSULTAS['serie_diaria'])
+    duracoes, df = medir(lambda: series.obter(CONSULTAS['serie_diaria']), repeticoes)
+    resultados['series_incremental.serie_diaria'] = resumir(duracoes, len(df))
+
+    if previsao:
+        from cache_previsoes import obter_cache_previsoes
+        cache_previsoes = obter_cache_previsoes()
+        mensal = executar_query(engine, CONSULTAS['historico_mensal'])
+        
+        def previsao_sem_cache():
+            cache_previsoes.limpar()
+            return analytics.fazer_previsao(mensal)
+        
+        duracoes, _ = medir(previsao_sem_cache, repeticoes)
+        resultados['fazer_previsao'] = resumir(duracoes, len(mensal))
+        duracoes, _ = medir(lambda: analytics.fazer_previsao(mensal), repeticoes)
+        resultados['fazer_previsao.cache'] = resumir(duracoes, len(mensal))
+        
+        # Prophet na série diária, com e sem os parâmetros do ajuste sem a última semana
+        sql_diaria = CONSULTAS['serie_diaria']
+        diaria = executar_query(engine, sql_diaria)
+        cache_previsoes.limpar()
+        analytics.fazer_previsao(diaria.iloc[:-7], modelo='prophet', chave_serie=sql_diaria)
+        parametros = cache_previsoes.parametros(sql_diaria)
+        
+        def previsao_prophet(inicial):
+            cache_previsoes.limpar()
+            if inicial is not None:
+                cache_previsoes.armazenar_parametros(sql_diaria, inicial)
+            return analytics.fazer_previsao(diaria, modelo='prophet', chave_serie=sql_diaria)
+        
+        duracoes, _ = medir(lambda: previsao_prophet(None), repeticoes)
+        resultados['fazer_previsao.prophet'] = resumir(duracoes, len(diaria))
+        duracoes, _ = medir(lambda: previsao_prophet(parametros), repeticoes)
+        resultados['fazer_previsao.prophet_warm_start'] = resumir(duracoes, len(diaria))
+        
+        por_material = executar_query(engine, CONSULTA_MENSAL_POR_MATERIAL.format(series=series_lote))
+        cache_previsoes.limpar()
+        duracoes, (_, metricas) = medir(
+            lambda: analytics.prever_em_lote(por_material, 'material'), 1, aquecimento=0)
+        resultados['prever_em_lote'] = resumir(duracoes, len(por_material))
+        resultados['prever_em_lote'].update(series=metricas['previstas'], processos=metricas['processos'])
+    return resultados
+
+def comparar(atual, base):
+    """Variação percentual do p50 de cada medição presente nos dois resultados"""
+    linhas = []
+    for tamanho, medicoes in atual['tamanhos'].items():
+        anteriores = base.get('tamanhos', {}).get(tamanho, {})
+        for nome, resumo in medicoes.items():
+            if nome in anteriores and anteriores[nome]['p50_ms']:
+                variacao = (resumo['p50_ms'] / anteriores[nome]['p50_ms'] - 1) * 100
+                linhas.append(f"{tamanho:>10} {nome:<60} {anteriores[nome]['p50_ms']:>10.1f} "
+                              f"{resumo['p50_ms']:>10.1f} {variacao:>+8.1f}%")
+    return linhas
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tamanhos', default='10000,100000',
+                        help='linhas dos arquivos sintéticos, separadas por vírgula (ex.: 10000,1000000,50000000)')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--saida', default='resultados_benchmark.json')
+    parser.add_argument('--sem-previsao', action='store_true', help='não mede fazer_previsao (Prophet é lento)')
+    parser.add_argument('--series-lote', type=int, default=8, help='materiais previstos por prever_em_lote')
+    parser.add_argument('--latencia-llm', type=float, default=0.0,
+                        help='atraso simulado, em segundos, por chamada ao LLM')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior para comparar os p50')
+    args = parser.parse_args()
+
+    # Os rastros das perguntas do benchmark não devem poluir o arquivo do usuário
+    from rastreamento import obter_rastreador
+    obter_rastreador().caminho = None
+
+    saida = {
+        'metadados': {
+            'commit': _commit_git(),
+            'python': sys.version.split()[0],
+            'plataforma': platform.platform(),
+            'processadores': os.cpu_count(),
+            'data': datetime.now(timezone.utc).isoformat(),
+            'repeticoes': args.repeticoes,
+            'latencia_llm_s': args.latencia_llm,
+        },
+        'tamanhos': {},
+    }
+    with tempfile.TemporaryDirectory() as pasta:
+        # Previsões medidas sem o cache do usuário
+        os.environ['AGENTE_CACHE_PREVISOES'] = os.path.join(pasta, 'previsoes')
+        for n_linhas in (int(t) for t in args.tamanhos.split(',')):
+            caminho = os.path.join(pasta, f'vendas_{n_linhas}.csv')
+            escrever_csv_vendas(caminho, n_linhas)
+            print(f"{n_linhas:,} linhas ({os.path.getsize(caminho) / 1024 / 1024:,.1f} MB)")
+            resultados = executar_tamanho(caminho, n_linhas, args.repeticoes, not args.sem_previsao,
+                                          args.latencia_llm, args.series_lote)
+            saida['tamanhos'][str(n_linhas)] = resultados
+            for nome, resumo in resultados.items():
+                print(f"  {nome:<60} p50 {resumo['p50_ms']:>10.1f} ms  p95 {resumo['p95_ms']:>10.1f} ms")
+            os.remove(caminho)
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(saida, f, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em {args.saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        print(f"{'tamanho':>10} {'medição':<60} {'base p50':>10} {'atual p50':>10} {'variação':>9}")
+        print('\n'.join(comparar(saida, base)))
+
+if __name__ == '__main__':
+    main()
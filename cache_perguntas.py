@@ -0,0 +1,131 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from indice_texto import IndiceTfidf, normalizar_texto
+
+# Cache local pergunta -> SQL validado, compartilhado por todas as sessões do processo
+CAMINHO_CACHE_PERGUNTAS = os.getenv(
+    'AGENTE_CACHE_PERGUNTAS', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'perguntas.sqlite'))
+MAX_ENTRADAS_PADRAO = 2000
+TTL_PADRAO = 7 * 24 * 3600
+SIMILARIDADE_MINIMA = 0.9
+
+def _literais(normalizada):
+    # Perguntas parecidas com números diferentes ("material 300000" x "300001") pedem SQL diferente
+    return sorted(re.findall(r'\d+', normalizada))
+
+class CachePerguntas:
+    """Mapeia perguntas normalizadas para o SQL que já foi executado com sucesso.
+
+    A chave inclui a versão do schema, então mudanças nas tabelas invalidam as entradas.
+    Perguntas quase idênticas são encontradas por similaridade TF-IDF local.
+    """
+
+    def __init__(self, caminho=CAMINHO_CACHE_PERGUNTAS, max_entradas=MAX_ENTRADAS_PADRAO, ttl=TTL_PADRAO,
+                 similaridade_minima=SIMILARIDADE_MINIMA):
+        os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.similaridade_minima = similaridade_minima
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute('PRAGMA journal_mode=WAL')
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS perguntas (
+                chave TEXT PRIMARY KEY,
+                versao_schema TEXT NOT NULL,
+                pergunta TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL,
+                acertos INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conexao.execute('CREATE INDEX IF NOT EXISTS idx_perguntas_versao ON perguntas (versao_schema)')
+        self._conexao.commit()
+        self.estatisticas = {'acertos': 0, 'acertos_similares': 0, 'falhas': 0}
+
+    @staticmethod
+    def _chave(normalizada, versao_schema):
+        return hashlib.sha256(f'{versao_schema}\n{normalizada}'.encode('utf-8')).hexdigest()
+
+    def _expirar(self, agora):
+        if self.ttl is not None:
+            self._conexao.execute('DELETE FROM perguntas WHERE criado_em < ?', (agora - self.ttl,))
+
+    def _buscar_similar(self, normalizada, versao_schema):
+        linhas = self._conexao.execute(
+            'SELECT chave, pergunta FROM perguntas WHERE versao_schema = ?', (versao_schema,)).fetchall()
+        literais = _literais(normalizada)
+        indice = IndiceTfidf()
+        for chave, pergunta in linhas:
+            if _literais(pergunta) == literais:
+                indice.adicionar(chave, pergunta)
+        for chave, similaridade in indice.buscar(normalizada, limite=1):
+            if similaridade >= self.similaridade_minima:
+                return chave, similaridade
+        return None
+
+    def buscar(self, pergunta, versao_schema, similares=True):
+        """Retorna {'chave', 'sql', 'similaridade'} para a pergunta, ou None"""
+        normalizada = normalizar_texto(pergunta)
+        chave = self._chave(normalizada, versao_schema)
+        agora = time.time()
+        with self._lock:
+            self._expirar(agora)
+            similaridade = 1.0
+            linha = self._conexao.execute('SELECT sql FROM perguntas WHERE chave = ?', (chave,)).fetchone()
+            if linha is None and similares:
+                encontrada = self._buscar_similar(normalizada, versao_schema)
+                if encontrada:
+                    chave, similaridade = encontrada
+                    linha = self._conexao.execute('SELECT sql FROM perguntas WHERE chave = ?', (chave,)).fetchone()
+            if linha is None:
+                self.estatisticas['falhas'] += 1
+                self._conexao.commit()
+                return None
+            self._conexao.execute(
+                'UPDATE perguntas SET acessado_em = ?, acertos = acertos + 1 WHERE chave = ?', (agora, chave))
+            self._conexao.commit()
+            self.estatisticas['acertos' if similaridade == 1.0 else 'acertos_similares'] += 1
+            return {'chave': chave, 'sql': linha[0], 'similaridade': similaridade}
+
+    def armazenar(self, pergunta, versao_schema, sql):
+        normalizada = normalizar_texto(pergunta)
+        agora = time.time()
+        with self._lock:
+            self._conexao.execute(
+                'INSERT OR REPLACE INTO perguntas (chave, versao_schema, pergunta, sql, criado_em, acessado_em) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self._chave(normalizada, versao_schema), versao_schema, normalizada, sql, agora, agora))
+            # Descarte LRU: mantém apenas as entradas acessadas mais recentemente
+            self._conexao.execute(
+                'DELETE FROM perguntas WHERE chave NOT IN '
+                '(SELECT chave FROM perguntas ORDER BY acessado_em DESC LIMIT ?)', (self.max_entradas,))
+            self._conexao.commit()
+
+    def descartar(self, chave):
+        """Remove uma entrada, por exemplo quando o SQL em cache deixou de executar"""
+        with self._lock:
+            self._conexao.execute('DELETE FROM perguntas WHERE chave = ?', (chave,))
+            self._conexao.commit()
+
+    def limpar(self):
+        with self._lock:
+            self._conexao.execute('DELETE FROM perguntas')
+            self._conexao.commit()
+
+_cache_perguntas = None
+_cache_perguntas_lock = threading.Lock()
+
+def obter_cache_perguntas():
+    """Cache de perguntas compartilhado pelo processo"""
+    global _cache_perguntas
+    with _cache_perguntas_lock:
+        if _cache_perguntas is None:
+            _cache_perguntas = CachePerguntas()
+        return _cache_perguntas
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Previsões já calculadas, por impressão digital da série histórica
+PASTA_CACHE_PREVISOES = os.getenv(
+    'AGENTE_CACHE_PREVISOES', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'previsoes'))
+MAX_ENTRADAS_MEMORIA = 64
+TAMANHO_MAX_DISCO_PADRAO = 256 * 1024 * 1024
+
+def chave_previsao(serie, futuro, configuracao):
+    """Hash da série (`ds`, `y`), das datas a prever e da configuração do modelo"""
+    h = hashlib.sha256()
+    h.update(pd.to_datetime(serie['ds']).to_numpy(dtype='datetime64[ns]').view(np.int64).tobytes())
+    h.update(np.ascontiguousarray(serie['y'].to_numpy(dtype=np.float64)).tobytes())
+    h.update(pd.to_datetime(futuro['ds']).to_numpy(dtype='datetime64[ns]').view(np.int64).tobytes())
+    h.update(json.dumps(configuracao, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+class CachePrevisoes:
+    """Guarda o DataFrame de previsão (ds, yhat, yhat_lower, yhat_upper) em dois níveis.
+
+    O nível em memória é um LRU com até `max_memoria` entradas; o nível em disco é
+    compartilhado entre processos e limitado por tamanho, com descarte LRU por data de acesso.
+    Guarda também, só em memória, os parâmetros do último ajuste do Prophet de cada série
+    (`parametros`), usados como ponto de partida quando a série ganha pontos novos.
+    """
+
+    EXTENSAO = '.pkl'
+
+    def __init__(self, pasta=PASTA_CACHE_PREVISOES, max_memoria=MAX_ENTRADAS_MEMORIA,
+                 tamanho_maximo=TAMANHO_MAX_DISCO_PADRAO):
+        self.pasta = pasta
+        self.max_memoria = max_memoria
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+        self._memoria = OrderedDict()
+        self._parametros = OrderedDict()
+        self.estatisticas = {'acertos_memoria': 0, 'acertos_disco': 0, 'falhas': 0, 'descartes': 0}
+        os.makedirs(self.pasta, exist_ok=True)
+
+    def caminho(self, chave):
+        return os.path.join(self.pasta, chave + self.EXTENSAO)
+
+    def _guardar_em_memoria(self, chave, previsao):
+        self._memoria[chave] = previsao
+        self._memoria.move_to_end(chave)
+        while len(self._memoria) > self.max_memoria:
+            self._memoria.popitem(last=False)
+
+    def obter(self, chave):
+        """Cópia da previsão em cache, ou None"""
+        with self._lock:
+            if chave in self._memoria:
+                self._memoria.move_to_end(chave)
+                self.estatisticas['acertos_memoria'] += 1
+                return self._memoria[chave].copy()
+        caminho = self.caminho(chave)
+        try:
+            previsao = pd.read_pickle(caminho)
+            # Atualiza a data de acesso usada pelo descarte LRU
+            os.utime(caminho)
+        except (OSError, ValueError, EOFError):
+            with self._lock:
+                self.estatisticas['falhas'] += 1
+            return None
+        with self._lock:
+            self._guardar_em_memoria(chave, previsao)
+            self.estatisticas['acertos_disco'] += 1
+        return previsao.copy()
+
+    def armazenar(self, chave, previsao):
+        previsao = previsao.reset_index(drop=True)
+        with self._lock:
+            self._guardar_em_memoria(chave, previsao)
+        caminho = self.caminho(chave)
+        temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+        previsao.to_pickle(temporario)
+        os.replace(temporario, caminho)
+        self.descartar_excedente(manter=caminho)
+
+    def parametros(self, chave_serie):
+        """Parâmetros do último ajuste da série, ou None"""
+        with self._lock:
+            if chave_serie not in self._parametros:
+                return None
+            self._parametros.move_to_end(chave_serie)
+            return self._parametros[chave_serie]
+
+    def armazenar_parametros(self, chave_serie, parametros):
+        with self._lock:
+            self._parametros[chave_serie] = parametros
+            self._parametros.move_to_end(chave_serie)
+            while len(self._parametros) > self.max_memoria:
+                self._parametros.popitem(last=False)
+
+    def _entradas(self):
+        entradas = []
+        for nome in os.listdir(self.pasta):
+            if not nome.endswith(self.EXTENSAO):
+                continue
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, caminho))
+        return sorted(entradas)
+
+    def descartar_excedente(self, manter=None):
+        """Remove as previsões menos usadas até o disco caber em `tamanho_maximo`"""
+        entradas = self._entradas()
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in entradas:
+            if total <= self.tamanho_maximo:
+                break
+            if caminho == manter:
+                continue
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+            with self._lock:
+                self.estatisticas['descartes'] += 1
+
+    def limpar(self):
+        with self._lock:
+            self._memoria.clear()
+            self._parametros.clear()
+        for _, _, caminho in self._entradas():
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+
+_cache_previsoes = None
+_cache_previsoes_lock = threading.Lock()
+
+def obter_cache_previsoes():
+    """Cache de previsões compartilhado pelo processo"""
+    global _cache_previsoes
+    with _cache_previsoes_lock:
+        if _cache_previsoes is None:
+            _cache_previsoes = CachePrevisoes()
+        return _cache_previsoes
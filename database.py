@@ -1,31 +1,565 @@
+import contextvars
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+
 import pandas as pd
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine, event, exc, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from indice_texto import IndiceTfidf
+from perfil import TTL_PERFIL_PADRAO, assinatura, atualizar_perfil, calcular_perfil
+from ingestao import carregar_arquivo, calcular_hash_arquivo, obter_cache_ingestao, MMAP_CACHE_BYTES
+
+# Tempo (em segundos) que os metadados do catálogo ficam válidos em memória
+TTL_CATALOGO_PADRAO = 300
+
+# Consultas executadas em lotes para não manter o resultado inteiro duas vezes em memória
+TAMANHO_LOTE_PADRAO = 10_000
+LIMITE_LINHAS_PADRAO = 500_000
+LIMITE_BYTES_PADRAO = 256 * 1024 * 1024
+
+# Gráficos: a agregação por período é feita no banco, com no máximo ~PONTOS_ALVO_GRAFICO pontos
+PONTOS_ALVO_GRAFICO = 400
+DIAS_POR_BALDE = {'dia': 1, 'semana': 7, 'mes': 30.44, 'ano': 365.25}
+_TRUNC_POSTGRES = {'dia': 'day', 'semana': 'week', 'mes': 'month', 'ano': 'year'}
+_TRUNC_SQLITE = {
+    'dia': "date({})",
+    'semana': "date({}, 'weekday 0', '-6 days')",
+    'mes': "date({}, 'start of month')",
+    'ano': "date({}, 'start of year')",
+}
+
+# Conexões simultâneas ao banco da planilha (gráficos, previsões e prévias em threads)
+TAMANHO_POOL_PLANILHA = 8
+MAX_OVERFLOW_PLANILHA = 8
+
+# Pool do PostgreSQL compartilhado por todas as sessões que usam a mesma string de conexão
+TAMANHO_POOL_POSTGRES = int(os.getenv('AGENTE_POOL_SIZE', 5))
+MAX_OVERFLOW_POSTGRES = int(os.getenv('AGENTE_POOL_MAX_OVERFLOW', 10))
+TIMEOUT_POOL_SEGUNDOS = int(os.getenv('AGENTE_POOL_TIMEOUT', 30))
+RECICLAR_CONEXAO_SEGUNDOS = 1800
+TIMEOUT_STATEMENT_MS = int(os.getenv('AGENTE_STATEMENT_TIMEOUT_MS', 60_000))
+# No SQLite o prazo da consulta é verificado a cada PASSOS_PROGRESSO_SQLITE instruções da VM
+PASSOS_PROGRESSO_SQLITE = 10_000
+
+class CatalogoSchema:
+    """Cache em memória das tabelas e colunas de um engine.
+
+    A introspecção é feita uma única vez e reaproveitada até o TTL expirar
+    ou até `invalidar()` ser chamado.
+    """
+
+    def __init__(self, engine, ttl=TTL_CATALOGO_PADRAO, ttl_perfil=TTL_PERFIL_PADRAO):
+        # Referência fraca: o registro de catálogos não deve manter o engine vivo
+        self._engine = weakref.ref(engine)
+        self.ttl = ttl
+        self.ttl_perfil = ttl_perfil
+        self._lock = threading.Lock()
+        self._lock_perfis = threading.Lock()
+        self._tabelas = None
+        self._colunas = {}
+        self._indice = None
+        self._perfis = {}
+        self._falhas_perfil = {}
+        self._perfis_pendentes = set()
+        self._thread_perfis = None
+        self._carregado_em = 0.0
+
+    @property
+    def engine(self):
+        return self._engine()
+
+    def _expirado(self):
+        if self._tabelas is None:
+            return True
+        return self.ttl is not None and time.monotonic() - self._carregado_em > self.ttl
+
+    def _carregar(self):
+        inspector = inspect(self.engine)
+        tabelas = inspector.get_table_names()
+        # get_multi_columns busca todas as colunas em uma única consulta ao catálogo
+        colunas = {tabela: [] for tabela in tabelas}
+        for (_, tabela), cols in inspector.get_multi_columns().items():
+            if tabela in colunas:
+                colunas[tabela] = cols
+        self._tabelas = tabelas
+        self._colunas = colunas
+        self._indice = None
+        self._carregado_em = time.monotonic()
+
+    def _garantir_carregado(self):
+        with self._lock:
+            if self._expirado():
+                self._carregar()
+
+    def invalidar(self):
+        """Descarta os metadados; a próxima leitura refaz a introspecção"""
+        with self._lock:
+            self._tabelas = None
+            self._colunas = {}
+            self._indice = None
+        with self._lock_perfis:
+            self._perfis = {}
+            self._falhas_perfil = {}
+            self._perfis_pendentes = set()
+
+    def tabelas(self):
+        self._garantir_carregado()
+        return list(self._tabelas)
+
+    def colunas(self, tabela):
+        self._garantir_carregado()
+        return self._colunas.get(tabela, [])
+
+    def schemas(self):
+        self._garantir_carregado()
+        return {tabela: self._colunas[tabela] for tabela in self._tabelas}
+
+    def indice(self):
+        """Índices TF-IDF (tabelas, colunas) sobre os nomes do schema, construídos uma vez por carga"""
+        self._garantir_carregado()
+        with self._lock:
+            if self._indice is None:
+                tabelas, colunas = IndiceTfidf(), IndiceTfidf()
+                for tabela in self._tabelas:
+                    nomes = [col['name'] for col in self._colunas[tabela]]
+                    tabelas.adicionar(tabela, ' '.join([tabela, tabela] + nomes))
+                    for nome in nomes:
+                        colunas.adicionar((tabela, nome), nome)
+                self._indice = (tabelas, colunas)
+            return self._indice
+
+    def perfil(self, tabela):
+        """Perfil da tabela (veja `perfil.calcular_perfil`), ou None se não puder ser calculado.
+
+        Calculado na primeira leitura; depois do `ttl_perfil` só as linhas novas são agregadas.
+        Mudanças nas colunas da tabela refazem o perfil inteiro.
+        """
+        colunas = self.colunas(tabela)
+        if not colunas:
+            return None
+        # Um perfil por vez: a primeira varredura de uma tabela grande não é repetida em paralelo
+        with self._lock_perfis:
+            perfil = self._perfis.get(tabela)
+            falha = self._falhas_perfil.get(tabela)
+            if falha is not None and self.ttl_perfil is not None and time.monotonic() - falha < self.ttl_perfil:
+                return perfil
+            try:
+                if perfil is None or perfil['assinatura'] != assinatura(colunas):
+                    perfil = calcular_perfil(self.engine, tabela, colunas)
+                elif self.ttl_perfil is not None and time.monotonic() - perfil['atualizado_em'] > self.ttl_perfil:
+                    perfil = atualizar_perfil(self.engine, perfil, colunas)
+            except exc.SQLAlchemyError:
+                # Sem perfil, gráficos e prompts voltam às heurísticas por nome de coluna;
+                # nova tentativa só depois do `ttl_perfil`
+                self._falhas_perfil[tabela] = time.monotonic()
+                return perfil
+            self._falhas_perfil.pop(tabela, None)
+            self._perfis[tabela] = perfil
+            return perfil
+
+    def perfis(self, tabelas=None):
+        """{tabela: perfil} das tabelas informadas (todas, por padrão)"""
+        return {tabela: self.perfil(tabela) for tabela in (tabelas if tabelas is not None else self.tabelas())}
+
+    def _calcular_pendentes(self):
+        while True:
+            with self._lock:
+                if not self._perfis_pendentes:
+                    self._thread_perfis = None
+                    return
+                tabela = self._perfis_pendentes.pop()
+            try:
+                self.perfil(tabela)
+            except Exception:
+                # Tabela removida ou catálogo indisponível: os demais perfis continuam
+                pass
+
+    def calcular_perfis_em_segundo_plano(self, tabelas=None):
+        """Calcula os perfis das tabelas (todas, por padrão) em uma thread, sem esperar"""
+        tabelas = list(tabelas) if tabelas is not None else self.tabelas()
+        with self._lock:
+            self._perfis_pendentes.update(tabelas)
+            if self._thread_perfis is None and self._perfis_pendentes:
+                self._thread_perfis = threading.Thread(target=self._calcular_pendentes, name='perfis', daemon=True)
+                self._thread_perfis.start()
+
+    def perfis_disponiveis(self, tabelas=None):
+        """{tabela: perfil} já calculados, sem consultar o banco.
+
+        Usado no caminho das perguntas: perfis ausentes ou vencidos são calculados em segundo
+        plano e entram nas perguntas seguintes.
+        """
+        tabelas = list(tabelas) if tabelas is not None else self.tabelas()
+        perfis = dict(self._perfis)
+        agora = time.monotonic()
+        disponiveis, faltantes = {}, []
+        for tabela in tabelas:
+            perfil = perfis.get(tabela)
+            if perfil is not None:
+                disponiveis[tabela] = perfil
+            if perfil is None or perfil['assinatura'] != assinatura(self.colunas(tabela)) or (
+                    self.ttl_perfil is not None and agora - perfil['atualizado_em'] > self.ttl_perfil):
+                faltantes.append(tabela)
+        if faltantes:
+            self.calcular_perfis_em_segundo_plano(faltantes)
+        return disponiveis
+
+    def versao(self):
+        """Hash do dialeto, tabelas e colunas; muda sempre que o schema muda"""
+        partes = [self.engine.dialect.name]
+        for tabela, colunas in sorted(self.schemas().items()):
+            partes.append(tabela + ':' + ','.join(f"{col['name']} {col['type']}" for col in colunas))
+        return hashlib.sha256('\n'.join(partes).encode('utf-8')).hexdigest()[:16]
+
+_catalogos = weakref.WeakKeyDictionary()
+_catalogos_lock = threading.Lock()
+
+def obter_catalogo(engine):
+    """Retorna o catálogo de schema associado ao engine, criando-o se necessário"""
+    with _catalogos_lock:
+        catalogo = _catalogos.get(engine)
+        if catalogo is None:
+            catalogo = CatalogoSchema(engine)
+            _catalogos[engine] = catalogo
+        return catalogo
+
+class QueuePoolMedido(QueuePool):
+    """QueuePool que registra quanto tempo as sessões esperam por uma conexão livre"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self._metricas = {'checkouts': 0, 'espera_total_s': 0.0, 'espera_max_s': 0.0, 'timeouts': 0}
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        esgotou = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            esgotou = True
+            raise
+        finally:
+            espera = time.perf_counter() - inicio
+            with self._lock_metricas:
+                self._metricas['checkouts'] += 1
+                self._metricas['espera_total_s'] += espera
+                self._metricas['espera_max_s'] = max(self._metricas['espera_max_s'], espera)
+                self._metricas['timeouts'] += esgotou
+
+    def metricas(self):
+        with self._lock_metricas:
+            return dict(self._metricas)
+
+_engines_postgres = {}
+_engines_postgres_lock = threading.Lock()
+
+def obter_engine_postgres(connection_string, pool_size=TAMANHO_POOL_POSTGRES,
+                          max_overflow=MAX_OVERFLOW_POSTGRES, statement_timeout_ms=TIMEOUT_STATEMENT_MS):
+    """Retorna o engine do processo para a string de conexão, criando-o na primeira chamada.
+
+    Os parâmetros de pool só valem para a criação; chamadas seguintes reutilizam o engine existente.
+    """
+    with _engines_postgres_lock:
+        engine = _engines_postgres.get(connection_string)
+        if engine is not None:
+            return engine
+
+        connect_args = {}
+        if make_url(connection_string).get_backend_name() == 'postgresql' and statement_timeout_ms:
+            # Aplicado pelo libpq ao abrir cada conexão, vale para todos os comandos da sessão
+            connect_args['options'] = f'-c statement_timeout={int(statement_timeout_ms)}'
+
+        engine = create_engine(
+            connection_string,
+            poolclass=QueuePoolMedido,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=TIMEOUT_POOL_SEGUNDOS,
+            pool_recycle=RECICLAR_CONEXAO_SEGUNDOS,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+        )
+        _engines_postgres[connection_string] = engine
+        return engine
+
+def metricas_pool(engine):
+    """Estado atual do pool do engine: conexões em uso, ociosas e tempo de espera"""
+    pool = engine.pool
+    metricas = {}
+    if isinstance(pool, QueuePool):
+        metricas.update({
+            'tamanho': pool.size(),
+            'em_uso': pool.checkedout(),
+            'ociosas': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+    if isinstance(pool, QueuePoolMedido):
+        metricas.update(pool.metricas())
+        checkouts = metricas['checkouts']
+        metricas['espera_media_s'] = metricas['espera_total_s'] / checkouts if checkouts else 0.0
+    return metricas
 
 def carregar_dados_do_postgres(connection_string):
-    engine = create_engine(connection_string)
+    return obter_engine_postgres(connection_string)
+
+def _criar_engine_sqlite(url):
+    return create_engine(
+        url,
+        echo=False,
+        poolclass=QueuePool,
+        pool_size=TAMANHO_POOL_PLANILHA,
+        max_overflow=MAX_OVERFLOW_PLANILHA,
+        connect_args={'check_same_thread': False},
+    )
+
+def _criar_engine_memoria_compartilhada():
+    """SQLite em memória com cache compartilhado, visível por todas as conexões do pool.
+
+    `sqlite:///:memory:` cria um banco por conexão, então outras threads viam um banco vazio.
+    """
+    nome = f'planilha_{uuid.uuid4().hex}'
+    uri = f'file:{nome}?mode=memory&cache=shared'
+    # O banco existe enquanto houver uma conexão aberta: a âncora vive junto com o engine
+    ancora = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    engine = _criar_engine_sqlite(f'sqlite:///{uri}&uri=true')
+    weakref.finalize(engine, ancora.close)
     return engine
 
-def carregar_planilha(arquivo):
-    if arquivo.name.endswith('.csv'):
-        df = pd.read_csv(arquivo)
-    elif arquivo.name.endswith(('.xls', '.xlsx')):
-        df = pd.read_excel(arquivo)
-    else:
-        raise ValueError("Formato de arquivo não suportado")
-    
-    engine = create_engine('sqlite:///:memory:', echo=False)
-    df.to_sql('dados', engine, index=False, if_exists='replace')
+def _abrir_planilha_em_cache(caminho):
+    # Somente leitura: se o arquivo sumiu do cache a conexão falha, em vez de criar um banco vazio
+    arquivo = Path(os.path.abspath(caminho)).as_posix()
+    engine = _criar_engine_sqlite(f'sqlite:///file:{arquivo}?mode=ro&uri=true')
+    obter_cache_ingestao().registrar_uso(engine, caminho)
+
+    @event.listens_for(engine, 'connect')
+    def _configurar(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # Lê o arquivo via mmap e impede que o SQL gerado altere o cache compartilhado
+        cursor.execute(f'PRAGMA mmap_size={MMAP_CACHE_BYTES}')
+        cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return engine
+
+def carregar_planilha(arquivo, hash_arquivo=None, usar_cache=True):
+    if usar_cache:
+        caminho = obter_cache_ingestao().carregar(arquivo, hash_arquivo)
+        return _abrir_planilha_em_cache(caminho)
+
+    engine = _criar_engine_memoria_compartilhada()
+    carregar_arquivo(arquivo, engine, 'dados')
     return engine
 
 def listar_tabelas(engine):
-    inspector = inspect(engine)
-    return inspector.get_table_names()
+    return obter_catalogo(engine).tabelas()
 
 def obter_schema(engine, table_name):
-    inspector = inspect(engine)
-    return inspector.get_columns(table_name)
+    return obter_catalogo(engine).colunas(table_name)
+
+class ConsultaInterrompida(Exception):
+    """Consulta parada pelo limite de tempo ou cancelada pelo usuário"""
+
+# Consultas em execução, para que possam ser canceladas de outra thread (ex.: botão do app)
+_dono_consultas = contextvars.ContextVar('dono_consultas', default=None)
+_execucoes = {}
+_execucoes_lock = threading.Lock()
+
+@contextmanager
+def dono_das_consultas(dono):
+    """Associa a `dono` as consultas do bloco, inclusive as de tarefas e threads (`asyncio.to_thread`) criadas nele"""
+    token = _dono_consultas.set(dono)
+    try:
+        yield
+    finally:
+        _dono_consultas.reset(token)
 
-def executar_query(engine, query):
-    with engine.connect() as conn:
+@contextmanager
+def execucao_cancelavel(engine, conn, timeout_ms):
+    """Registra a consulta da conexão para `cancelar_consultas` e aplica o prazo no SQLite.
+
+    No PostgreSQL o prazo é o `statement_timeout` da conexão (`obter_engine_postgres`).
+    """
+    dbapi = conn.connection.dbapi_connection
+    execucao = {'engine': engine, 'dono': _dono_consultas.get(), 'dbapi': dbapi, 'pid': None,
+                'cancelada': False, 'expirada': False}
+    sqlite = engine.dialect.name == 'sqlite'
+    if sqlite and timeout_ms:
+        prazo = time.monotonic() + timeout_ms / 1000
+
+        def _verificar_prazo():
+            if time.monotonic() > prazo:
+                execucao['expirada'] = True
+                return 1
+            return 0
+
+        dbapi.set_progress_handler(_verificar_prazo, PASSOS_PROGRESSO_SQLITE)
+    elif hasattr(dbapi, 'get_backend_pid'):
+        execucao['pid'] = dbapi.get_backend_pid()
+    chave = id(execucao)
+    with _execucoes_lock:
+        _execucoes[chave] = execucao
+    try:
+        yield
+    except exc.DBAPIError as e:
+        if execucao['cancelada']:
+            raise ConsultaInterrompida("Consulta cancelada pelo usuário") from e
+        # 57014 (query_canceled): statement_timeout do PostgreSQL
+        if execucao['expirada'] or getattr(e.orig, 'pgcode', None) == '57014':
+            raise ConsultaInterrompida(f"Consulta interrompida após {timeout_ms / 1000:g} s (limite de tempo)") from e
+        raise
+    finally:
+        with _execucoes_lock:
+            _execucoes.pop(chave, None)
+        if sqlite and timeout_ms:
+            dbapi.set_progress_handler(None, 0)
+
+def consultas_em_andamento(engine=None, dono=None):
+    with _execucoes_lock:
+        return [execucao for execucao in _execucoes.values()
+                if (engine is None or execucao['engine'] is engine) and (dono is None or execucao['dono'] == dono)]
+
+def cancelar_consultas(engine=None, dono=None):
+    """Cancela no banco as consultas em andamento do engine e/ou do dono; retorna quantas foram canceladas"""
+    execucoes = consultas_em_andamento(engine, dono)
+    for execucao in execucoes:
+        execucao['cancelada'] = True
+        if execucao['pid'] is not None:
+            # Pedido ao servidor por outra conexão: vale mesmo no meio da leitura do cursor
+            with execucao['engine'].connect() as conn:
+                conn.execute(text('SELECT pg_cancel_backend(:pid)'), {'pid': execucao['pid']})
+        elif hasattr(execucao['dbapi'], 'interrupt'):
+            execucao['dbapi'].interrupt()
+        elif hasattr(execucao['dbapi'], 'cancel'):
+            execucao['dbapi'].cancel()
+    return len(execucoes)
+
+def iterar_query(engine, query, tamanho_lote=TAMANHO_LOTE_PADRAO, max_linhas=None, max_bytes=None,
+                 timeout_ms=TIMEOUT_STATEMENT_MS):
+    """Executa a query com cursor no servidor e gera DataFrames de até `tamanho_lote` linhas.
+
+    Ao atingir `max_linhas` ou `max_bytes` o último lote é cortado, marcado com
+    `attrs['truncado'] = True` e a leitura é interrompida. Consultas canceladas ou acima
+    de `timeout_ms` levantam `ConsultaInterrompida`.
+    """
+    linhas_lidas = 0
+    bytes_lidos = 0
+    emitiu = False
+    with engine.connect() as conn, execucao_cancelavel(engine, conn, timeout_ms):
+        # stream_results usa cursor nomeado (server-side) no PostgreSQL
+        conn = conn.execution_options(stream_results=True, max_row_buffer=tamanho_lote)
         result = conn.execute(text(query))
-        return pd.DataFrame(result.fetchall(), columns=result.keys())
\ No newline at end of file
+        colunas = list(result.keys())
+        for linhas in result.partitions(tamanho_lote):
+            lote = pd.DataFrame.from_records(linhas, columns=colunas, coerce_float=True)
+            del linhas
+            truncado = False
+            if max_linhas is not None and linhas_lidas + len(lote) > max_linhas:
+                lote = lote.iloc[:max_linhas - linhas_lidas]
+                truncado = True
+            tamanho = int(lote.memory_usage(deep=True).sum())
+            if max_bytes is not None and bytes_lidos + tamanho > max_bytes and len(lote):
+                por_linha = tamanho / len(lote)
+                lote = lote.iloc[:int((max_bytes - bytes_lidos) // por_linha)]
+                tamanho = int(por_linha * len(lote))
+                truncado = True
+            linhas_lidas += len(lote)
+            bytes_lidos += tamanho
+            lote.attrs['truncado'] = truncado
+            if len(lote) or truncado:
+                emitiu = True
+                yield lote
+            if truncado:
+                return
+    if not emitiu:
+        vazio = pd.DataFrame(columns=colunas)
+        vazio.attrs['truncado'] = False
+        yield vazio
+
+def executar_query(engine, query, max_linhas=LIMITE_LINHAS_PADRAO, max_bytes=LIMITE_BYTES_PADRAO,
+                   tamanho_lote=TAMANHO_LOTE_PADRAO, usar_rollups=True):
+    """Executa a query em lotes e monta um único DataFrame respeitando os limites.
+
+    `df.attrs['truncado']` indica se o resultado foi cortado pelos limites. Somas por período
+    que os agregados de `rollups` cobrem são respondidas por eles (`df.attrs['rollup']`).
+    """
+    if usar_rollups:
+        # Importado aqui: rollups depende deste módulo
+        from rollups import responder_com_rollup
+        df = responder_com_rollup(engine, query, max_linhas)
+        if df is not None:
+            return df
+    lotes = list(iterar_query(engine, query, tamanho_lote, max_linhas, max_bytes))
+    truncado = any(lote.attrs.get('truncado') for lote in lotes)
+    df = lotes[0] if len(lotes) == 1 else pd.concat(lotes, ignore_index=True)
+    df.attrs['truncado'] = truncado
+    return df
+
+def normalizar_select(query):
+    """Um único comando SELECT/WITH, sem o `;` final; ValueError para qualquer outra coisa"""
+    sql = query.strip().rstrip(';').strip()
+    if not re.match(r'(select|with)\b', sql, re.IGNORECASE):
+        raise ValueError("Apenas consultas SELECT são permitidas")
+    if ';' in sql:
+        raise ValueError("Envie apenas um comando SQL por vez")
+    return sql
+
+def escolher_balde(inicio, fim, pontos_alvo=PONTOS_ALVO_GRAFICO):
+    """Menor período (dia, semana, mês, ano) que cobre o intervalo com até `pontos_alvo` pontos"""
+    dias = max((pd.Timestamp(fim) - pd.Timestamp(inicio)).days, 0) + 1
+    for balde, tamanho in DIAS_POR_BALDE.items():
+        if dias / tamanho <= pontos_alvo:
+            return balde
+    return 'ano'
+
+def expressao_balde(engine, coluna, balde):
+    """Expressão SQL que trunca `coluna` ao início do período no dialeto do engine"""
+    coluna = engine.dialect.identifier_preparer.quote(coluna)
+    if engine.dialect.name == 'sqlite':
+        return _TRUNC_SQLITE[balde].format(coluna)
+    return f"DATE_TRUNC('{_TRUNC_POSTGRES[balde]}', CAST({coluna} AS TIMESTAMP))"
+
+def agregar_por_periodo(engine, query, coluna_data, coluna_valor, pontos_alvo=PONTOS_ALVO_GRAFICO, intervalo=None):
+    """Soma `coluna_valor` por período de `coluna_data` no próprio banco.
+
+    A consulta original vira subconsulta; o período é escolhido pelo intervalo de datas
+    para que voltem no máximo ~`pontos_alvo` linhas. `df.attrs['balde']` indica o período.
+    Com `intervalo` (início, fim) já conhecido, por exemplo pelo perfil da tabela, a consulta
+    de MIN/MAX não é feita.
+    """
+    base = query.strip().rstrip(';')
+    preparador = engine.dialect.identifier_preparer
+    data, valor = preparador.quote(coluna_data), preparador.quote(coluna_valor)
+    if intervalo is not None:
+        inicio, fim = intervalo
+    else:
+        with engine.connect() as conn:
+            inicio, fim = conn.execute(text(f"SELECT MIN({data}), MAX({data}) FROM ({base}) AS base")).one()
+    if inicio is None:
+        balde = 'dia'
+    else:
+        balde = escolher_balde(inicio, fim, pontos_alvo)
+    df = executar_query(engine, (
+        f"SELECT {expressao_balde(engine, coluna_data, balde)} AS {data}, SUM({valor}) AS {valor} "
+        f"FROM ({base}) AS base GROUP BY 1 ORDER BY 1"))
+    df.attrs['balde'] = balde
+    return df
+
+def agregar_por_categoria(engine, query, coluna_categoria, coluna_valor, limite=PONTOS_ALVO_GRAFICO):
+    """Soma `coluna_valor` por categoria no próprio banco, mantendo as `limite` maiores"""
+    base = query.strip().rstrip(';')
+    preparador = engine.dialect.identifier_preparer
+    categoria, valor = preparador.quote(coluna_categoria), preparador.quote(coluna_valor)
+    return executar_query(engine, (
+        f"SELECT {categoria}, SUM({valor}) AS {valor} FROM ({base}) AS base "
+        f"GROUP BY 1 ORDER BY 2 DESC LIMIT {int(limite)}"))
@@ -0,0 +1,91 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+# Limites de pontos enviados ao navegador
+PONTOS_MAXIMOS_LINHA = 2000
+CATEGORIAS_MAXIMAS_BARRA = 30
+ROTULO_OUTROS = 'Outros'
+
+_INICIO_GRAFICO = '<!--grafico-->'
+_FIM_GRAFICO = '<!--/grafico-->'
+
+def lttb(x, y, limite):
+    """Índices dos pontos escolhidos pelo Largest-Triangle-Three-Buckets.
+
+    Mantém o primeiro e o último ponto e, em cada balde, o ponto que forma o maior
+    triângulo com o ponto escolhido no balde anterior e a média do balde seguinte.
+    """
+    n = len(x)
+    if limite >= n or limite < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    limites = np.linspace(1, n - 1, limite - 1).astype(int)
+    indices = np.empty(limite, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    anterior = 0
+    for i in range(limite - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        proximo_fim = limites[i + 2] if i + 2 < len(limites) else n
+        media_x = x[fim:proximo_fim].mean() if proximo_fim > fim else x[-1]
+        media_y = y[fim:proximo_fim].mean() if proximo_fim > fim else y[-1]
+        areas = np.abs((x[anterior] - media_x) * (y[inicio:fim] - y[anterior])
+                       - (x[anterior] - x[inicio:fim]) * (media_y - y[anterior]))
+        anterior = inicio + int(np.nanargmax(areas)) if len(areas) else inicio
+        indices[i + 1] = anterior
+    return indices
+
+def reduzir_serie(df, x_col, y_col, limite=PONTOS_MAXIMOS_LINHA):
+    """Reduz uma série ordenada por `x_col` a até `limite` pontos preservando a forma (LTTB)"""
+    if len(df) <= limite:
+        return df
+    x = df[x_col]
+    if pd.api.types.is_datetime64_any_dtype(x):
+        x = x.astype('int64')
+    elif not pd.api.types.is_numeric_dtype(x):
+        x = pd.Series(np.arange(len(df)), index=df.index)
+    return df.iloc[lttb(x.to_numpy(), df[y_col].fillna(0).to_numpy(), limite)]
+
+def top_n_com_outros(df, x_col, y_col, limite=CATEGORIAS_MAXIMAS_BARRA, rotulo=ROTULO_OUTROS):
+    """Mantém as `limite - 1` maiores categorias e soma as demais em uma barra `rotulo`"""
+    if len(df) <= limite:
+        return df
+    totais = df.groupby(x_col, sort=False)[y_col].sum()
+    if len(totais) <= limite:
+        return totais.reset_index()
+    maiores = totais.nlargest(limite - 1)
+    outros = totais.drop(maiores.index).sum()
+    resultado = maiores.reset_index()
+    resultado[x_col] = resultado[x_col].astype(str)
+    return pd.concat([resultado, pd.DataFrame({x_col: [rotulo], y_col: [outros]})], ignore_index=True)
+
+def figura_json(fig):
+    """JSON da figura como o `st.plotly_chart` envia ao navegador (`to_dict` + `PlotlyJSONEncoder`)"""
+    return json.dumps(fig.to_dict(), cls=PlotlyJSONEncoder)
+
+def html_figura(fig):
+    """Trecho com o JSON da figura embutido no texto da resposta (veja `partes_resposta`)"""
+    dados = figura_json(fig).replace('</', '<\\/')
+    return f'{_INICIO_GRAFICO}<script type="application/json">{dados}</script>{_FIM_GRAFICO}'
+
+def carregar_figura(dados):
+    """Figura (dicionário) a partir do JSON de `figura_json`, pronta para `st.plotly_chart`"""
+    return json.loads(dados)
+
+def partes_resposta(texto):
+    """Divide o texto em partes [('texto', str) | ('figura', json_da_figura)]"""
+    partes = []
+    padrao = re.escape(_INICIO_GRAFICO) + r'(.*?)' + re.escape(_FIM_GRAFICO)
+    posicao = 0
+    for trecho in re.finditer(padrao, texto, re.DOTALL):
+        partes.append(('texto', texto[posicao:trecho.start()]))
+        dados = re.search(r'<script type="application/json"[^>]*>(.*?)</script>', trecho.group(1), re.DOTALL)
+        if dados:
+            partes.append(('figura', dados.group(1).replace('<\\/', '</')))
+        posicao = trecho.end()
+    partes.append(('texto', texto[posicao:]))
+    return partes
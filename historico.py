@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from graficos import carregar_figura, partes_resposta
+
+# Histórico do chat: mensagens recentes em memória, anteriores e figuras em disco
+PASTA_HISTORICO = os.getenv(
+    'AGENTE_HISTORICO', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'historico'))
+MAX_MENSAGENS_MEMORIA = 20
+MAX_FIGURAS_RENDERIZADAS = 32
+IDADE_MAXIMA_SESSAO_S = 7 * 24 * 3600
+
+class HistoricoConversa:
+    """Mensagens de uma sessão como registros {'role', 'partes', 'sql_usado'}.
+
+    Cada parte é {'texto': str} ou {'figura': chave, 'bytes': n}; o JSON da figura fica em
+    `<pasta>/<sessao>/figuras/<chave>.json`. Só as `max_memoria` mensagens mais recentes ficam
+    em memória; as anteriores são acrescentadas a `<pasta>/<sessao>/mensagens.jsonl`.
+    """
+
+    def __init__(self, pasta=PASTA_HISTORICO, max_memoria=MAX_MENSAGENS_MEMORIA, sessao=None):
+        self.pasta = os.path.join(pasta, sessao or uuid.uuid4().hex)
+        self.max_memoria = max_memoria
+        self.recentes = []
+        self.em_disco = 0
+        self._lock = threading.Lock()
+        descartar_sessoes_antigas(pasta)
+        os.makedirs(os.path.join(self.pasta, 'figuras'), exist_ok=True)
+
+    @property
+    def arquivo_mensagens(self):
+        return os.path.join(self.pasta, 'mensagens.jsonl')
+
+    def caminho_figura(self, chave):
+        return os.path.join(self.pasta, 'figuras', chave + '.json')
+
+    def _guardar_figura(self, dados):
+        chave = hashlib.sha256(dados.encode('utf-8')).hexdigest()[:32]
+        caminho = self.caminho_figura(chave)
+        if not os.path.exists(caminho):
+            temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+            with open(temporario, 'w', encoding='utf-8') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        return chave
+
+    def adicionar(self, role, content, sql_usado=None):
+        """Registra a mensagem; figuras embutidas em `content` vão para o disco"""
+        partes = []
+        for tipo, valor in partes_resposta(str(content)):
+            if tipo == 'figura':
+                partes.append({'figura': self._guardar_figura(valor), 'bytes': len(valor.encode('utf-8'))})
+            elif valor.strip():
+                partes.append({'texto': valor})
+        mensagem = {'role': role, 'partes': partes, 'sql_usado': sql_usado}
+        with self._lock:
+            self.recentes.append(mensagem)
+            excedentes = self.recentes[:-self.max_memoria] if len(self.recentes) > self.max_memoria else []
+            self.recentes = self.recentes[len(excedentes):]
+            if excedentes:
+                with open(self.arquivo_mensagens, 'a', encoding='utf-8') as f:
+                    for antiga in excedentes:
+                        f.write(json.dumps(antiga, ensure_ascii=False) + '\n')
+                self.em_disco += len(excedentes)
+        # Mantém a sessão longe do descarte por idade
+        os.utime(self.pasta)
+        return mensagem
+
+    def anteriores(self):
+        """Mensagens que já saíram da memória, lidas do disco"""
+        try:
+            with open(self.arquivo_mensagens, encoding='utf-8') as f:
+                return [json.loads(linha) for linha in f if linha.strip()]
+        except FileNotFoundError:
+            return []
+
+    def figura(self, chave):
+        """Figura pronta para `st.plotly_chart`, ou None se o arquivo não existir mais"""
+        return obter_figura(self.caminho_figura(chave))
+
+    def limpar(self):
+        with self._lock:
+            self.recentes = []
+            self.em_disco = 0
+            shutil.rmtree(self.pasta, ignore_errors=True)
+            os.makedirs(os.path.join(self.pasta, 'figuras'), exist_ok=True)
+
+    def __len__(self):
+        return self.em_disco + len(self.recentes)
+
+def descartar_sessoes_antigas(pasta=PASTA_HISTORICO, idade_maxima=IDADE_MAXIMA_SESSAO_S):
+    """Remove pastas de sessões sem alteração há mais de `idade_maxima` segundos"""
+    limite = time.time() - idade_maxima
+    try:
+        nomes = os.listdir(pasta)
+    except FileNotFoundError:
+        return
+    for nome in nomes:
+        caminho = os.path.join(pasta, nome)
+        try:
+            if os.path.isdir(caminho) and os.stat(caminho).st_mtime < limite:
+                shutil.rmtree(caminho, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+
+# Figuras já decodificadas, compartilhadas pelo processo: reexecuções do Streamlit não
+# voltam a ler e decodificar o JSON dos gráficos antigos
+_figuras = OrderedDict()
+_figuras_lock = threading.Lock()
+
+def obter_figura(caminho):
+    with _figuras_lock:
+        if caminho in _figuras:
+            _figuras.move_to_end(caminho)
+            return _figuras[caminho]
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            figura = carregar_figura(f.read())
+    except FileNotFoundError:
+        return None
+    with _figuras_lock:
+        _figuras[caminho] = figura
+        while len(_figuras) > MAX_FIGURAS_RENDERIZADAS:
+            _figuras.popitem(last=False)
+    return figura
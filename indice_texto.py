@@ -0,0 +1,76 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+
+# Palavras sem valor para comparar perguntas ou localizar tabelas
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'e', 'de', 'da', 'do', 'das', 'dos', 'em', 'no', 'na', 'nos', 'nas',
+    'um', 'uma', 'uns', 'umas', 'para', 'por', 'pelo', 'pela', 'com', 'que', 'qual', 'quais',
+    'me', 'se', 'ao', 'aos', 'the', 'of', 'by', 'and',
+}
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos, sem pontuação e com espaços simples"""
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[^a-z0-9_]+', ' ', texto)
+    return ' '.join(texto.split())
+
+def _radical(palavra):
+    # Plural simples: "vendas" e "venda" devem cair no mesmo termo
+    if len(palavra) > 3 and palavra.endswith('s') and not palavra.isdigit():
+        return palavra[:-1]
+    return palavra
+
+def tokenizar(texto):
+    """Termos normalizados do texto; nomes como `data_venda` também geram `data` e `venda`"""
+    termos = []
+    for palavra in normalizar_texto(texto).split():
+        partes = [palavra] + (palavra.split('_') if '_' in palavra else [])
+        termos.extend(_radical(p) for p in partes if p and p not in STOPWORDS)
+    return termos
+
+class IndiceTfidf:
+    """Índice TF-IDF em memória para busca por similaridade de cosseno, sem dependências externas"""
+
+    def __init__(self):
+        self._documentos = {}
+        self._frequencia_documentos = Counter()
+
+    def __len__(self):
+        return len(self._documentos)
+
+    def adicionar(self, identificador, texto):
+        self.remover(identificador)
+        termos = Counter(tokenizar(texto))
+        self._documentos[identificador] = termos
+        self._frequencia_documentos.update(termos.keys())
+
+    def remover(self, identificador):
+        termos = self._documentos.pop(identificador, None)
+        if termos:
+            self._frequencia_documentos.subtract(termos.keys())
+
+    def _idf(self, termo):
+        total = len(self._documentos)
+        return math.log((1 + total) / (1 + self._frequencia_documentos.get(termo, 0))) + 1
+
+    def _vetor(self, termos):
+        vetor = {termo: (1 + math.log(n)) * self._idf(termo) for termo, n in termos.items()}
+        norma = math.sqrt(sum(v * v for v in vetor.values()))
+        return {termo: v / norma for termo, v in vetor.items()} if norma else {}
+
+    def buscar(self, texto, limite=5):
+        """Retorna [(identificador, similaridade)] em ordem decrescente de similaridade"""
+        consulta = self._vetor(Counter(tokenizar(texto)))
+        if not consulta:
+            return []
+        resultados = []
+        for identificador, termos in self._documentos.items():
+            documento = self._vetor(termos)
+            similaridade = sum(peso * documento.get(termo, 0.0) for termo, peso in consulta.items())
+            if similaridade > 0:
+                resultados.append((identificador, similaridade))
+        resultados.sort(key=lambda item: item[1], reverse=True)
+        return resultados[:limite]
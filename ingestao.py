@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import weakref
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+# Leitura do CSV em blocos para não materializar o arquivo inteiro
+TAMANHO_CHUNK_CSV = 100_000
+TAMANHO_LOTE_INSERT = 50_000
+
+# Colunas com até esse número de valores distintos recebem índice (ex.: material, loja)
+LIMITE_CARDINALIDADE_INDICE = 10_000
+MAX_INDICES_AUTOMATICOS = 6
+
+# Configurações do SQLite durante a carga: sem journal e sem fsync
+PRAGMAS_CARGA = (
+    "PRAGMA journal_mode=OFF",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+)
+
+# Cache em disco das planilhas já ingeridas, compartilhado entre sessões e reinícios
+PASTA_CACHE_PADRAO = os.getenv(
+    'AGENTE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'planilhas'))
+TAMANHO_MAX_CACHE_PADRAO = 2 * 1024 ** 3
+MMAP_CACHE_BYTES = 256 * 1024 * 1024
+
+_PADRAO_DATA = re.compile(r'^\s*(\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4})([ T]\d{1,2}:\d{2}(:\d{2})?)?')
+# Datas já em ISO são gravadas como estão, sem conversão
+_PADRAO_ISO = r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?$'
+
+# Colunas numéricas com esses termos são medidas, não chaves de filtro
+_TERMOS_MEDIDA = ['quantidade', 'qtd', 'valor', 'total', 'preco', 'preço']
+
+def _tipo_sqlite(serie):
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(serie):
+        return 'REAL'
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return 'TIMESTAMP'
+    return 'TEXT'
+
+def _detectar_datas(df, amostra=1000):
+    """Retorna {coluna: dayfirst} para colunas de texto que contêm datas.
+
+    `dayfirst` é None quando a coluna já está em ISO e não precisa de conversão.
+    """
+    datas = {}
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        valores = df[col].dropna().astype(str).head(amostra)
+        if valores.empty or not valores.str.match(_PADRAO_DATA).all():
+            continue
+        dayfirst = valores.str.match(r'^\s*\d{1,2}/').any()
+        convertidos = pd.to_datetime(valores, errors='coerce', dayfirst=dayfirst)
+        if convertidos.notna().mean() >= 0.95:
+            datas[col] = None if valores.str.match(_PADRAO_ISO).all() else dayfirst
+    return datas
+
+def inferir_tipos(df):
+    """Infere uma única vez os tipos SQLite e as colunas de data a partir do primeiro bloco"""
+    datas = _detectar_datas(df)
+    tipos = {}
+    for col in df.columns:
+        tipos[col] = 'TIMESTAMP' if col in datas else _tipo_sqlite(df[col])
+    return tipos, datas
+
+def _preparar_lote(df, tipos, datas):
+    """Converte o bloco em linhas de tipos nativos do Python prontas para o executemany"""
+    colunas = []
+    for col in df.columns:
+        serie = df[col]
+        if col in datas and datas[col] is not None:
+            serie = pd.to_datetime(serie, errors='coerce', dayfirst=datas[col],
+                                   infer_datetime_format=True)
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            texto = serie.dt.strftime('%Y-%m-%d %H:%M:%S')
+            colunas.append(texto.where(serie.notna(), None).tolist())
+        elif tipos[col] == 'TEXT' and serie.dtype != object:
+            colunas.append(serie.astype(object).where(serie.notna(), None).map(
+                lambda v: v if v is None else str(v)).tolist())
+        else:
+            # NaN em colunas numéricas é gravado como NULL pelo SQLite
+            colunas.append(serie.tolist())
+    return list(zip(*colunas))
+
+def _ler_blocos(arquivo, tamanho_chunk):
+    nome = arquivo.name if hasattr(arquivo, 'name') else str(arquivo)
+    if nome.endswith('.csv'):
+        yield from pd.read_csv(arquivo, chunksize=tamanho_chunk)
+    elif nome.endswith(('.xls', '.xlsx')):
+        # Excel não permite leitura em blocos; o insert continua em lotes
+        df = pd.read_excel(arquivo)
+        for inicio in range(0, len(df), tamanho_chunk):
+            yield df.iloc[inicio:inicio + tamanho_chunk]
+    else:
+        raise ValueError("Formato de arquivo não suportado")
+
+def _citar(nome):
+    return '"' + str(nome).replace('"', '""') + '"'
+
+def _candidatas_indice(tipos):
+    return [
+        col for col, tipo in tipos.items()
+        if tipo == 'TEXT' or (tipo == 'INTEGER' and not any(t in col.lower() for t in _TERMOS_MEDIDA))
+    ]
+
+def _atualizar_distintos(distintos, bloco):
+    """Acumula os valores distintos das candidatas e descarta as de alta cardinalidade"""
+    for col in list(distintos):
+        distintos[col].update(bloco[col].dropna().unique().tolist())
+        if len(distintos[col]) > LIMITE_CARDINALIDADE_INDICE:
+            del distintos[col]
+
+def _criar_indices(cursor, tabela, tipos, distintos, total_linhas):
+    """Cria índices nas colunas de data e nas chaves de baixa cardinalidade"""
+    indices = [col for col, tipo in tipos.items() if tipo == 'TIMESTAMP']
+    chaves = [
+        (len(valores), col) for col, valores in distintos.items()
+        if 1 < len(valores) < total_linhas / 2
+    ]
+    indices += [col for _, col in sorted(chaves)]
+    indices = indices[:MAX_INDICES_AUTOMATICOS]
+    for col in indices:
+        nome_indice = _citar(f'idx_{tabela}_{col}')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {nome_indice} ON {_citar(tabela)} ({_citar(col)})')
+    # Estatísticas por amostragem para o planejador de consultas
+    cursor.execute('PRAGMA analysis_limit=1000')
+    cursor.execute('ANALYZE')
+    return indices
+
+def carregar_arquivo(arquivo, engine, tabela='dados', tamanho_chunk=TAMANHO_CHUNK_CSV,
+                     criar_indices=True):
+    """Carrega um CSV/Excel em uma tabela SQLite usando executemany em uma única transação.
+
+    Retorna um dicionário com linhas carregadas, tempo gasto, linhas/s e índices criados
+    (o tempo de criação dos índices está incluído no total e também separado).
+    """
+    inicio = time.perf_counter()
+    conexao = engine.raw_connection()
+    try:
+        cursor = conexao.cursor()
+        for pragma in PRAGMAS_CARGA:
+            cursor.execute(pragma)
+
+        tipos = datas = distintos = None
+        insert = None
+        total_linhas = 0
+        for bloco in _ler_blocos(arquivo, tamanho_chunk):
+            if tipos is None:
+                tipos, datas = inferir_tipos(bloco)
+                definicao = ', '.join(f'{_citar(col)} {tipo}' for col, tipo in tipos.items())
+                cursor.execute(f'DROP TABLE IF EXISTS {_citar(tabela)}')
+                cursor.execute(f'CREATE TABLE {_citar(tabela)} ({definicao})')
+                marcadores = ', '.join('?' for _ in tipos)
+                insert = f'INSERT INTO {_citar(tabela)} VALUES ({marcadores})'
+                distintos = {col: set() for col in _candidatas_indice(tipos)} if criar_indices else {}
+            _atualizar_distintos(distintos, bloco)
+            for inicio_lote in range(0, len(bloco), TAMANHO_LOTE_INSERT):
+                lote = bloco.iloc[inicio_lote:inicio_lote + TAMANHO_LOTE_INSERT]
+                cursor.executemany(insert, _preparar_lote(lote, tipos, datas))
+                total_linhas += len(lote)
+
+        if tipos is None:
+            raise ValueError("A planilha está vazia")
+
+        inicio_indices = time.perf_counter()
+        indices = _criar_indices(cursor, tabela, tipos, distintos, total_linhas) if criar_indices else []
+        segundos_indices = time.perf_counter() - inicio_indices
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+    finally:
+        conexao.close()
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'tabela': tabela,
+        'linhas': total_linhas,
+        'segundos': segundos,
+        'linhas_por_segundo': total_linhas / segundos if segundos else float('inf'),
+        'colunas_data': list(datas),
+        'indices': indices,
+        'segundos_indices': segundos_indices,
+    }
+
+def calcular_hash_arquivo(arquivo, tamanho_bloco=1024 * 1024):
+    """SHA-256 do conteúdo do arquivo enviado, lido em blocos"""
+    if isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, 'rb') as f:
+            return calcular_hash_arquivo(f, tamanho_bloco)
+    sha = hashlib.sha256()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(tamanho_bloco), b''):
+        sha.update(bloco)
+    arquivo.seek(0)
+    return sha.hexdigest()
+
+class CacheIngestao:
+    """Guarda cada planilha ingerida como um arquivo SQLite em disco, nomeado pelo hash do conteúdo.
+
+    Cargas seguintes do mesmo arquivo abrem o banco diretamente, sem reprocessar.
+    O tamanho total é limitado com descarte LRU (pela data de último acesso); bancos abertos
+    por engines vivos deste processo (`registrar_uso`) não são descartados.
+    """
+
+    EXTENSAO = '.sqlite'
+    ARQUIVO_ESTATISTICAS = 'estatisticas.json'
+
+    def __init__(self, pasta=PASTA_CACHE_PADRAO, tamanho_maximo=TAMANHO_MAX_CACHE_PADRAO):
+        self.pasta = pasta
+        self.tamanho_maximo = tamanho_maximo
+        self._lock = threading.Lock()
+        # engine -> caminho do banco que ele mantém aberto
+        self._em_uso = weakref.WeakKeyDictionary()
+        os.makedirs(self.pasta, exist_ok=True)
+
+    def caminho(self, hash_arquivo):
+        return os.path.join(self.pasta, hash_arquivo + self.EXTENSAO)
+
+    def _registrar(self, evento):
+        caminho = os.path.join(self.pasta, self.ARQUIVO_ESTATISTICAS)
+        with self._lock:
+            try:
+                with open(caminho) as f:
+                    estatisticas = json.load(f)
+            except (OSError, ValueError):
+                estatisticas = {}
+            estatisticas[evento] = estatisticas.get(evento, 0) + 1
+            temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+            with open(temporario, 'w') as f:
+                json.dump(estatisticas, f)
+            os.replace(temporario, caminho)
+
+    def obter(self, hash_arquivo):
+        """Caminho do banco em cache para o hash, ou None se ainda não foi ingerido"""
+        caminho = self.caminho(hash_arquivo)
+        if not os.path.exists(caminho):
+            self._registrar('falhas')
+            return None
+        # Atualiza a data de acesso usada pelo descarte LRU
+        os.utime(caminho)
+        self._registrar('acertos')
+        return caminho
+
+    def armazenar(self, hash_arquivo, arquivo, tabela='dados'):
+        """Ingere o arquivo em um SQLite temporário e o publica atomicamente no cache"""
+        caminho = self.caminho(hash_arquivo)
+        temporario = f'{caminho}.{uuid.uuid4().hex}.tmp'
+        engine = create_engine(f'sqlite:///{temporario}')
+        try:
+            carregar_arquivo(arquivo, engine, tabela)
+        except Exception:
+            engine.dispose()
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        engine.dispose()
+        os.replace(temporario, caminho)
+        self.descartar_excedente(manter=caminho)
+        return caminho
+
+    def carregar(self, arquivo, hash_arquivo=None, tabela='dados'):
+        """Retorna o caminho do banco em cache para o arquivo, ingerindo-o na primeira vez"""
+        hash_arquivo = hash_arquivo or calcular_hash_arquivo(arquivo)
+        return self.obter(hash_arquivo) or self.armazenar(hash_arquivo, arquivo, tabela)
+
+    def registrar_uso(self, engine, caminho):
+        """Protege `caminho` do descarte enquanto o engine existir"""
+        with self._lock:
+            self._em_uso[engine] = caminho
+
+    def _caminhos_em_uso(self):
+        with self._lock:
+            return set(self._em_uso.values())
+
+    def _entradas(self):
+        entradas = []
+        for nome in os.listdir(self.pasta):
+            if not nome.endswith(self.EXTENSAO):
+                continue
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, caminho))
+        return sorted(entradas)
+
+    def descartar_excedente(self, manter=None):
+        """Remove os bancos menos usados até o cache caber em `tamanho_maximo`"""
+        entradas = self._entradas()
+        em_uso = self._caminhos_em_uso()
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in entradas:
+            if total <= self.tamanho_maximo:
+                break
+            if caminho == manter or caminho in em_uso:
+                continue
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+            self._registrar('descartes')
+
+    def estatisticas(self):
+        try:
+            with open(os.path.join(self.pasta, self.ARQUIVO_ESTATISTICAS)) as f:
+                estatisticas = json.load(f)
+        except (OSError, ValueError):
+            estatisticas = {}
+        entradas = self._entradas()
+        return {
+            'acertos': estatisticas.get('acertos', 0),
+            'falhas': estatisticas.get('falhas', 0),
+            'descartes': estatisticas.get('descartes', 0),
+            'arquivos': len(entradas),
+            'bytes': sum(tamanho for _, tamanho, _ in entradas),
+        }
+
+_cache_ingestao = None
+_cache_ingestao_lock = threading.Lock()
+
+def obter_cache_ingestao():
+    """Cache de ingestão compartilhado pelo processo"""
+    global _cache_ingestao
+    with _cache_ingestao_lock:
+        if _cache_ingestao is None:
+            _cache_ingestao = CacheIngestao()
+        return _cache_ingestao
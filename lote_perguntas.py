@@ -0,0 +1,93 @@
+"""Processa um lote de perguntas sem interface, com concorrência limitada.
+
+Uso: python lote_perguntas.py perguntas.txt --planilha vendas.csv --concorrencia 4 --saida respostas.jsonl
+     python lote_perguntas.py perguntas.txt --postgres postgresql://... --timeout 120
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from agent import criar_agente, fazer_pergunta_async
+from database import cancelar_consultas, carregar_dados_do_postgres, carregar_planilha, dono_das_consultas
+
+CONCORRENCIA_PADRAO = 4
+
+async def processar_lote(engine, perguntas, concorrencia=CONCORRENCIA_PADRAO, timeout=None, llm=None,
+                         ao_concluir=None):
+    """Responde as perguntas com no máximo `concorrencia` em andamento ao mesmo tempo.
+
+    Cada vaga tem o próprio agente, pois o agente guarda as consultas capturadas da pergunta
+    em andamento. Perguntas que excedem `timeout` segundos são canceladas, inclusive a consulta
+    que estiver em execução no banco; o agente ReAct para antes do próximo passo e a vaga
+    recebe um agente novo, já que a thread do anterior pode ainda estar terminando. Retorna uma lista
+    de dicionários na ordem das perguntas; `ao_concluir(resultado)` é chamada a cada resposta.
+    """
+    vagas = asyncio.Queue()
+    for _ in range(max(1, min(concorrencia, len(perguntas)))):
+        vagas.put_nowait(criar_agente(engine, llm=llm))
+
+    async def responder(indice, pergunta):
+        agente, analytics = await vagas.get()
+        inicio = time.perf_counter()
+        resultado = {'indice': indice, 'pergunta': pergunta}
+        # As consultas da pergunta (inclusive nas threads do agente) ficam associadas a este dono
+        dono = f'lote-{uuid.uuid4().hex}'
+        try:
+            with dono_das_consultas(dono):
+                resposta, sql_usado = await asyncio.wait_for(
+                    fazer_pergunta_async(agente, engine, analytics, pergunta), timeout)
+            resultado.update(resposta=resposta, sql=sql_usado)
+            if sql_usado is None and resposta.startswith("Erro ao processar a pergunta"):
+                resultado['erro'] = resposta
+        except asyncio.TimeoutError:
+            # Cancelar a tarefa para o agente ReAct entre os passos, mas não a consulta no banco
+            await asyncio.to_thread(cancelar_consultas, dono=dono)
+            agente, analytics = await asyncio.to_thread(criar_agente, engine, llm=llm)
+            resultado['erro'] = f"Tempo limite de {timeout} s excedido"
+        except Exception as e:
+            resultado['erro'] = str(e)
+        finally:
+            vagas.put_nowait((agente, analytics))
+        resultado['segundos'] = round(time.perf_counter() - inicio, 3)
+        if ao_concluir is not None:
+            ao_concluir(resultado)
+        return resultado
+
+    return await asyncio.gather(*(responder(i, p) for i, p in enumerate(perguntas)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('perguntas', help='arquivo texto com uma pergunta por linha')
+    fonte = parser.add_mutually_exclusive_group(required=True)
+    fonte.add_argument('--planilha', help='CSV ou Excel a consultar')
+    fonte.add_argument('--postgres', help='string de conexão PostgreSQL')
+    parser.add_argument('--concorrencia', type=int, default=CONCORRENCIA_PADRAO)
+    parser.add_argument('--timeout', type=float, help='tempo máximo por pergunta, em segundos')
+    parser.add_argument('--saida', default='respostas.jsonl')
+    parser.add_argument('--transcricoes', help='usa o LLM de replay dos benchmarks (sem OpenAI)')
+    args = parser.parse_args()
+
+    with open(args.perguntas, encoding='utf-8') as f:
+        perguntas = [linha.strip() for linha in f if linha.strip()]
+    engine = carregar_planilha(args.planilha) if args.planilha else carregar_dados_do_postgres(args.postgres)
+    llm = None
+    if args.transcricoes:
+        from benchmarks.llm_falso import LLMReplay, carregar_transcricoes
+        llm = LLMReplay(transcricoes=carregar_transcricoes(args.transcricoes))
+
+    with open(args.saida, 'w', encoding='utf-8') as saida:
+        def gravar(resultado):
+            saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            saida.flush()
+            situacao = 'erro' if 'erro' in resultado else 'ok'
+            print(f"[{situacao}] {resultado['segundos']:8.2f} s  {resultado['pergunta']}")
+
+        inicio = time.perf_counter()
+        resultados = asyncio.run(processar_lote(engine, perguntas, args.concorrencia, args.timeout, llm, gravar))
+    erros = sum('erro' in r for r in resultados)
+    print(f"{len(resultados)} perguntas em {time.perf_counter() - inicio:.1f} s ({erros} com erro) -> {args.saida}")
+
+if __name__ == '__main__':
+    main()
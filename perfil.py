@@ -0,0 +1,236 @@
+import re
+import time
+from decimal import Decimal
+
+from sqlalchemy import text
+
+# Perfil de cada tabela (linhas, nulos, cardinalidade, mínimo e máximo por coluna), calculado
+# em uma única consulta agregada e atualizado de forma incremental pelas linhas novas
+TTL_PERFIL_PADRAO = 600
+TERMOS_MEDIDA = ['quantidade', 'qtd', 'valor', 'total', 'preco', 'preço', 'receita', 'custo']
+TERMOS_DATA = ['data', 'date', 'dt', 'período', 'periodo']
+# Colunas de texto com até esse número de valores distintos são categorias
+MAX_DISTINTOS_CATEGORIA = 1000
+# Colunas inteiras com distintos/linhas abaixo disso são códigos (material, loja), não medidas
+RAZAO_MAX_CATEGORIA_INTEIRA = 0.05
+# Tabelas do PostgreSQL acima disso (pela estatística do planejador) têm o perfil estimado:
+# linhas de `reltuples`, nulos e distintos de `pg_stats`, mínimo e máximo de uma amostra
+LINHAS_MAX_PERFIL_EXATO = 1_000_000
+LINHAS_AMOSTRA_PERFIL = 100_000
+
+_TIPO_DATA = re.compile(r'DATE|TIME', re.IGNORECASE)
+_TIPO_INTEIRO = re.compile(r'INT', re.IGNORECASE)
+_TIPO_DECIMAL = re.compile(r'REAL|FLOAT|DOUBLE|NUMERIC|DECIMAL|MONEY', re.IGNORECASE)
+_TIPO_SEM_ORDEM = re.compile(r'BLOB|BYTEA|JSON|ARRAY|\[\]|XML|UUID', re.IGNORECASE)
+_TEXTO_DATA = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+def _tipo(coluna):
+    nome = str(coluna['type'])
+    if _TIPO_SEM_ORDEM.search(nome):
+        return 'outro'
+    if _TIPO_DATA.search(nome):
+        return 'data'
+    if _TIPO_INTEIRO.search(nome):
+        return 'inteiro'
+    if _TIPO_DECIMAL.search(nome):
+        return 'decimal'
+    return 'texto'
+
+def _normalizar(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat(sep=' ') if hasattr(valor, 'hour') else valor.isoformat()
+    return valor
+
+def assinatura(colunas):
+    return tuple(f"{col['name']} {col['type']}" for col in colunas)
+
+def _consulta_agregada(engine, tabela, colunas, filtro=''):
+    """Uma única consulta com COUNT(*) e, por coluna, não nulos, distintos, mínimo e máximo"""
+    preparador = engine.dialect.identifier_preparer
+    expressoes = ['COUNT(*)']
+    for coluna in colunas:
+        nome, tipo = preparador.quote(coluna['name']), _tipo(coluna)
+        expressoes.append(f'COUNT({nome})')
+        if tipo == 'outro':
+            continue
+        # Valores decimais quase nunca se repetem: a contagem de distintos não ajuda e é cara
+        if tipo != 'decimal':
+            expressoes.append(f'COUNT(DISTINCT {nome})')
+        expressoes += [f'MIN({nome})', f'MAX({nome})']
+    return f"SELECT {', '.join(expressoes)} FROM {preparador.quote(tabela)}{filtro}"
+
+def _ler_agregados(linha, colunas):
+    valores = iter(linha)
+    linhas = next(valores)
+    estatisticas = {}
+    for coluna in colunas:
+        tipo = _tipo(coluna)
+        estatistica = {'tipo': tipo, 'nao_nulos': next(valores) or 0}
+        if tipo != 'outro':
+            estatistica['distintos'] = next(valores) if tipo != 'decimal' else None
+            estatistica['min'], estatistica['max'] = _normalizar(next(valores)), _normalizar(next(valores))
+        estatisticas[coluna['name']] = estatistica
+    return linhas or 0, estatisticas
+
+def papel(nome, estatistica, linhas):
+    """'data', 'medida', 'categoria', 'identificador' ou 'texto' a partir do tipo e das estatísticas"""
+    tipo, nome_min = estatistica['tipo'], nome.lower()
+    minimo = estatistica.get('min')
+    if tipo == 'data' or (tipo == 'texto' and isinstance(minimo, str) and _TEXTO_DATA.match(minimo)
+                          and _TEXTO_DATA.match(str(estatistica.get('max')))):
+        return 'data'
+    distintos, nao_nulos = estatistica.get('distintos'), estatistica['nao_nulos']
+    if tipo in ('inteiro', 'decimal'):
+        if any(termo in nome_min for termo in TERMOS_MEDIDA) or tipo == 'decimal':
+            return 'medida'
+        if distintos is not None and nao_nulos and distintos == nao_nulos and nao_nulos == linhas:
+            return 'identificador'
+        if distintos is not None and linhas and distintos / linhas <= RAZAO_MAX_CATEGORIA_INTEIRA:
+            return 'categoria'
+        return 'medida'
+    if tipo == 'texto' and distintos is not None and (
+            distintos <= MAX_DISTINTOS_CATEGORIA or (nao_nulos and distintos / nao_nulos < 0.5)):
+        return 'categoria'
+    return 'texto'
+
+def _atribuir_papeis(perfil):
+    for nome, estatistica in perfil['colunas'].items():
+        estatistica['papel'] = papel(nome, estatistica, perfil['linhas'])
+    datas = [nome for nome, e in perfil['colunas'].items() if e['papel'] == 'data']
+    # Coluna de data principal: a marca d'água das atualizações incrementais
+    perfil['coluna_data'] = datas[0] if datas else None
+    coluna = perfil['colunas'].get(perfil['coluna_data'] or '')
+    perfil['marca'] = coluna['max'] if coluna else None
+    return perfil
+
+def _linhas_estimadas(engine, conn, tabela):
+    """Linhas da tabela pela estatística do planejador do PostgreSQL, ou None se desconhecida"""
+    if engine.dialect.name != 'postgresql':
+        return None
+    linhas = conn.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:tabela)'),
+                          {'tabela': engine.dialect.identifier_preparer.quote(tabela)}).scalar()
+    return int(linhas) if linhas is not None and linhas > 0 else None
+
+def _estimar_agregados(engine, conn, tabela, colunas, linhas):
+    """Estatísticas de uma amostra (TABLESAMPLE), com nulos e distintos corrigidos por `pg_stats`"""
+    percentual = min(100.0, 100.0 * LINHAS_AMOSTRA_PERFIL / linhas)
+    amostra = f' TABLESAMPLE SYSTEM ({percentual:.6f})'
+    linhas_amostra, estatisticas = _ler_agregados(
+        conn.execute(text(_consulta_agregada(engine, tabela, colunas, amostra))).one(), colunas)
+    fator = linhas / linhas_amostra if linhas_amostra else 0.0
+    pg_stats = {nome: (nulos, distintos) for nome, nulos, distintos in conn.execute(text(
+        'SELECT attname, null_frac, n_distinct FROM pg_stats '
+        'WHERE schemaname = current_schema() AND tablename = :tabela'), {'tabela': tabela})}
+    for nome, estatistica in estatisticas.items():
+        nulos, distintos = pg_stats.get(nome, (None, None))
+        estatistica['nao_nulos'] = round(linhas * (1 - nulos) if nulos is not None
+                                         else estatistica['nao_nulos'] * fator)
+        # n_distinct negativo é a fração das linhas (-1: todos distintos)
+        if estatistica.get('distintos') is not None and distintos:
+            estatistica['distintos'] = round(distintos if distintos > 0 else -distintos * linhas)
+    return estatisticas
+
+def calcular_perfil(engine, tabela, colunas):
+    """Perfil da tabela em uma única varredura; estimado nas tabelas grandes do PostgreSQL"""
+    with engine.connect() as conn:
+        linhas = _linhas_estimadas(engine, conn, tabela)
+        estimado = linhas is not None and linhas > LINHAS_MAX_PERFIL_EXATO
+        if estimado:
+            estatisticas = _estimar_agregados(engine, conn, tabela, colunas, linhas)
+        else:
+            linha = conn.execute(text(_consulta_agregada(engine, tabela, colunas))).one()
+            linhas, estatisticas = _ler_agregados(linha, colunas)
+    return _atribuir_papeis({
+        'tabela': tabela, 'linhas': linhas, 'colunas': estatisticas, 'assinatura': assinatura(colunas),
+        'distintos_aproximados': estimado, 'estimado': estimado, 'atualizado_em': time.monotonic(),
+    })
+
+def atualizar_perfil(engine, perfil, colunas):
+    """Incorpora ao perfil apenas as linhas com data acima da marca d'água.
+
+    Sem coluna de data, ou com perfil estimado (a marca veio de uma amostra), o perfil é
+    recalculado. Contagens, mínimos e máximos ficam exatos; os distintos passam a ser um
+    limite inferior (o maior entre o perfil e as linhas novas).
+    """
+    if perfil.get('estimado') or perfil['coluna_data'] is None or perfil['marca'] is None:
+        return calcular_perfil(engine, perfil['tabela'], colunas)
+    coluna = engine.dialect.identifier_preparer.quote(perfil['coluna_data'])
+    consulta = _consulta_agregada(engine, perfil['tabela'], colunas, f' WHERE {coluna} > :marca')
+    with engine.connect() as conn:
+        linha = conn.execute(text(consulta), {'marca': perfil['marca']}).one()
+    novas, estatisticas = _ler_agregados(linha, colunas)
+    perfil = dict(perfil, atualizado_em=time.monotonic())
+    if not novas:
+        return perfil
+    try:
+        colunas_perfil = _combinar(perfil['colunas'], estatisticas)
+    except TypeError:
+        # Tipos misturados na mesma coluna (possível no SQLite): refaz o perfil inteiro
+        return calcular_perfil(engine, perfil['tabela'], colunas)
+    return _atribuir_papeis(dict(perfil, linhas=perfil['linhas'] + novas, colunas=colunas_perfil,
+                                 distintos_aproximados=True))
+
+def _combinar(colunas, estatisticas):
+    colunas_perfil = {}
+    for nome, atual in colunas.items():
+        nova = estatisticas[nome]
+        combinada = dict(atual, nao_nulos=atual['nao_nulos'] + nova['nao_nulos'])
+        if nova['nao_nulos'] and 'min' in atual:
+            combinada['min'] = nova['min'] if atual['min'] is None else min(atual['min'], nova['min'])
+            combinada['max'] = nova['max'] if atual['max'] is None else max(atual['max'], nova['max'])
+            if atual['distintos'] is not None:
+                combinada['distintos'] = max(atual['distintos'], nova['distintos'])
+        colunas_perfil[nome] = combinada
+    return colunas_perfil
+
+def papeis_resultado(df, perfis):
+    """{coluna: papel} das colunas de um resultado.
+
+    Colunas com o mesmo nome de uma coluna perfilada herdam o papel dela; aliases usam o
+    tipo do DataFrame e os termos do nome, sem reler os dados.
+    """
+    conhecidos = {}
+    for perfil in (perfis or {}).values():
+        for nome, estatistica in (perfil or {}).get('colunas', {}).items():
+            conhecidos.setdefault(nome.lower(), estatistica['papel'])
+    papeis = {}
+    for coluna in df.columns:
+        nome = str(coluna).lower()
+        serie = df[coluna]
+        if nome in conhecidos:
+            papeis[coluna] = conhecidos[nome]
+        elif hasattr(serie, 'dt') or any(termo in nome for termo in TERMOS_DATA):
+            papeis[coluna] = 'data'
+        elif serie.dtype.kind in 'iuf':
+            papeis[coluna] = 'medida'
+        else:
+            papeis[coluna] = 'categoria'
+    return papeis
+
+def colunas_por_papel(papeis, papel_procurado, preferidos=()):
+    """Colunas com o papel pedido, primeiro as que contêm algum termo de `preferidos`"""
+    colunas = [coluna for coluna, p in papeis.items() if p == papel_procurado]
+    return sorted(colunas, key=lambda c: not any(t in str(c).lower() for t in preferidos))
+
+def descrever_perfil(perfil, nomes=None):
+    """Resumo curto do perfil para o prompt (apenas as colunas em `nomes`, se informado)"""
+    partes = [f"{perfil['linhas']:,} linhas".replace(',', '.')]
+    for nome, estatistica in perfil['colunas'].items():
+        if nomes is not None and nome not in nomes:
+            continue
+        detalhes = []
+        if estatistica['papel'] == 'data' and estatistica.get('min') is not None:
+            detalhes.append(f"de {str(estatistica['min'])[:10]} a {str(estatistica['max'])[:10]}")
+        elif estatistica['papel'] == 'medida' and estatistica.get('min') is not None:
+            detalhes.append(f"entre {estatistica['min']} e {estatistica['max']}")
+        elif estatistica['papel'] == 'categoria' and estatistica.get('distintos') is not None:
+            detalhes.append(f"{estatistica['distintos']} valores distintos")
+        if perfil['linhas']:
+            nulos = 1 - estatistica['nao_nulos'] / perfil['linhas']
+            if nulos >= 0.01:
+                detalhes.append(f"{nulos:.0%} nulos")
+        if detalhes:
+            partes.append(f"{nome} {', '.join(detalhes)}")
+    return '; '.join(partes)
@@ -0,0 +1,41 @@
+import importlib
+import os
+import threading
+import time
+
+# Dependências pesadas carregadas só no primeiro uso (agente/LangChain e Plotly, Prophet).
+# O pré-aquecimento as importa em segundo plano logo após a interface abrir.
+MODULOS_PESADOS = ('agent', 'prophet')
+PREAQUECER = os.getenv('AGENTE_PREAQUECER', '1') != '0'
+
+_tempos = {}
+_thread = None
+_lock = threading.Lock()
+
+def preaquecer(modulos=MODULOS_PESADOS):
+    """Importa os módulos em ordem e retorna {modulo: segundos} (None se a importação falhou)"""
+    for modulo in modulos:
+        inicio = time.perf_counter()
+        try:
+            importlib.import_module(modulo)
+        except Exception:
+            # Dependência opcional ausente: o erro aparece quando a função for de fato usada
+            _tempos[modulo] = None
+            continue
+        _tempos[modulo] = time.perf_counter() - inicio
+    return dict(_tempos)
+
+def iniciar_preaquecimento(modulos=MODULOS_PESADOS):
+    """Inicia (uma vez por processo) a thread que importa os módulos pesados; desligue com AGENTE_PREAQUECER=0"""
+    global _thread
+    with _lock:
+        if _thread is None and PREAQUECER:
+            _thread = threading.Thread(target=preaquecer, args=(modulos,), name='preaquecimento', daemon=True)
+            _thread.start()
+        return _thread
+
+def estado_preaquecimento():
+    """{'concluido': bool, 'tempos': {modulo: segundos}}"""
+    with _lock:
+        thread = _thread
+    return {'concluido': thread is not None and not thread.is_alive(), 'tempos': dict(_tempos)}
@@ -0,0 +1,296 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from cache_previsoes import chave_previsao, obter_cache_previsoes
+
+# Parâmetros do Prophet; também fazem parte da chave do cache de previsões
+CONFIG_PROPHET = {
+    'yearly_seasonality': True,
+    'weekly_seasonality': True,
+    'daily_seasonality': False,
+    'interval_width': 0.95,
+}
+# Modelo rápido: tendência linear + sazonalidade, ajustado por mínimos quadrados em NumPy
+CONFIG_RAPIDO = {
+    'modelo': 'rapido',
+    'interval_width': 0.95,
+}
+# 'auto', 'prophet' ou 'rapido'
+MODELO_PREVISAO_PADRAO = os.getenv('AGENTE_MODELO_PREVISAO', 'auto')
+# Política automática: o Prophet só compensa com histórico longo e poucas séries
+MIN_PONTOS_PROPHET = 24
+MAX_SERIES_PROPHET = 20
+COLUNAS_PREVISAO = ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+# Horizonte móvel: meses previstos a partir da última data do histórico
+HORIZONTE_MESES = int(os.getenv('AGENTE_HORIZONTE_PREVISAO_MESES', 12))
+# O Prophet exige ao menos duas observações
+MIN_PONTOS_SERIE = 2
+# Warm start só em séries longas (nas curtas o ajuste do zero já é rápido e às vezes mais) e
+# partindo de ajustes com ruído acima do mínimo (abaixo, o ajuste interpolou a série)
+MIN_PONTOS_WARM_START = 100
+SIGMA_MINIMO_WARM_START = 1e-3
+
+def datas_futuras(ultima_data, periodos=HORIZONTE_MESES):
+    """Os `periodos` fins de mês seguintes à última data histórica"""
+    ultima_data = pd.Timestamp(ultima_data)
+    datas = pd.date_range(start=ultima_data, periods=periodos + 1, freq='M')
+    return pd.DataFrame({'ds': datas[datas > ultima_data][:periodos]})
+
+def ajustar_modelo_prophet(serie, configuracao=CONFIG_PROPHET, inicial=None):
+    """Prophet ajustado na série (`ds`, `y`).
+
+    `inicial` (de `parametros_prophet`) são os parâmetros de um ajuste anterior da mesma
+    série: o otimizador parte deles (warm start) e converge em menos iterações quando só
+    chegaram pontos novos no fim do histórico. Em séries curtas e a partir de ajustes
+    degenerados (`sigma_obs` quase zero) o warm start é ignorado: deixaria o ajuste mais lento.
+    """
+    # Importado só quando usado: o modelo rápido não depende do Prophet
+    from prophet import Prophet
+    if (inicial is not None and len(serie) >= MIN_PONTOS_WARM_START
+            and inicial['sigma_obs'] >= SIGMA_MINIMO_WARM_START):
+        try:
+            return Prophet(**configuracao).fit(serie, init=inicial)
+        except Exception:
+            # Formato diferente (ex.: outro número de changepoints): ajusta do zero
+            pass
+    return Prophet(**configuracao).fit(serie)
+
+def parametros_prophet(model):
+    """Parâmetros ajustados no formato de `init` do Stan, para o warm start do próximo ajuste"""
+    parametros = {nome: float(model.params[nome][0][0]) for nome in ('k', 'm', 'sigma_obs')}
+    # Vetores como arrays: o Prophet compara o `shape` com o dos valores iniciais padrão
+    parametros.update({nome: np.array(model.params[nome][0], dtype=float) for nome in ('delta', 'beta')})
+    return parametros
+
+def ajustar_prophet(serie, futuro, configuracao=CONFIG_PROPHET, inicial=None):
+    """Ajusta o Prophet na série (`ds`, `y`) e retorna a previsão para as datas de `futuro`.
+
+    Os parâmetros do ajuste ficam em `previsao.attrs['parametros']`.
+    """
+    model = ajustar_modelo_prophet(serie, configuracao, inicial)
+    previsao = model.predict(futuro)[COLUNAS_PREVISAO]
+    previsao.attrs['parametros'] = parametros_prophet(model)
+    return previsao
+
+def escolher_modelo(n_pontos, n_series=1, modelo=MODELO_PREVISAO_PADRAO):
+    """'prophet' ou 'rapido'; em 'auto', séries curtas e lotes grandes usam o modelo rápido"""
+    if modelo != 'auto':
+        return modelo
+    if n_pontos < MIN_PONTOS_PROPHET or n_series > MAX_SERIES_PROPHET:
+        return 'rapido'
+    return 'prophet'
+
+def _sazonalidade(ds):
+    """(período, índice sazonal de cada data) conforme o espaçamento típico das datas"""
+    ds = pd.DatetimeIndex(ds)
+    passo = float(np.median(np.diff(ds.asi8))) / 86_400e9 if len(ds) > 1 else 30.0
+    if passo <= 1.5:
+        return 7, passo, lambda d: d.dayofweek.to_numpy()
+    if passo <= 8:
+        return 52, passo, lambda d: (d.isocalendar().week.to_numpy().astype(int) - 1) % 52
+    if passo <= 35:
+        return 12, passo, lambda d: d.month.to_numpy() - 1
+    if passo <= 100:
+        return 4, passo, lambda d: d.quarter.to_numpy() - 1
+    return 1, passo, lambda d: np.zeros(len(d), dtype=int)
+
+def _matriz_modelo(ds, origem, passo, periodo, indice_sazonal, com_tendencia):
+    ds = pd.DatetimeIndex(ds)
+    colunas = [np.ones(len(ds))]
+    if com_tendencia:
+        colunas.append((ds.asi8 - origem) / (passo * 86_400e9))
+    if periodo > 1:
+        indice = indice_sazonal(ds)
+        # Uma coluna por estação, exceto a primeira (absorvida pelo intercepto)
+        colunas.extend((indice == estacao).astype(float) for estacao in range(1, periodo))
+    return np.column_stack(colunas)
+
+def ajustar_rapido_matriz(ds, Y, ds_futuro, interval_width=CONFIG_RAPIDO['interval_width']):
+    """Ajusta tendência linear + sazonalidade em várias séries de uma vez.
+
+    `Y` tem uma coluna por série, todas observadas nas datas `ds`. Retorna as matrizes
+    (yhat, yhat_lower, yhat_upper) com uma linha por data de `ds_futuro`; o intervalo
+    usa a variância de predição de mínimos quadrados.
+    """
+    Y = np.asarray(Y, dtype=float).reshape(len(ds), -1)
+    periodo, passo, indice_sazonal = _sazonalidade(ds)
+    n = len(ds)
+    # Sazonalidade só com dois ciclos completos; tendência só com três pontos
+    if n < 2 * periodo:
+        periodo = 1
+    origem = pd.DatetimeIndex(ds).asi8.min()
+    X = _matriz_modelo(ds, origem, passo, periodo, indice_sazonal, n >= 3)
+    X_futuro = _matriz_modelo(ds_futuro, origem, passo, periodo, indice_sazonal, n >= 3)
+
+    inversa = np.linalg.pinv(X.T @ X)
+    coeficientes = inversa @ X.T @ Y
+    residuos = Y - X @ coeficientes
+    graus_liberdade = max(n - np.linalg.matrix_rank(X), 1)
+    sigma = np.sqrt((residuos ** 2).sum(axis=0) / graus_liberdade)
+
+    yhat = X_futuro @ coeficientes
+    alavancagem = np.einsum('ij,jk,ik->i', X_futuro, inversa, X_futuro)
+    z = NormalDist().inv_cdf(0.5 + interval_width / 2)
+    margem = z * np.sqrt(1 + alavancagem)[:, None] * sigma[None, :]
+    return yhat, yhat - margem, yhat + margem
+
+def ajustar_rapido(serie, futuro, configuracao=CONFIG_RAPIDO):
+    """Previsão de uma série (`ds`, `y`) com o modelo rápido, no mesmo formato do Prophet"""
+    serie = serie.sort_values('ds')
+    yhat, inferior, superior = ajustar_rapido_matriz(
+        serie['ds'], serie['y'].to_numpy(), futuro['ds'], configuracao['interval_width'])
+    return pd.DataFrame({
+        'ds': pd.to_datetime(futuro['ds']).reset_index(drop=True),
+        'yhat': yhat[:, 0],
+        'yhat_lower': inferior[:, 0],
+        'yhat_upper': superior[:, 0],
+    })
+
+def _ajustar_em_processo(grupo, serie, futuro, configuracao, inicial=None):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    inicio = time.perf_counter()
+    return grupo, ajustar_prophet(serie, futuro, configuracao, inicial), time.perf_counter() - inicio
+
+def prever_series(df, coluna_grupo, coluna_data, coluna_valor, processos=None, ao_progresso=None,
+                  modelo=MODELO_PREVISAO_PADRAO, usar_cache=True, chave_series=None):
+    """Prevê cada série de um DataFrame em formato longo (uma linha por grupo e data).
+
+    O modelo de cada série segue `escolher_modelo`. Séries do modelo rápido com as mesmas
+    datas são ajustadas juntas, em forma matricial; as do Prophet, em paralelo em um pool
+    de processos (`processos`, padrão: todos os núcleos). Séries que já estão no cache de
+    previsões não são reajustadas. `ao_progresso(concluidas, total, grupo)` é chamada a
+    cada série finalizada. Com `chave_series` (ex.: o SQL de origem), o Prophet de cada
+    série parte dos parâmetros do último ajuste da mesma série.
+
+    Retorna (previsoes, metricas): um único DataFrame com a coluna do grupo e
+    ds, yhat, yhat_lower, yhat_upper, e um dicionário com contagens e tempos.
+    """
+    inicio = time.perf_counter()
+    dados = pd.DataFrame({
+        'grupo': df[coluna_grupo].to_numpy(),
+        'ds': pd.to_datetime(df[coluna_data]),
+        'y': pd.to_numeric(df[coluna_valor], errors='coerce'),
+    }).dropna(subset=['ds', 'y'])
+    # Uma observação por data em cada série
+    dados = dados.groupby(['grupo', 'ds'], sort=True)['y'].sum().reset_index()
+
+    cache = obter_cache_previsoes() if usar_cache else None
+    grupos = dados.groupby('grupo', sort=False)
+    previsoes, pendentes, rapidas, ignoradas, erros = {}, {}, {}, [], {}
+    modelos = {'prophet': 0, 'rapido': 0}
+    for grupo, serie in grupos:
+        serie = serie[['ds', 'y']].reset_index(drop=True)
+        futuro = datas_futuras(serie['ds'].max())
+        if len(serie) < MIN_PONTOS_SERIE or futuro.empty:
+            ignoradas.append(grupo)
+            continue
+        modelo_serie = escolher_modelo(len(serie), grupos.ngroups, modelo)
+        modelos[modelo_serie] += 1
+        chave = chave_previsao(serie, futuro, CONFIG_PROPHET if modelo_serie == 'prophet' else CONFIG_RAPIDO)
+        previsao = cache.obter(chave) if cache is not None else None
+        if previsao is not None:
+            previsoes[grupo] = previsao
+        elif modelo_serie == 'prophet':
+            pendentes[grupo] = (chave, serie, futuro)
+        else:
+            rapidas[grupo] = (chave, serie, futuro)
+
+    total = len(previsoes) + len(pendentes) + len(rapidas)
+    concluidas = 0
+    if ao_progresso is not None:
+        for grupo in list(previsoes):
+            concluidas += 1
+            ao_progresso(concluidas, total, grupo)
+
+    processos = max(1, min(processos or os.cpu_count() or 1, len(pendentes)))
+    segundos_ajuste = []
+
+    def inicial(grupo):
+        if chave_series is None or cache is None:
+            return None
+        return cache.parametros(f'{chave_series}|{grupo}')
+
+    def concluir(grupo, previsao, segundos):
+        previsoes[grupo] = previsao
+        segundos_ajuste.append(segundos)
+        if cache is not None:
+            cache.armazenar((pendentes.get(grupo) or rapidas[grupo])[0], previsao)
+            if chave_series is not None and 'parametros' in previsao.attrs:
+                cache.armazenar_parametros(f'{chave_series}|{grupo}', previsao.attrs['parametros'])
+
+    # Modelo rápido: uma matriz por conjunto de datas (históricas e futuras) em comum
+    blocos = {}
+    for grupo, (_, serie, futuro) in rapidas.items():
+        assinatura = (serie['ds'].to_numpy().tobytes(), futuro['ds'].to_numpy().tobytes())
+        blocos.setdefault(assinatura, []).append(grupo)
+    for membros in blocos.values():
+        inicio_bloco = time.perf_counter()
+        _, serie, futuro = rapidas[membros[0]]
+        Y = np.column_stack([rapidas[grupo][1]['y'].to_numpy(dtype=float) for grupo in membros])
+        yhat, inferior, superior = ajustar_rapido_matriz(
+            serie['ds'], Y, futuro['ds'], CONFIG_RAPIDO['interval_width'])
+        segundos = (time.perf_counter() - inicio_bloco) / len(membros)
+        ds_futuro = pd.to_datetime(futuro['ds']).reset_index(drop=True)
+        for j, grupo in enumerate(membros):
+            concluir(grupo, pd.DataFrame({
+                'ds': ds_futuro, 'yhat': yhat[:, j], 'yhat_lower': inferior[:, j], 'yhat_upper': superior[:, j],
+            }), segundos)
+            concluidas += 1
+            if ao_progresso is not None:
+                ao_progresso(concluidas, total, grupo)
+
+    if processos == 1:
+        for grupo, (_, serie, futuro) in pendentes.items():
+            try:
+                concluir(*_ajustar_em_processo(grupo, serie, futuro, CONFIG_PROPHET, inicial(grupo)))
+            except Exception as e:
+                erros[grupo] = str(e)
+            concluidas += 1
+            if ao_progresso is not None:
+                ao_progresso(concluidas, total, grupo)
+    elif pendentes:
+        # spawn: o processo pai pode ter threads (Streamlit, pools de conexão)
+        with ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futuros = {
+                pool.submit(_ajustar_em_processo, grupo, serie, futuro, CONFIG_PROPHET, inicial(grupo)): grupo
+                for grupo, (_, serie, futuro) in pendentes.items()
+            }
+            for futuro in as_completed(futuros):
+                grupo = futuros[futuro]
+                try:
+                    concluir(*futuro.result())
+                except Exception as e:
+                    erros[grupo] = str(e)
+                concluidas += 1
+                if ao_progresso is not None:
+                    ao_progresso(concluidas, total, grupo)
+
+    if previsoes:
+        resultado = pd.concat(
+            [previsao.assign(**{coluna_grupo: grupo}) for grupo, previsao in previsoes.items()], ignore_index=True)
+        resultado = resultado[[coluna_grupo] + COLUNAS_PREVISAO]
+    else:
+        resultado = pd.DataFrame(columns=[coluna_grupo] + COLUNAS_PREVISAO)
+
+    segundos = time.perf_counter() - inicio
+    metricas = {
+        'series': total + len(ignoradas),
+        'previstas': len(previsoes),
+        'ajustadas': len(segundos_ajuste),
+        'do_cache': total - len(pendentes) - len(rapidas),
+        'modelos': modelos,
+        'ignoradas': ignoradas,
+        'erros': erros,
+        'processos': processos if pendentes else 0,
+        'segundos': segundos,
+        'segundos_ajuste_medio': sum(segundos_ajuste) / len(segundos_ajuste) if segundos_ajuste else 0.0,
+        'series_por_segundo': len(previsoes) / segundos if segundos else 0.0,
+    }
+    return resultado, metricas
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+from collections import defaultdict
+
+from sqlalchemy import exc, text
+
+from database import normalizar_select, obter_catalogo
+from rastreamento import etapa
+
+# Orçamento das consultas geradas pelo LLM, estimado com EXPLAIN antes da execução.
+# PostgreSQL: custo total do planejador. SQLite (sem custos no EXPLAIN): linhas visitadas,
+# o produto das tabelas varridas em cada laço aninhado.
+CUSTO_MAXIMO_POSTGRES = float(os.getenv('AGENTE_CUSTO_MAXIMO', 2e7))
+LINHAS_VISITADAS_MAXIMAS = float(os.getenv('AGENTE_LINHAS_VISITADAS_MAXIMAS', 2e8))
+# LIMIT acrescentado aos SELECTs sem agregação que passam do orçamento
+LIMITE_AUTOMATICO = int(os.getenv('AGENTE_LIMITE_AUTOMATICO', 10_000))
+
+_AGREGACAO = re.compile(r'\bgroup\s+by\b|\b(?:sum|count|avg|min|max|total)\s*\(|\bdistinct\b', re.IGNORECASE)
+_LIMITE_FINAL = re.compile(r'\blimit\s+(\d+)(?:\s+offset\s+\d+)?\s*$', re.IGNORECASE)
+_TABELA_NO_FROM = re.compile(
+    r'(?:\bfrom|\bjoin|,)\s*"?(?P<tabela>\w+)"?(?:\s+(?:as\s+)?(?!(?:on|where|join|inner|left|right|full|cross|'
+    r'natural|group|order|limit|union|using)\b)"?(?P<alias>\w+)"?)?', re.IGNORECASE)
+
+def _sem_literais(sql):
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+def agregada(sql):
+    """Se a consulta agrega (GROUP BY, DISTINCT ou funções de agregação)"""
+    return _AGREGACAO.search(_sem_literais(sql)) is not None
+
+def limite_final(sql):
+    """Valor do LIMIT no fim da consulta, ou None"""
+    m = _LIMITE_FINAL.search(_sem_literais(sql))
+    return int(m.group(1)) if m else None
+
+def limitar(sql, limite=LIMITE_AUTOMATICO):
+    """Acrescenta (ou reduz) o LIMIT no fim da consulta"""
+    atual = limite_final(sql)
+    if atual is None:
+        return f'{sql}\nLIMIT {limite}'
+    if atual > limite:
+        m = _LIMITE_FINAL.search(_sem_literais(sql))
+        return f'{sql[:m.start(1)]}{limite}{sql[m.end(1):]}'
+    return sql
+
+def _estimar_postgres(engine, sql):
+    with engine.connect() as conn:
+        plano = conn.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+    if isinstance(plano, str):
+        plano = json.loads(plano)
+    raiz = plano[0]['Plan']
+    return {'custo': float(raiz['Total Cost']), 'linhas': int(raiz['Plan Rows']), 'maximo': CUSTO_MAXIMO_POSTGRES,
+            'unidade': 'custo do planejador'}
+
+def _linhas_sqlite(engine, tabela):
+    """Maior rowid: total de linhas sem varrer a tabela (exato se nada foi excluído)"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text(f'SELECT max(rowid) FROM {engine.dialect.identifier_preparer.quote(tabela)}')
+                                ).scalar()
+    except exc.SQLAlchemyError:
+        # Tabelas WITHOUT ROWID
+        return None
+
+def _estimar_sqlite(engine, sql):
+    """Linhas visitadas a partir do EXPLAIN QUERY PLAN e do total de linhas de cada tabela no perfil"""
+    with engine.connect() as conn:
+        plano = conn.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+    catalogo = obter_catalogo(engine)
+    tabelas = {t.lower(): t for t in catalogo.tabelas()}
+    nomes = {}
+    for m in _TABELA_NO_FROM.finditer(_sem_literais(sql)):
+        tabela = tabelas.get(m.group('tabela').lower())
+        if tabela:
+            nomes[tabela.lower()] = tabela
+            if m.group('alias'):
+                nomes[m.group('alias').lower()] = tabela
+
+    filhos = defaultdict(list)
+    for id_, pai, _, detalhe in plano:
+        filhos[pai].append((id_, detalhe))
+    materializadas = {}
+
+    def custo_no(pai):
+        """(linhas visitadas, linhas do laço principal, maior tabela varrida, se ordena em árvore temporária)"""
+        # Irmãos SCAN são laços aninhados e multiplicam; subconsultas e CTEs materializadas somam
+        produto, soma, maior, ordena = 1.0, 0.0, 1.0, False
+        for id_, detalhe in filhos[pai]:
+            if filhos[id_]:
+                custo_filho = custo_no(id_)[0]
+                soma += custo_filho
+                m = re.match(r'(?:MATERIALIZE|CO-ROUTINE)\s+(\S+)', detalhe)
+                if m:
+                    materializadas[m.group(1).lower()] = custo_filho
+                continue
+            ordena = ordena or detalhe.startswith('USE TEMP B-TREE')
+            m = re.match(r'SCAN\s+(\S+)', detalhe)
+            if not m or m.group(1) == 'CONSTANT':
+                continue
+            nome = m.group(1).lower()
+            tabela = nomes.get(nome) or tabelas.get(nome)
+            if tabela:
+                perfil = catalogo.perfis_disponiveis([tabela]).get(tabela)
+                linhas = perfil['linhas'] if perfil else _linhas_sqlite(engine, tabela)
+            else:
+                linhas = materializadas.get(nome)
+            linhas = max(float(linhas or 1), 1.0)
+            produto *= linhas
+            maior = max(maior, linhas)
+        return produto + soma, produto, maior, ordena
+
+    custo, linhas, maior, ordena = custo_no(0)
+    limite = limite_final(sql)
+    if limite is not None and not ordena:
+        # Sem ordenação a leitura para no LIMIT, salvo um filtro que obrigue a varrer a maior tabela
+        custo = min(custo, max(float(limite), maior))
+        linhas = min(linhas, limite)
+    return {'custo': custo, 'linhas': int(min(linhas, 1e18)), 'maximo': LINHAS_VISITADAS_MAXIMAS,
+            'unidade': 'linhas visitadas'}
+
+def estimar_consulta(engine, sql):
+    """{'custo', 'linhas', 'maximo', 'unidade'} a partir do EXPLAIN (também valida a consulta no banco).
+
+    `linhas` é a estimativa do planejador no PostgreSQL; no SQLite, o produto das tabelas
+    varridas no laço principal (limite superior para consultas sem agregação).
+    """
+    if engine.dialect.name == 'sqlite':
+        return _estimar_sqlite(engine, sql)
+    return _estimar_postgres(engine, sql)
+
+def proteger_sql(engine, query, limite=LIMITE_AUTOMATICO):
+    """Valida a consulta e a mantém dentro do orçamento antes da execução.
+
+    Acima do orçamento, SELECTs sem agregação recebem LIMIT `limite` e são estimados de novo;
+    as que continuam acima são recusadas com ValueError, com a estimativa na mensagem para
+    que o agente reescreva a consulta. Retorna o SQL a executar.
+    """
+    sql = normalizar_select(query)
+    with etapa('protecao_sql') as span:
+        estimativa = estimar_consulta(engine, sql)
+        if estimativa['custo'] > estimativa['maximo'] and not agregada(sql):
+            sql = limitar(sql, limite)
+            estimativa = estimar_consulta(engine, sql)
+            span['limite_automatico'] = limite
+        span.update(custo=round(estimativa['custo'], 1), linhas_estimadas=estimativa['linhas'])
+        if estimativa['custo'] > estimativa['maximo']:
+            span['recusada'] = True
+            raise ValueError(
+                f"Consulta recusada: estimativa de {estimativa['custo']:,.0f} ({estimativa['unidade']}) acima do "
+                f"limite de {estimativa['maximo']:,.0f}. Filtre, agregue ou junte as tabelas por uma chave.")
+    return sql
@@ -0,0 +1,190 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Rastros de cada pergunta, uma linha JSON por pergunta
+CAMINHO_RASTROS = os.getenv(
+    'AGENTE_RASTROS', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'rastros.jsonl'))
+MAX_RASTROS_MEMORIA = 200
+
+_rastro_atual = contextvars.ContextVar('rastro_atual', default=None)
+
+class Rastro:
+    """Etapas (spans) cronometradas de uma pergunta, com contadores como tokens e linhas"""
+
+    def __init__(self, pergunta):
+        self.id = uuid.uuid4().hex
+        self.pergunta = pergunta
+        self.inicio = time.time()
+        self._inicio_relogio = time.perf_counter()
+        self.duracao_ms = None
+        self.etapas = []
+        self.atributos = {}
+
+    @contextmanager
+    def etapa(self, nome, **atributos):
+        """Cronometra o bloco; o dicionário retornado aceita atributos extras (linhas, bytes...)"""
+        span = {'nome': nome, 'inicio_ms': round((time.perf_counter() - self._inicio_relogio) * 1000, 3)}
+        span.update(atributos)
+        inicio = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span['erro'] = type(e).__name__
+            raise
+        finally:
+            span['duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+            self.etapas.append(span)
+
+    def finalizar(self):
+        self.duracao_ms = round((time.perf_counter() - self._inicio_relogio) * 1000, 3)
+
+    def para_dict(self):
+        return {
+            'id': self.id,
+            'pergunta': self.pergunta,
+            'inicio': self.inicio,
+            'duracao_ms': self.duracao_ms,
+            'atributos': self.atributos,
+            'etapas': self.etapas,
+        }
+
+@contextmanager
+def etapa(nome, **atributos):
+    """Span no rastro da pergunta em andamento; sem rastro ativo apenas executa o bloco"""
+    rastro = _rastro_atual.get()
+    if rastro is None:
+        yield dict(atributos)
+        return
+    with rastro.etapa(nome, **atributos) as span:
+        yield span
+
+def rastro_atual():
+    return _rastro_atual.get()
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    posicao = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[posicao]
+
+class Rastreador:
+    """Mantém os últimos rastros em memória e os grava em JSONL"""
+
+    def __init__(self, caminho=CAMINHO_RASTROS, max_rastros=MAX_RASTROS_MEMORIA):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._rastros = deque(maxlen=max_rastros)
+        if caminho:
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+
+    @contextmanager
+    def rastrear(self, pergunta):
+        """Ativa um novo rastro para o bloco e o registra ao final"""
+        rastro = Rastro(pergunta)
+        token = _rastro_atual.set(rastro)
+        try:
+            yield rastro
+        finally:
+            _rastro_atual.reset(token)
+            rastro.finalizar()
+            self.registrar(rastro)
+
+    def registrar(self, rastro):
+        registro = rastro.para_dict()
+        with self._lock:
+            self._rastros.append(registro)
+            if self.caminho:
+                with open(self.caminho, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+
+    def ultimos(self, n=10):
+        with self._lock:
+            return list(self._rastros)[-n:]
+
+    def resumo(self):
+        """Contagem, média, p50 e p95 (ms) por etapa nos rastros em memória"""
+        with self._lock:
+            rastros = list(self._rastros)
+        duracoes = {}
+        for rastro in rastros:
+            duracoes.setdefault('total', []).append(rastro['duracao_ms'] or 0.0)
+            for span in rastro['etapas']:
+                duracoes.setdefault(span['nome'], []).append(span['duracao_ms'])
+        return {
+            nome: {
+                'contagem': len(valores),
+                'media_ms': sum(valores) / len(valores),
+                'p50_ms': _percentil(valores, 50),
+                'p95_ms': _percentil(valores, 95),
+            }
+            for nome, valores in duracoes.items()
+        }
+
+    def formato_prometheus(self):
+        """Métricas no formato texto do Prometheus"""
+        with self._lock:
+            rastros = list(self._rastros)
+        linhas = [
+            '# HELP agente_etapa_duracao_segundos Duração das etapas de fazer_pergunta',
+            '# TYPE agente_etapa_duracao_segundos summary',
+        ]
+        soma, contagem, tokens = {}, {}, {}
+        for rastro in rastros:
+            for span in rastro['etapas']:
+                soma[span['nome']] = soma.get(span['nome'], 0.0) + span['duracao_ms'] / 1000
+                contagem[span['nome']] = contagem.get(span['nome'], 0) + 1
+            for chave in ('prompt_tokens', 'completion_tokens'):
+                tokens[chave] = tokens.get(chave, 0) + rastro['atributos'].get(chave, 0)
+        for nome in sorted(soma):
+            linhas.append(f'agente_etapa_duracao_segundos_sum{{etapa="{nome}"}} {soma[nome]:.6f}')
+            linhas.append(f'agente_etapa_duracao_segundos_count{{etapa="{nome}"}} {contagem[nome]}')
+        linhas += ['# HELP agente_tokens_total Tokens consumidos pelo LLM', '# TYPE agente_tokens_total counter']
+        for chave in sorted(tokens):
+            linhas.append(f'agente_tokens_total{{tipo="{chave}"}} {tokens[chave]}')
+        linhas += ['# TYPE agente_perguntas_total counter', f'agente_perguntas_total {len(rastros)}']
+        return '\n'.join(linhas) + '\n'
+
+    def iniciar_servidor_metricas(self, porta):
+        """Expõe `/metrics` em uma thread daemon"""
+        rastreador = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                corpo = rastreador.formato_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        servidor = ThreadingHTTPServer(('0.0.0.0', porta), _Handler)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        return servidor
+
+_rastreador = None
+_rastreador_lock = threading.Lock()
+
+def obter_rastreador():
+    """Rastreador do processo; inicia o endpoint de métricas se AGENTE_METRICAS_PORTA estiver definida"""
+    global _rastreador
+    with _rastreador_lock:
+        if _rastreador is None:
+            _rastreador = Rastreador()
+            porta = os.getenv('AGENTE_METRICAS_PORTA')
+            if porta:
+                _rastreador.iniciar_servidor_metricas(int(porta))
+        return _rastreador
@@ -0,0 +1,536 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import weakref
+
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+
+from database import TIMEOUT_STATEMENT_MS, execucao_cancelavel, executar_query, expressao_balde, obter_catalogo
+from ingestao import obter_cache_ingestao
+from rastreamento import etapa
+
+# Agregados diários e mensais (soma das medidas por dia/mês e por dimensão) das tabelas de
+# fatos, guardados em um SQLite local e atualizados pela marca d'água da coluna de data
+PASTA_ROLLUPS = os.getenv(
+    'AGENTE_ROLLUPS', os.path.join(os.path.expanduser('~'), '.cache', 'agente', 'rollups'))
+USAR_ROLLUPS = os.getenv('AGENTE_USAR_ROLLUPS', '1') != '0'
+TTL_ROLLUPS = 300
+MAX_DIMENSOES = 4
+MAX_MEDIDAS = 8
+# Dimensões com mais valores que isso deixariam o agregado quase do tamanho da tabela
+MAX_DISTINTOS_DIMENSAO = 5000
+TAMANHO_LOTE_ROLLUP = 10_000
+
+_COLUNA = r'(?:\w+\.)?"?(?P<col>\w+)"?'
+_APELIDO = r'(?:\s+(?:as\s+)?"?(?P<alias>\w+)"?)?'
+# Expressões de data reconhecidas: (regex, balde, formato do resultado)
+_EXPRESSOES_DATA = [
+    (rf"date_trunc\(\s*'(?P<balde>day|month)'\s*,\s*{_COLUNA}\s*\)", None, 'data'),
+    (rf"date\(\s*{_COLUNA}\s*\)", 'dia', 'data'),
+    (rf"date\(\s*{_COLUNA}\s*,\s*'start of month'\s*\)", 'mes', 'data'),
+    (rf"strftime\(\s*'%Y-%m-%d'\s*,\s*{_COLUNA}\s*\)", 'dia', 'data'),
+    (rf"strftime\(\s*'%Y-%m'\s*,\s*{_COLUNA}\s*\)", 'mes', 'ano_mes'),
+    (rf"to_char\(\s*{_COLUNA}\s*,\s*'YYYY-MM'\s*\)", 'mes', 'ano_mes'),
+    (rf"cast\(\s*{_COLUNA}\s+as\s+date\s*\)", 'dia', 'data'),
+    (rf"{_COLUNA}\s*::\s*date", 'dia', 'data'),
+]
+_CONSULTA = re.compile(
+    r'^\s*select\s+(?P<itens>.+?)\s+from\s+(?P<tabela>[\w."]+)(?:\s+(?:as\s+)?(?!where\b|group\b)\w+)?'
+    r'(?:\s+where\s+(?P<filtro>.+?))?\s+group\s+by\s+(?P<grupo>.+?)'
+    r'(?:\s+order\s+by\s+(?P<ordem>.+?))?(?:\s+limit\s+(?P<limite>\d+))?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL)
+_LITERAL = r"'(?:[^']|'')*'|-?\d+(?:\.\d+)?"
+
+def _dividir(texto, separador=','):
+    """Divide `texto` no separador fora de parênteses e aspas"""
+    partes, nivel, aspas, inicio = [], 0, False, 0
+    for i, caractere in enumerate(texto):
+        if caractere == "'":
+            aspas = not aspas
+        elif not aspas and caractere == '(':
+            nivel += 1
+        elif not aspas and caractere == ')':
+            nivel -= 1
+        elif not aspas and nivel == 0 and caractere == separador:
+            partes.append(texto[inicio:i].strip())
+            inicio = i + 1
+    partes.append(texto[inicio:].strip())
+    return partes
+
+def _valor_literal(literal):
+    if literal.startswith("'"):
+        return literal[1:-1].replace("''", "'")
+    return float(literal) if '.' in literal else int(literal)
+
+def _sql_literal(valor):
+    if isinstance(valor, (int, float)):
+        return repr(valor)
+    return "'" + str(valor).replace("'", "''") + "'"
+
+def _normalizar_expr(expr):
+    return re.sub(r'\s+', '', expr).lower()
+
+def _analisar_item(texto):
+    for padrao, balde, formato in _EXPRESSOES_DATA:
+        m = re.fullmatch(padrao + _APELIDO, texto, re.IGNORECASE | re.DOTALL)
+        if m:
+            balde = balde or {'day': 'dia', 'month': 'mes'}[m.group('balde').lower()]
+            return {'tipo': 'data', 'col': m.group('col'), 'balde': balde, 'formato': formato,
+                    'alias': m.group('alias'),
+                    'expr': re.sub(r'\s+(?:as\s+)?"?\w+"?$', '', texto, flags=re.IGNORECASE)
+                    if m.group('alias') else texto}
+    m = re.fullmatch(rf"sum\(\s*{_COLUNA}\s*\){_APELIDO}", texto, re.IGNORECASE)
+    if m:
+        return {'tipo': 'soma', 'col': m.group('col'), 'alias': m.group('alias')}
+    m = re.fullmatch(rf"count\(\s*\*\s*\){_APELIDO}", texto, re.IGNORECASE)
+    if m:
+        return {'tipo': 'contagem', 'col': None, 'alias': m.group('alias')}
+    m = re.fullmatch(rf"{_COLUNA}{_APELIDO}", texto, re.IGNORECASE)
+    if m:
+        return {'tipo': 'dimensao', 'col': m.group('col'), 'alias': m.group('alias') or m.group('col')}
+    return None
+
+def _resolver(referencia, itens):
+    """Item do SELECT citado em GROUP BY / ORDER BY por posição, apelido ou expressão"""
+    referencia = referencia.strip()
+    if referencia.isdigit():
+        posicao = int(referencia) - 1
+        return itens[posicao] if 0 <= posicao < len(itens) else None
+    for item in itens:
+        if item['alias'] and referencia.strip('"').lower() == item['alias'].lower():
+            return item
+        if item['tipo'] == 'data' and _normalizar_expr(referencia) == _normalizar_expr(item['expr']):
+            return item
+        if item['tipo'] == 'dimensao' and referencia.strip('"').lower() == item['col'].lower():
+            return item
+    return None
+
+def analisar_consulta(query):
+    """Estrutura da consulta se ela tiver a forma "soma por período (e dimensão)"; senão None.
+
+    Forma aceita: SELECT <data truncada>, [dimensão,] SUM(medida)... / COUNT(*) FROM tabela
+    [WHERE dimensão = literal | dimensão IN (...) [AND ...]] GROUP BY ... [ORDER BY ...] [LIMIT n].
+    Expressões diferentes de SUM/COUNT(*) precisam de apelido (o nome da coluna varia por banco).
+    """
+    m = _CONSULTA.match(query)
+    if not m:
+        return None
+    itens = [_analisar_item(parte) for parte in _dividir(m.group('itens'))]
+    if any(item is None for item in itens):
+        return None
+    datas = [item for item in itens if item['tipo'] == 'data']
+    dimensoes = [item for item in itens if item['tipo'] == 'dimensao']
+    somas = [item for item in itens if item['tipo'] in ('soma', 'contagem')]
+    if len(datas) != 1 or len(dimensoes) > 1 or not somas or any(item['alias'] is None for item in itens):
+        return None
+
+    filtros = {}
+    if m.group('filtro'):
+        if re.search(r'\bor\b|\bnot\b', m.group('filtro'), re.IGNORECASE):
+            return None
+        for condicao in re.split(r'\s+and\s+', m.group('filtro').strip(), flags=re.IGNORECASE):
+            condicao = condicao.strip()
+            igual = re.fullmatch(rf"{_COLUNA}\s*=\s*(?P<lit>{_LITERAL})", condicao, re.IGNORECASE)
+            lista = re.fullmatch(rf"{_COLUNA}\s+in\s*\((?P<lits>[^)]*)\)", condicao, re.IGNORECASE)
+            if igual:
+                filtros.setdefault(igual.group('col'), []).append(_valor_literal(igual.group('lit')))
+            elif lista and all(re.fullmatch(_LITERAL, v.strip()) for v in _dividir(lista.group('lits'))):
+                filtros.setdefault(lista.group('col'), []).extend(
+                    _valor_literal(v.strip()) for v in _dividir(lista.group('lits')))
+            else:
+                return None
+    # Um agregado por dimensão: filtro e dimensão selecionada precisam ser a mesma coluna
+    colunas_dimensao = {c.lower() for c in filtros} | {item['col'].lower() for item in dimensoes}
+    if len(colunas_dimensao) > 1:
+        return None
+
+    grupo = [_resolver(parte, itens) for parte in _dividir(m.group('grupo'))]
+    if any(item is None for item in grupo) or {id(i) for i in grupo} != {id(i) for i in datas + dimensoes}:
+        return None
+    ordem = []
+    if m.group('ordem'):
+        for parte in _dividir(m.group('ordem')):
+            direcao = re.fullmatch(r'(?P<ref>.+?)(?:\s+(?P<dir>asc|desc))?', parte.strip(), re.IGNORECASE)
+            item = _resolver(direcao.group('ref'), itens)
+            if item is None:
+                return None
+            ordem.append((item['alias'], (direcao.group('dir') or 'asc').lower() == 'asc'))
+    return {
+        'tabela': m.group('tabela').replace('"', '').split('.')[-1],
+        'tabela_texto': m.group('tabela'),
+        'itens': itens,
+        'data': datas[0],
+        'dimensao': (dimensoes[0]['col'] if dimensoes else next(iter(filtros), None)),
+        'dimensao_item': dimensoes[0] if dimensoes else None,
+        'filtros': filtros,
+        'itens_texto': m.group('itens'),
+        'filtro_texto': m.group('filtro'),
+        'grupo_texto': m.group('grupo'),
+        'ordem': ordem,
+        'limite': int(m.group('limite')) if m.group('limite') else None,
+    }
+
+def _dia(valor):
+    return str(valor)[:10]
+
+def _inicio_mes(valor):
+    return str(valor)[:7] + '-01'
+
+class Rollups:
+    """Agregados das tabelas de um engine em um SQLite local (`caminho`).
+
+    Para cada tabela com coluna de data e medidas (segundo o perfil), mantém uma tabela diária
+    e uma mensal sem dimensão e uma de cada por dimensão categórica. A atualização relê apenas
+    as linhas a partir do dia da marca d'água (a maior data já agregada). Consultas com a forma
+    de `analisar_consulta` são respondidas pelos agregados até a marca, somados às linhas mais
+    recentes lidas da tabela original, então o resultado não depende da idade do agregado.
+    Com `imutavel` (planilhas do cache de ingestão) a origem nunca muda: os agregados
+    respondem sozinhos e não são atualizados depois de construídos.
+    """
+
+    def __init__(self, engine, caminho, ttl=TTL_ROLLUPS, imutavel=False):
+        self._engine = weakref.ref(engine)
+        self.caminho = caminho
+        self.ttl = None if imutavel else ttl
+        self.imutavel = imutavel
+        self._lock = threading.Lock()
+        self._thread = None
+        # Tabelas a atualizar: só as que já tiveram uma consulta reconhecida por `analisar_consulta`
+        self._pendentes = set()
+        self.estatisticas = {'consultas_respondidas': 0, 'atualizacoes': 0, 'linhas_agregadas': 0, 'erros': 0,
+                             'ultimo_erro': None}
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self.destino = create_engine(f'sqlite:///{caminho}', connect_args={'check_same_thread': False})
+
+        @event.listens_for(self.destino, 'connect')
+        def _configurar(dbapi_connection, connection_record):
+            # WAL: consultas continuam lendo enquanto a atualização grava
+            dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+        with self.destino.begin() as conn:
+            conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS _rollups (tabela TEXT PRIMARY KEY, definicao TEXT, marca TEXT, '
+                'atualizado_em REAL)'))
+            self._estado = {tabela: {'definicao': json.loads(definicao), 'marca': marca, 'atualizado_em': 0.0}
+                            for tabela, definicao, marca, _ in conn.execute(text('SELECT * FROM _rollups'))}
+
+    @property
+    def engine(self):
+        return self._engine()
+
+    @staticmethod
+    def nome_tabela(tabela, dimensao, balde):
+        chave = hashlib.sha256(f'{tabela}|{dimensao or ""}'.encode('utf-8')).hexdigest()[:12]
+        return f'r_{chave}_{balde}'
+
+    @staticmethod
+    def definicao(perfil):
+        """Coluna de data, dimensões e medidas agregadas da tabela, ou None se ela não servir"""
+        if not perfil or not perfil.get('coluna_data'):
+            return None
+        colunas = perfil['colunas']
+        medidas = [nome for nome, e in colunas.items() if e['papel'] == 'medida'][:MAX_MEDIDAS]
+        dimensoes = [nome for nome, e in colunas.items() if e['papel'] == 'categoria'
+                     and (e.get('distintos') or 0) <= MAX_DISTINTOS_DIMENSAO][:MAX_DIMENSOES]
+        if not medidas:
+            return None
+        return {'coluna_data': perfil['coluna_data'], 'dimensoes': dimensoes, 'medidas': medidas,
+                'assinatura': list(perfil['assinatura'])}
+
+    def _criar_tabelas(self, conn, tabela, definicao, tipos):
+        medidas = ''.join(f', "{m}" NUMERIC' for m in definicao['medidas'])
+        for dimensao in [None] + definicao['dimensoes']:
+            coluna = f', "{dimensao}" {tipos.get(dimensao, "")}' if dimensao else ''
+            for balde in ('dia', 'mes'):
+                nome = self.nome_tabela(tabela, dimensao, balde)
+                conn.execute(text(f'DROP TABLE IF EXISTS {nome}'))
+                conn.execute(text(f'CREATE TABLE {nome} (periodo TEXT{coluna}{medidas}, linhas INTEGER)'))
+                indice = f'"{dimensao}", periodo' if dimensao else 'periodo'
+                conn.execute(text(f'CREATE INDEX {nome}_idx ON {nome} ({indice})'))
+
+    def _ler_origem(self, tabela, definicao, dimensao, corte, marca):
+        """Linhas (periodo, [dimensão,] somas..., linhas) por dia, lidas da tabela original"""
+        engine = self.engine
+        preparador = engine.dialect.identifier_preparer
+        data = preparador.quote(definicao['coluna_data'])
+        colunas = [f"{expressao_balde(engine, definicao['coluna_data'], 'dia')} AS periodo"]
+        if dimensao:
+            colunas.append(preparador.quote(dimensao))
+        colunas += [f'SUM({preparador.quote(m)})' for m in definicao['medidas']] + ['COUNT(*)']
+        filtro = f'{data} <= :marca' + (f' AND {data} >= :corte' if corte else '')
+        grupo = '1, 2' if dimensao else '1'
+        consulta = (f"SELECT {', '.join(colunas)} FROM {preparador.quote(tabela)} WHERE {filtro} "
+                    f"GROUP BY {grupo}")
+        # Mesmo prazo das consultas das perguntas
+        with engine.connect() as conn, execucao_cancelavel(engine, conn, TIMEOUT_STATEMENT_MS):
+            resultado = conn.execute(text(consulta), {'marca': marca, 'corte': corte})
+            for linhas in resultado.partitions(TAMANHO_LOTE_ROLLUP):
+                yield [(_dia(linha[0]),) + tuple(linha[1:]) for linha in linhas]
+
+    def _atualizar_tabela(self, tabela, perfil):
+        definicao = self.definicao(perfil)
+        if definicao is None:
+            return
+        estado = self._estado.get(tabela)
+        reconstruir = estado is None or estado['definicao'] != definicao
+        engine = self.engine
+        coluna = engine.dialect.identifier_preparer.quote(definicao['coluna_data'])
+        with engine.connect() as conn, execucao_cancelavel(engine, conn, TIMEOUT_STATEMENT_MS):
+            marca = conn.execute(text(f'SELECT MAX({coluna}) FROM {engine.dialect.identifier_preparer.quote(tabela)}')).scalar()
+        if marca is None:
+            return
+        marca = str(marca)
+        if not reconstruir and (marca == estado['marca'] or self.imutavel):
+            estado['atualizado_em'] = time.monotonic()
+            return
+        corte = None if reconstruir else _dia(estado['marca'])
+        tipos = {col['name']: str(col['type']) for col in obter_catalogo(engine).colunas(tabela)}
+        lidas = 0
+        with self.destino.begin() as destino:
+            if reconstruir:
+                if estado is not None:
+                    for dimensao in [None] + estado['definicao']['dimensoes']:
+                        for balde in ('dia', 'mes'):
+                            destino.execute(text(f'DROP TABLE IF EXISTS {self.nome_tabela(tabela, dimensao, balde)}'))
+                self._criar_tabelas(destino, tabela, definicao, tipos)
+            for dimensao in [None] + definicao['dimensoes']:
+                diaria = self.nome_tabela(tabela, dimensao, 'dia')
+                mensal = self.nome_tabela(tabela, dimensao, 'mes')
+                colunas = ['periodo'] + ([f'"{dimensao}"'] if dimensao else []) + [
+                    f'"{m}"' for m in definicao['medidas']] + ['linhas']
+                if corte:
+                    destino.execute(text(f'DELETE FROM {diaria} WHERE periodo >= :corte'), {'corte': corte})
+                marcadores = ', '.join(f':p{i}' for i in range(len(colunas)))
+                for lote in self._ler_origem(tabela, definicao, dimensao, corte, marca):
+                    destino.execute(text(f"INSERT INTO {diaria} ({', '.join(colunas)}) VALUES ({marcadores})"),
+                                    [{f'p{i}': v for i, v in enumerate(linha)} for linha in lote])
+                    lidas += len(lote)
+                # O mensal é refeito a partir do diário, só nos meses tocados
+                inicio_mes = _inicio_mes(corte) if corte else '0000-00-00'
+                destino.execute(text(f'DELETE FROM {mensal} WHERE periodo >= :inicio'), {'inicio': inicio_mes})
+                somas = ', '.join(['SUM(' + c + ')' for c in colunas[1 + bool(dimensao):]])
+                chaves = "date(periodo, 'start of month')" + (f', "{dimensao}"' if dimensao else '')
+                destino.execute(text(
+                    f"INSERT INTO {mensal} ({', '.join(colunas)}) SELECT {chaves}, {somas} FROM {diaria} "
+                    f"WHERE periodo >= :inicio GROUP BY {'1, 2' if dimensao else '1'}"), {'inicio': inicio_mes})
+            destino.execute(text('INSERT OR REPLACE INTO _rollups VALUES (:tabela, :definicao, :marca, :agora)'),
+                            {'tabela': tabela, 'definicao': json.dumps(definicao), 'marca': marca,
+                             'agora': time.time()})
+        self._estado[tabela] = {'definicao': definicao, 'marca': marca, 'atualizado_em': time.monotonic()}
+        self.estatisticas['atualizacoes'] += 1
+        self.estatisticas['linhas_agregadas'] += lidas
+
+    def _atualizar_pendentes(self):
+        catalogo = obter_catalogo(self.engine)
+        while True:
+            with self._lock:
+                if not self._pendentes:
+                    self._thread = None
+                    return
+                tabela = self._pendentes.pop()
+            try:
+                self._atualizar_tabela(tabela, catalogo.perfil(tabela))
+            except Exception as e:
+                # Sem agregado atualizado as consultas continuam indo à tabela original
+                self.estatisticas['erros'] += 1
+                self.estatisticas['ultimo_erro'] = f'{tabela}: {e}'
+
+    def atualizar(self, tabelas=None, bloquear=False):
+        """Atualiza em uma thread (uma por vez) os agregados das tabelas; com `bloquear`, espera terminar.
+
+        Sem `tabelas`, só os agregados que já existem: os de uma tabela nova são montados
+        quando uma consulta sobre ela é reconhecida (`responder`).
+        """
+        with self._lock:
+            self._pendentes.update(tabelas if tabelas is not None else self._estado)
+            if self._thread is None and self._pendentes:
+                self._thread = threading.Thread(target=self._atualizar_pendentes, name='rollups', daemon=True)
+                self._thread.start()
+            thread = self._thread
+        if bloquear and thread is not None:
+            thread.join()
+
+    def _consulta_agregado(self, analise, estado):
+        """SQL sobre os agregados e o dia a partir do qual ler a origem (None: nada a ler)"""
+        definicao, dimensao, data = estado['definicao'], analise['dimensao'], analise['data']
+        # Origem imutável: o agregado já contém todas as linhas, inclusive as do dia da marca
+        corte_dia = '9999-12-31' if self.imutavel else _dia(estado['marca'])
+        colunas = ['periodo'] + ([f'"{dimensao}"'] if dimensao else []) + [
+            f'"{m}"' for m in definicao['medidas']] + ['linhas']
+        diaria = self.nome_tabela(analise['tabela'], dimensao, 'dia')
+        if data['balde'] == 'dia':
+            origem = f"SELECT {', '.join(colunas)} FROM {diaria} WHERE periodo < {_sql_literal(corte_dia)}"
+            corte = corte_dia
+        else:
+            # Meses fechados do mensal, o mês corrente a partir do diário e o resto da origem
+            corte = _inicio_mes(corte_dia)
+            mensal = self.nome_tabela(analise['tabela'], dimensao, 'mes')
+            do_diario = ["date(periodo, 'start of month')"] + colunas[1:]
+            origem = (f"SELECT {', '.join(colunas)} FROM {mensal} WHERE periodo < {_sql_literal(corte)} "
+                      f"UNION ALL SELECT {', '.join(do_diario)} FROM {diaria} "
+                      f"WHERE periodo >= {_sql_literal(corte)} AND periodo < {_sql_literal(corte_dia)}")
+            corte = corte_dia
+        corte = None if self.imutavel else corte
+        periodo = 'substr(periodo, 1, 7)' if data['formato'] == 'ano_mes' else 'periodo'
+        medidas = {m.lower(): m for m in definicao['medidas']}
+        # Mesma ordem de colunas da consulta original
+        selecao, grupo = [], []
+        for posicao, item in enumerate(analise['itens'], start=1):
+            if item['tipo'] == 'data':
+                selecao.append(f'{periodo} AS "{item["alias"]}"')
+                grupo.append(str(posicao))
+            elif item['tipo'] == 'dimensao':
+                selecao.append(f'"{dimensao}" AS "{item["alias"]}"')
+                grupo.append(str(posicao))
+            elif item['tipo'] == 'soma':
+                selecao.append(f'SUM("{medidas[item["col"].lower()]}") AS "{item["alias"]}"')
+            else:
+                selecao.append(f'SUM(linhas) AS "{item["alias"]}"')
+        filtros = [f'"{dimensao}" IN ({", ".join(_sql_literal(v) for v in valores)})'
+                   for valores in analise['filtros'].values()]
+        grupo = ', '.join(grupo)
+        consulta = (f"SELECT {', '.join(selecao)} FROM ({origem}) AS agregado"
+                    f"{' WHERE ' + ' AND '.join(filtros) if filtros else ''} GROUP BY {grupo}")
+        return consulta, corte
+
+    def responder(self, query, max_linhas=None):
+        """Resultado da consulta a partir dos agregados, ou None se ela não puder ser atendida por eles"""
+        analise = analisar_consulta(query)
+        if analise is None:
+            return None
+        estado = self._estado.get(analise['tabela'])
+        if estado is None or (self.ttl is not None and time.monotonic() - estado['atualizado_em'] > self.ttl):
+            # Agregado ausente ou antigo: monta/atualiza o desta tabela em segundo plano; o antigo continua correto
+            self.atualizar([analise['tabela']])
+        if estado is None:
+            return None
+        definicao = estado['definicao']
+        dimensoes = {d.lower(): d for d in definicao['dimensoes']}
+        medidas = {m.lower() for m in definicao['medidas']}
+        if analise['data']['col'].lower() != definicao['coluna_data'].lower():
+            return None
+        if analise['dimensao'] is not None:
+            if analise['dimensao'].lower() not in dimensoes:
+                return None
+            analise['dimensao'] = dimensoes[analise['dimensao'].lower()]
+        if any(item['tipo'] == 'soma' and item['col'].lower() not in medidas for item in analise['itens']):
+            return None
+
+        with etapa('rollup', tabela=analise['tabela'], balde=analise['data']['balde']) as span:
+            consulta, corte = self._consulta_agregado(analise, estado)
+            agregado = executar_query(self.destino, consulta, max_linhas=None, max_bytes=None,
+                                      usar_rollups=False)
+            recentes = agregado.iloc[:0]
+            if corte is not None:
+                # Linhas a partir do corte vêm da tabela original, com a consulta original restrita
+                data = self.engine.dialect.identifier_preparer.quote(definicao['coluna_data'])
+                recentes = executar_query(self.engine, consulta_a_partir(analise, data, corte),
+                                          max_linhas=None, max_bytes=None, usar_rollups=False)
+            span.update(linhas_agregado=len(agregado), linhas_recentes=len(recentes))
+
+        df = combinar(analise, agregado, recentes, self.engine.dialect.name != 'sqlite')
+        self.estatisticas['consultas_respondidas'] += 1
+        truncado = max_linhas is not None and len(df) > max_linhas
+        if truncado:
+            df = df.iloc[:max_linhas]
+        df.attrs['truncado'] = truncado
+        df.attrs['rollup'] = self.nome_tabela(analise['tabela'], analise['dimensao'], analise['data']['balde'])
+        return df
+
+def consulta_a_partir(analise, coluna_data, corte):
+    """A consulta analisada restrita às linhas com `coluna_data` (já entre aspas) >= `corte`, sem ORDER/LIMIT"""
+    filtro = f"({analise['filtro_texto']}) AND " if analise['filtro_texto'] else ''
+    return (f"SELECT {analise['itens_texto']} FROM {analise['tabela_texto']} "
+            f"WHERE {filtro}{coluna_data} >= {_sql_literal(corte)} GROUP BY {analise['grupo_texto']}")
+
+def alinhar_colunas(df, colunas):
+    """`df` com as colunas de `colunas`, casadas pelo nome sem diferenciar maiúsculas.
+
+    O PostgreSQL devolve apelidos sem aspas em minúsculas. ValueError se os conjuntos diferirem.
+    """
+    nomes = {str(c).lower(): c for c in df.columns}
+    if len(nomes) != len(df.columns) or set(nomes) != {str(c).lower() for c in colunas}:
+        raise ValueError(f"Colunas diferentes: {list(df.columns)} e {list(colunas)}")
+    return df.rename(columns={nomes[str(c).lower()]: c for c in colunas})[list(colunas)]
+
+def combinar(analise, agregado, recentes, datas_como_objetos):
+    """Soma `recentes` a `agregado` por período (e dimensão) e aplica o ORDER BY e o LIMIT da consulta"""
+    chaves = [analise['data']['alias']] + ([analise['dimensao_item']['alias']] if analise['dimensao_item'] else [])
+    valores = [item['alias'] for item in analise['itens'] if item['tipo'] in ('soma', 'contagem')]
+    if datas_como_objetos and analise['data']['formato'] == 'data':
+        # O PostgreSQL devolve datas como objetos; o agregado guarda texto 'AAAA-MM-DD'
+        agregado[chaves[0]] = pd.to_datetime(agregado[chaves[0]])
+    if len(recentes):
+        recentes = alinhar_colunas(recentes, agregado.columns)
+        df = pd.concat([agregado, recentes], ignore_index=True)
+        df = df.groupby(chaves, dropna=False, sort=False)[valores].sum(min_count=1).reset_index()
+        df = df[list(agregado.columns)]
+    else:
+        df = agregado
+    if analise['ordem']:
+        df = df.sort_values([c for c, _ in analise['ordem']], ascending=[a for _, a in analise['ordem']],
+                            kind='stable')
+    else:
+        df = df.sort_values(chaves, kind='stable')
+    if analise['limite'] is not None:
+        df = df.iloc[:analise['limite']]
+    return df.reset_index(drop=True)
+
+def _arquivo_sqlite(url):
+    """Caminho do arquivo de um banco SQLite (inclusive em URI `file:...?uri=true`); None em memória"""
+    banco = url.database or ''
+    if url.query.get('uri') == 'true' and banco.startswith('file:'):
+        if url.query.get('mode') == 'memory':
+            return None
+        banco = banco[len('file:'):]
+    if not banco or banco == ':memory:' or banco.startswith('file:') or 'mode=memory' in banco:
+        return None
+    return os.path.abspath(banco)
+
+def _imutavel(engine):
+    """Planilhas do cache de ingestão: arquivos nomeados pelo hash do conteúdo, nunca alterados"""
+    banco = _arquivo_sqlite(engine.url) if engine.url.get_backend_name() == 'sqlite' else None
+    return banco is not None and os.path.dirname(banco) == os.path.abspath(obter_cache_ingestao().pasta)
+
+def _identidade(engine):
+    """Identifica o banco de forma estável entre execuções; None para bancos em memória"""
+    url = engine.url
+    if url.get_backend_name() == 'sqlite':
+        banco = _arquivo_sqlite(url)
+        return 'sqlite:' + banco if banco else None
+    return url.render_as_string(hide_password=True)
+
+_rollups = weakref.WeakKeyDictionary()
+_rollups_lock = threading.Lock()
+
+def obter_rollups(engine):
+    """Agregados associados ao engine, ou None se desativados ou se o banco não tiver identidade estável"""
+    if not USAR_ROLLUPS:
+        return None
+    with _rollups_lock:
+        if engine not in _rollups:
+            identidade = _identidade(engine)
+            caminho = None
+            if identidade is not None:
+                nome = hashlib.sha256(identidade.encode('utf-8')).hexdigest()[:24]
+                caminho = os.path.join(PASTA_ROLLUPS, nome + '.sqlite')
+            _rollups[engine] = Rollups(engine, caminho, imutavel=_imutavel(engine)) if caminho else None
+        return _rollups[engine]
+
+def responder_com_rollup(engine, query, max_linhas=None):
+    """Usado por `database.executar_query`: resposta pelos agregados ou None"""
+    if not re.search(r'\bgroup\s+by\b', query, re.IGNORECASE):
+        return None
+    rollups = obter_rollups(engine)
+    if rollups is None:
+        return None
+    try:
+        return rollups.responder(query, max_linhas)
+    except Exception:
+        # Qualquer falha no caminho dos agregados cai na consulta original
+        rollups.estatisticas['erros'] += 1
+        return None
@@ -0,0 +1,121 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+from database import LIMITE_LINHAS_PADRAO, executar_query, normalizar_select, obter_catalogo
+from rastreamento import etapa
+from rollups import alinhar_colunas, analisar_consulta, combinar, consulta_a_partir
+
+# Séries usadas nas previsões, guardadas com a marca d'água (último período lido). Na
+# pergunta seguinte só as linhas a partir do último período voltam do banco.
+MAX_SERIES = 32
+# Depois deste tempo a série é lida por inteiro de novo (linhas antigas alteradas no banco)
+TTL_SERIE_COMPLETA = 3600
+
+def _periodos(valores, formato):
+    """Período de cada linha como texto comparável ('AAAA-MM-DD' ou 'AAAA-MM')"""
+    return valores.astype('string').str[:10 if formato == 'data' else 7]
+
+class SeriesIncrementais:
+    """Resultados de consultas "soma por período" (veja `rollups.analisar_consulta`) de um engine.
+
+    A primeira leitura traz a série completa; as seguintes leem só o último período guardado
+    (que pode ter ficado incompleto) e os posteriores, e os juntam às linhas anteriores
+    guardadas. Supõe que as linhas antigas não mudam; `ttl` limita quanto tempo isso vale.
+    """
+
+    def __init__(self, engine, max_series=MAX_SERIES, ttl=TTL_SERIE_COMPLETA):
+        self.engine = engine
+        self.max_series = max_series
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._series = OrderedDict()
+        self.estatisticas = {'completas': 0, 'incrementais': 0, 'linhas_novas': 0}
+
+    def _coluna_data(self, analise):
+        colunas = obter_catalogo(self.engine).schemas().get(analise['tabela'], [])
+        nomes = {col['name'].lower(): col['name'] for col in colunas}
+        coluna = nomes.get(analise['data']['col'].lower(), analise['data']['col'])
+        return self.engine.dialect.identifier_preparer.quote(coluna)
+
+    def _guardar(self, chave, entrada):
+        with self._lock:
+            self._series[chave] = entrada
+            self._series.move_to_end(chave)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+
+    def _ler_completa(self, chave, sql, analise, max_linhas):
+        with etapa('serie_completa') as span:
+            df = executar_query(self.engine, sql, max_linhas=max_linhas)
+            span['linhas'] = len(df)
+        self.estatisticas['completas'] += 1
+        if analise['limite'] is None and not df.attrs.get('truncado'):
+            self._guardar(chave, {'df': df, 'analise': analise, 'lida_em': time.monotonic()})
+        return df.copy()
+
+    def obter(self, query, max_linhas=LIMITE_LINHAS_PADRAO):
+        """Resultado da consulta, lido do banco só a partir da marca d'água quando a série já foi lida.
+
+        `df.attrs['incremental']` traz a marca usada e quantas linhas vieram do banco.
+        """
+        sql = normalizar_select(query)
+        analise = analisar_consulta(sql)
+        if analise is None:
+            return executar_query(self.engine, sql, max_linhas=max_linhas)
+        chave = f"{obter_catalogo(self.engine).versao()}|{' '.join(sql.split())}"
+        with self._lock:
+            entrada = self._series.get(chave)
+            if entrada is not None:
+                self._series.move_to_end(chave)
+        if entrada is None or time.monotonic() - entrada['lida_em'] > self.ttl:
+            return self._ler_completa(chave, sql, analise, max_linhas)
+
+        anterior = entrada['df']
+        data = analise['data']
+        periodos = _periodos(anterior[data['alias']], data['formato'])
+        marca = periodos.max()
+        if marca is None or marca != marca:
+            return self._ler_completa(chave, sql, analise, max_linhas)
+        corte = marca if data['formato'] == 'data' else marca + '-01'
+        with etapa('serie_incremental', marca=marca) as span:
+            novas = executar_query(self.engine, consulta_a_partir(analise, self._coluna_data(analise), corte),
+                                   max_linhas=None, max_bytes=None)
+            span['linhas_novas'] = len(novas)
+        # Períodos anteriores à marca continuam valendo; linhas sem data ficam como na leitura completa
+        mantidas = anterior[(periodos < marca).fillna(True).astype(bool)].reset_index(drop=True)
+        try:
+            novas = alinhar_colunas(novas, mantidas.columns)
+        except ValueError:
+            # Colunas guardadas diferentes das lidas agora: lê a série inteira de novo
+            return self._ler_completa(chave, sql, analise, max_linhas)
+        if pd.api.types.is_datetime64_any_dtype(mantidas[data['alias']]):
+            # Leitura completa respondida pelos agregados já converte as datas
+            novas[data['alias']] = pd.to_datetime(novas[data['alias']])
+        df = combinar(analise, mantidas, novas, datas_como_objetos=False)
+        df.attrs['truncado'] = False
+        self._guardar(chave, {'df': df, 'analise': analise, 'lida_em': entrada['lida_em']})
+        self.estatisticas['incrementais'] += 1
+        self.estatisticas['linhas_novas'] += len(novas)
+
+        resultado = df.copy()
+        if max_linhas is not None and len(resultado) > max_linhas:
+            resultado = resultado.iloc[:max_linhas]
+            resultado.attrs['truncado'] = True
+        resultado.attrs['incremental'] = {'marca': marca, 'linhas_novas': len(novas)}
+        return resultado
+
+_series = weakref.WeakKeyDictionary()
+_series_lock = threading.Lock()
+
+def obter_series(engine):
+    """Séries incrementais associadas ao engine, criando-as se necessário"""
+    with _series_lock:
+        series = _series.get(engine)
+        if series is None:
+            series = SeriesIncrementais(engine)
+            _series[engine] = series
+        return series
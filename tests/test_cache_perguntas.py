@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_perguntas import CachePerguntas
+
+PERGUNTA = 'Qual o total de vendas por mês do material 300000 em 2023?'
+SQL = "SELECT strftime('%Y-%m', data_venda) AS mes, SUM(valor) AS total FROM vendas WHERE material = 300000 GROUP BY 1"
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = CachePerguntas(str(tmp_path / 'perguntas.sqlite'))
+    cache.armazenar(PERGUNTA, 'v1', SQL)
+    cache.armazenar('Quais as vendas da loja Centro por mês?', 'v1', 'SELECT 2')
+    return cache
+
+@pytest.mark.parametrize('pergunta', [
+    'total das vendas por mes do material 300000 em 2023',
+    'Vendas por mês, total, material 300000, 2023',
+    'QUAL O TOTAL DE VENDAS POR MÊS DO MATERIAL 300000 EM 2023',
+])
+def test_pergunta_reformulada_acerta(cache, pergunta):
+    entrada = cache.buscar(pergunta, 'v1')
+    assert entrada is not None
+    assert entrada['sql'] == SQL
+    assert entrada['similaridade'] >= cache.similaridade_minima
+
+@pytest.mark.parametrize('pergunta', [
+    'Qual o total de vendas por mês do material 300001 em 2023?',
+    'Qual o total de vendas por mês do material 300000 em 2024?',
+    'Qual o total de vendas por mês do material 300000?',
+    'Quais as vendas da loja Norte por mês?',
+])
+def test_outro_valor_de_filtro_nao_acerta(cache, pergunta):
+    assert cache.buscar(pergunta, 'v1') is None
+
+def test_nova_versao_do_schema_invalida(cache):
+    assert cache.buscar(PERGUNTA, 'v2') is None
+    assert cache.buscar('total das vendas por mes do material 300000 em 2023', 'v2') is None
+    assert cache.buscar(PERGUNTA, 'v1')['sql'] == SQL
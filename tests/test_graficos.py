@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graficos import ROTULO_OUTROS, lttb, reduzir_serie, top_n_com_outros
+
+@pytest.mark.parametrize('n, limite', [(10_000, 2000), (5000, 3), (101, 100)])
+def test_lttb_mantem_extremos_e_tamanho(n, limite):
+    x = np.arange(n)
+    y = np.sin(x / 50) + np.random.default_rng(0).normal(0, 0.1, n)
+    indices = lttb(x, y, limite)
+    assert len(indices) == limite
+    assert indices[0] == 0 and indices[-1] == n - 1
+    assert np.all(np.diff(indices) > 0)
+
+def test_lttb_nao_reduz_serie_menor_que_o_limite():
+    assert list(lttb(np.arange(50), np.arange(50), 100)) == list(range(50))
+
+def test_lttb_mantem_pico():
+    y = np.zeros(10_000)
+    y[4321] = 100.0
+    assert 4321 in lttb(np.arange(10_000), y, 200)
+
+def test_reduzir_serie_com_datas():
+    df = pd.DataFrame({'data': pd.date_range('2020-01-01', periods=5000, freq='h'), 'valor': np.arange(5000.0)})
+    reduzida = reduzir_serie(df, 'data', 'valor', limite=500)
+    assert len(reduzida) == 500
+    assert reduzida['data'].iloc[0] == df['data'].iloc[0]
+    assert reduzida['data'].iloc[-1] == df['data'].iloc[-1]
+
+def test_top_n_com_outros_soma_as_categorias_descartadas():
+    df = pd.DataFrame({'material': [f'M{i}' for i in range(100)], 'valor': np.arange(100.0)})
+    resultado = top_n_com_outros(df, 'material', 'valor', limite=30)
+    assert len(resultado) == 30
+    assert resultado['material'].iloc[-1] == ROTULO_OUTROS
+    mantidas = resultado['material'].iloc[:-1]
+    assert set(mantidas) == {f'M{i}' for i in range(71, 100)}
+    descartadas = df.loc[~df['material'].isin(mantidas), 'valor'].sum()
+    assert resultado['valor'].iloc[-1] == descartadas
+    assert resultado['valor'].sum() == df['valor'].sum()
+
+def test_top_n_com_outros_agrupa_repetidas_sem_outros():
+    df = pd.DataFrame({'loja': ['A', 'B'] * 40, 'valor': 1.0})
+    resultado = top_n_com_outros(df, 'loja', 'valor', limite=30)
+    assert dict(zip(resultado['loja'], resultado['valor'])) == {'A': 40.0, 'B': 40.0}
@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.dados_sinteticos import gerar_vendas
+from database import ConsultaInterrompida, iterar_query
+from protecao_sql import LIMITE_AUTOMATICO, limite_final, proteger_sql
+
+@pytest.fixture
+def engine(tmp_path):
+    banco = tmp_path / 'vendas.sqlite'
+    with sqlite3.connect(banco) as conn:
+        gerar_vendas(5000, n_materiais=5).to_sql('vendas', conn, index=False)
+    return create_engine(f'sqlite:///{banco}')
+
+def test_consulta_agregada_fica_sem_limit(engine):
+    sql = proteger_sql(engine, "SELECT material, SUM(valor) AS valor FROM vendas GROUP BY material;")
+    assert limite_final(sql) is None
+    assert sql == "SELECT material, SUM(valor) AS valor FROM vendas GROUP BY material"
+
+def test_produto_cartesiano_recebe_limit(engine):
+    sql = proteger_sql(engine, "SELECT * FROM vendas a, vendas b, vendas c")
+    assert limite_final(sql) == LIMITE_AUTOMATICO == 10_000
+
+def test_produto_cartesiano_agregado_e_recusado(engine):
+    with pytest.raises(ValueError, match="Consulta recusada"):
+        proteger_sql(engine, "SELECT COUNT(*) FROM vendas a, vendas b, vendas c")
+
+@pytest.mark.parametrize('sql', [
+    "DELETE FROM vendas",
+    "SELECT * FROM vendas; DELETE FROM vendas",
+    "DROP TABLE vendas",
+])
+def test_apenas_um_select(engine, sql):
+    with pytest.raises(ValueError):
+        proteger_sql(engine, sql)
+
+def test_prazo_do_sqlite_interrompe_a_consulta(engine):
+    with pytest.raises(ConsultaInterrompida):
+        list(iterar_query(engine, "SELECT COUNT(*) FROM vendas a, vendas b, vendas c", timeout_ms=100))
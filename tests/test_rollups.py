@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.dados_sinteticos import gerar_vendas
+from database import executar_query, obter_catalogo
+from rollups import Rollups
+
+CONSULTAS = [
+    "SELECT material, date(data_venda) AS data, SUM(quantidade) AS quantidade FROM vendas "
+    "GROUP BY 1, 2 ORDER BY 2, 1",
+    "SELECT SUM(valor) AS valor, strftime('%Y-%m', data_venda) AS mes, COUNT(*) AS n FROM vendas "
+    "WHERE material IN (300000, 300001) GROUP BY mes ORDER BY mes",
+    "SELECT date(data_venda) AS data, material, SUM(quantidade) AS quantidade FROM vendas "
+    "WHERE material = 300002 GROUP BY 1, 2 ORDER BY 1",
+]
+
+@pytest.fixture
+def engine_com_rollups(tmp_path):
+    banco = tmp_path / 'vendas.sqlite'
+    vendas = gerar_vendas(5000, n_materiais=5, inicio='2023-01-01', fim='2023-06-30')
+    with sqlite3.connect(banco) as conn:
+        vendas.to_sql('vendas', conn, index=False)
+    engine = create_engine(f'sqlite:///{banco}')
+    rollups = Rollups(engine, str(tmp_path / 'rollups.sqlite'))
+    rollups.atualizar(['vendas'], bloquear=True)
+    # Linhas depois da marca d'água: vêm da tabela original e são somadas ao agregado
+    novas = gerar_vendas(500, n_materiais=5, inicio='2023-06-30', fim='2023-07-20', seed=7)
+    with sqlite3.connect(banco) as conn:
+        novas.to_sql('vendas', conn, index=False, if_exists='append')
+    obter_catalogo(engine).invalidar()
+    return engine, rollups
+
+@pytest.mark.parametrize('consulta', CONSULTAS)
+def test_rollup_igual_a_consulta_original_apos_a_marca(engine_com_rollups, consulta):
+    engine, rollups = engine_com_rollups
+    resposta = rollups.responder(consulta)
+    assert resposta is not None
+    original = executar_query(engine, consulta, usar_rollups=False)
+    assert list(resposta.columns) == list(original.columns)
+    pd.testing.assert_frame_equal(resposta, original, check_dtype=False)
+
+def test_agregado_montado_so_na_primeira_consulta_reconhecida(tmp_path):
+    banco = tmp_path / 'vendas.sqlite'
+    with sqlite3.connect(banco) as conn:
+        gerar_vendas(2000, n_materiais=3).to_sql('vendas', conn, index=False)
+        gerar_vendas(2000, n_materiais=3, seed=3).to_sql('outras', conn, index=False)
+    engine = create_engine(f'sqlite:///{banco}')
+    rollups = Rollups(engine, str(tmp_path / 'rollups.sqlite'))
+    # Sem consultas ainda: nenhuma tabela é varrida
+    rollups.atualizar(bloquear=True)
+    assert rollups.estatisticas['atualizacoes'] == 0
+    assert rollups.responder(CONSULTAS[0]) is None
+    rollups.atualizar(bloquear=True)
+    assert rollups.estatisticas['atualizacoes'] == 1
+    assert rollups.responder(CONSULTAS[0]) is not None